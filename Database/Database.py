@@ -1,14 +1,34 @@
 from pony.orm import *
-import sys
+from contextvars import ContextVar
+from Database.migrations import migrate
+from Database.sqlite_profile import apply_profile
+from Database.storage import storage
 from datetime import *
 
-db = pony.orm.Database()
+# Contador de consultas de la petición en curso (ver connection/request_scope.py)
+query_counter = ContextVar("query_counter", default=None)
 
 
-if "pytest" in sys.modules or "unittest" in sys.modules:
-    db.bind(provider="sqlite", filename=":sharedmemory:")
-else:
-    db.bind(provider="sqlite", filename="lacosa.sqlite", create_db=True)
+class _CountingDatabase(pony.orm.Database):
+    def _exec_sql(self, *args, **kwargs):
+        counter = query_counter.get()
+        if counter is not None:
+            counter.queries += 1
+        return super()._exec_sql(*args, **kwargs)
+
+
+db = _CountingDatabase()
+
+
+@db.on_connect(provider="sqlite")
+def _sqlite_profile(db, connection):
+    apply_profile(connection)
+
+
+# Dónde se guardan las partidas: ver Database/storage.py
+if storage.sqlite_file is not None:
+    migrate(storage.sqlite_file)
+db.bind(provider=storage.provider, **storage.bind_kwargs)
 
 
 class Match(db.Entity):
@@ -18,11 +38,14 @@ class Match(db.Entity):
     min_players = Required(int)
     max_players = Required(int)
     players = Set("Player")
+    player_count = Optional(int, default=0)
+    alive_count = Optional(int, default=0)
     initiated = Optional(bool, default=False)
     clockwise = Optional(bool, default=True)
     current_player = Required(int, default=0)
-    deck = Set("Deck")
-    top_card = Optional(int, default=None, nullable=True)
+    cards = Set("MatchCard")
+    seed = Optional(int, default=None, nullable=True)  # RNG de la partida
+    shuffles = Optional(int, default=0)  # mezclas del mazo hechas con el RNG
     game_state = Optional(int, default=0)
     played_card = Optional(int, default=None, nullable=True)
     turn_player = Optional(str, default=None, nullable=True)
@@ -35,8 +58,8 @@ class Match(db.Entity):
     obstacles = Optional(IntArray, default=[])
     exchange_json = Optional(Json, default={})
     timestamp = Optional(float, default=None, nullable=True)
-    chat_record = Optional(StrArray, default=[])
-    logs_record = Optional(StrArray, default=[])
+    chat = Set("ChatMessage")
+    logs = Set("LogEntry")
     amount_discarded = Optional(int, default=0)
 
 class Player(db.Entity):
@@ -44,12 +67,14 @@ class Player(db.Entity):
     player_name = Required(str, unique=True)
     match = Optional(Match)
     is_host = Optional(bool, default=False)
-    cards = Set("Card")
+    hand = Set("MatchCard")
     position = Optional(int)
     rol = Optional(int)  # 0: default, 1: human, 2: la cosa, 3: infected
     is_alive = Optional(bool)
     in_game = Optional(bool, default=False)
     in_quarantine = Optional(int, default=0)
+    composite_index(match, position)
+    composite_index(match, rol)
 
 
 class Card(db.Entity):
@@ -57,15 +82,37 @@ class Card(db.Entity):
     number = Optional(int)
     card_name = Required(str)
     type = Required(int)
-    player = Set(Player)
-    deck = Set("Deck")
 
 
-class Deck(db.Entity):
+# Ejemplar de una carta del catálogo en una partida
+class MatchCard(db.Entity):
+    match = Required(Match)
+    card = Required(int)  # id de la carta en el catálogo
+    location = Required(int)  # CARD_LOCATION
+    owner = Optional(Player)  # jugador que la tiene en la mano
+    position = Optional(int, nullable=True)  # orden en el mazo, la mayor es la cima
+    PrimaryKey(match, card)
+
+
+class ChatMessage(db.Entity):
+    match = Required(Match)
+    seq = Required(int)
+    author = Optional(str)
+    message = Optional(str)
+    timestamp = Optional(float, nullable=True)
+    target = Optional(str, nullable=True)  # None: mensaje para todos
+    PrimaryKey(match, seq)
+    composite_index(match, target)
+
+
+# Entrada del registro de jugadas de una partida
+class LogEntry(db.Entity):
     match = Required(Match)
-    cards = Set(Card)
-    is_discard = Required(bool)
-    PrimaryKey(match, is_discard)
+    seq = Required(int)
+    text = Optional(str)
+    target = Optional(str, nullable=True)  # None: visible para todos
+    PrimaryKey(match, seq)
+    composite_index(match, target)
 
 
 db.generate_mapping(create_tables=True)
@@ -74,6 +121,8 @@ db.generate_mapping(create_tables=True)
 # --- Constants --- #
 
 ROL = {"HUMANO": 1, "LA_COSA": 2, "INFECTADO": 3}
+# OUT: fuera de los mazos y las manos
+CARD_LOCATION = {"DECK": 0, "DISCARD": 1, "HAND": 2, "OUT": 3}
 GAME_STATE = {
     "DRAW_CARD": 1,
     "PLAY_TURN": 2,
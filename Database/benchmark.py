@@ -0,0 +1,117 @@
+# Benchmark de los perfiles de SQLite (ver Database/sqlite_profile.py).
+# Por cada perfil, sobre un archivo temporal, un hilo hace transacciones como
+# las de una jugada (actualiza la partida y una carta, agrega un log) mientras
+# otro lee el listado del lobby. Informa transacciones y lecturas por segundo.
+#
+#   python -m Database.benchmark [segundos por perfil]
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from Database.sqlite_profile import PROFILES, apply_profile, connect_kwargs
+
+MATCHES = 200
+CARDS_PER_MATCH = 100
+
+
+def _connect(filename: str, profile: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        filename, isolation_level=None, check_same_thread=False, **connect_kwargs(profile)
+    )
+    apply_profile(connection, profile)
+    return connection
+
+
+def _create(connection: sqlite3.Connection):
+    connection.executescript(
+        """
+        CREATE TABLE "Match" (
+            "id" INTEGER PRIMARY KEY, "name" TEXT, "player_count" INTEGER,
+            "current_player" INTEGER
+        );
+        CREATE TABLE "MatchCard" (
+            "match" INTEGER, "card" INTEGER, "location" INTEGER,
+            PRIMARY KEY ("match", "card")
+        );
+        CREATE TABLE "LogEntry" (
+            "match" INTEGER, "seq" INTEGER, "text" TEXT, "target" TEXT,
+            PRIMARY KEY ("match", "seq")
+        );
+        """
+    )
+    connection.execute("BEGIN")
+    for match in range(MATCHES):
+        connection.execute(
+            'INSERT INTO "Match" VALUES (?, ?, 4, 0)', (match, f"m{match}")
+        )
+        connection.executemany(
+            'INSERT INTO "MatchCard" VALUES (?, ?, 0)',
+            [(match, card) for card in range(CARDS_PER_MATCH)],
+        )
+    connection.execute("COMMIT")
+
+
+def _writer(connection: sqlite3.Connection, until: float) -> int:
+    transactions = 0
+    while time.perf_counter() < until:
+        match = transactions % MATCHES
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            'UPDATE "Match" SET "current_player" = ? WHERE "id" = ?',
+            (transactions % 4, match),
+        )
+        connection.execute(
+            'INSERT INTO "LogEntry" VALUES (?, ?, ?, NULL)',
+            (match, transactions, f"jugada {transactions}"),
+        )
+        connection.execute(
+            'UPDATE "MatchCard" SET "location" = 2 WHERE "match" = ? AND "card" = ?',
+            (match, transactions % CARDS_PER_MATCH),
+        )
+        connection.execute("COMMIT")
+        transactions += 1
+    return transactions
+
+
+def _reader(connection: sqlite3.Connection, until: float, result: list):
+    reads = 0
+    while time.perf_counter() < until:
+        connection.execute(
+            'SELECT "id", "name", "player_count" FROM "Match"'
+        ).fetchall()
+        reads += 1
+    result.append(reads)
+
+
+def run(profile: str, seconds: float) -> tuple[float, float]:
+    """Transactions and lobby reads per second with the profile"""
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bench.sqlite")
+        writer = _connect(filename, profile)
+        _create(writer)
+        reader = _connect(filename, profile)
+
+        until = time.perf_counter() + seconds
+        reads = []
+        thread = threading.Thread(target=_reader, args=(reader, until, reads))
+        thread.start()
+        transactions = _writer(writer, until)
+        thread.join()
+        writer.close()
+        reader.close()
+    return transactions / seconds, reads[0] / seconds
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"{'perfil':<10}{'transacciones/s':>18}{'lecturas lobby/s':>18}")
+    for profile in PROFILES:
+        tps, rps = run(profile, seconds)
+        print(f"{profile:<10}{tps:>18.0f}{rps:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
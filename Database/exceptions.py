@@ -52,8 +52,5 @@ class MatchNotStarted(DatabaseError):
 class InvalidPlayer(DatabaseError):
     pass
 
-class NoTopCard(DatabaseError):
-    pass
-
 class NoPositionExchangeVictim(DatabaseError):
     pass
\ No newline at end of file
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextvars import copy_context
+from functools import partial
+import asyncio
+import itertools
+import threading
+from Database.storage import storage
+
+# Hilos dedicados a la base de datos, así el event loop no se bloquea
+# esperando a la base.
+# Hay storage.pool_size carriles, cada uno un único hilo que ejecuta sus
+# trabajos en orden de llegada. Todos los trabajos de una partida (sus
+# escrituras con run_match_db y sus snapshots con submit_db) van al carril
+# match_id % pool_size, así nunca se reordenan. Los trabajos sin partida
+# (run_db) se reparten entre los carriles. Con SQLite hay un solo carril.
+
+# Marca de los hilos de la base: el estado en memoria de las partidas
+# (Game/match_state.py) sólo lo ve el event loop
+_db_thread = threading.local()
+
+
+def _mark_db_thread():
+    _db_thread.active = True
+
+
+def on_db_thread() -> bool:
+    return getattr(_db_thread, "active", False)
+
+
+class DbLanes:
+    """The database threads, one single-thread executor per lane"""
+
+    def __init__(self, size: int):
+        self.executors = [
+            ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f"lacosa-db-{lane}",
+                initializer=_mark_db_thread,
+            )
+            for lane in range(size)
+        ]
+        self._turns = itertools.count()
+
+    def for_match(self, match_id: int) -> ThreadPoolExecutor:
+        """Lane of every job of the match"""
+        return self.executors[match_id % len(self.executors)]
+
+    def any(self) -> ThreadPoolExecutor:
+        """Next lane, in turns, for jobs of no match in particular"""
+        return self.executors[next(self._turns) % len(self.executors)]
+
+
+db_lanes = DbLanes(storage.pool_size)
+
+
+def _report_error(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        print("Database job failed: " + repr(future.exception()))
+
+
+def submit_db(match_id: int, fn: callable, *args, **kwargs) -> Future:
+    """Queue a job of the match without waiting for it; errors are only
+    reported"""
+    context = copy_context()
+    future = db_lanes.for_match(match_id).submit(
+        context.run, partial(fn, *args, **kwargs)
+    )
+    future.add_done_callback(_report_error)
+    return future
+
+
+async def _run_in(executor: ThreadPoolExecutor, fn: callable, args, kwargs):
+    loop = asyncio.get_running_loop()
+    context = copy_context()
+    return await loop.run_in_executor(
+        executor, context.run, partial(fn, *args, **kwargs)
+    )
+
+
+async def run_db(fn: callable, *args, **kwargs):
+    """Run a blocking database job in a database thread and await its result"""
+    return await _run_in(db_lanes.any(), fn, args, kwargs)
+
+
+async def run_match_db(match_id: int, fn: callable, *args, **kwargs):
+    """Same as run_db, in the lane of the match: use it for the jobs that
+    change the match, so they run in order with its other writes"""
+    return await _run_in(db_lanes.for_match(match_id), fn, args, kwargs)
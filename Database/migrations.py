@@ -0,0 +1,250 @@
+# Migraciones de esquema para archivos lacosa.sqlite ya existentes.
+# Pony crea las tablas que faltan pero no agrega columnas ni índices a las
+# tablas ya creadas, y falla al generar el mapeo si falta una columna. Estas
+# migraciones corren antes de generar el mapeo; cada una verifica si ya fue
+# aplicada, así que correrlas de nuevo no cambia nada.
+
+import json
+import os
+import sqlite3
+from random import Random
+
+# Texto que veía el jugador infectado en lugar de su marca "$" + jugador
+INFECTED_LOG = "LA COSA TE INFECTÓ!!"
+# CARD_LOCATION de Database/Database.py, que todavía no se puede importar
+DECK, DISCARD, HAND, OUT = 0, 1, 2, 3
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _tables(conn: sqlite3.Connection) -> set:
+    query = "SELECT name FROM sqlite_master WHERE type = 'table'"
+    return {row[0] for row in conn.execute(query)}
+
+
+def _add_match_counters(conn: sqlite3.Connection):
+    """Match.player_count and Match.alive_count, filled from Player"""
+    columns = _columns(conn, "Match")
+    if "player_count" not in columns:
+        conn.execute('ALTER TABLE "Match" ADD COLUMN "player_count" INTEGER')
+        conn.execute(
+            'UPDATE "Match" SET "player_count" = '
+            '(SELECT COUNT(*) FROM "Player" WHERE "Player"."match" = "Match"."id")'
+        )
+    if "alive_count" not in columns:
+        conn.execute('ALTER TABLE "Match" ADD COLUMN "alive_count" INTEGER')
+        conn.execute(
+            'UPDATE "Match" SET "alive_count" = '
+            '(SELECT COUNT(*) FROM "Player" '
+            'WHERE "Player"."match" = "Match"."id" AND "Player"."is_alive")'
+        )
+
+
+def _add_player_indexes(conn: sqlite3.Connection):
+    """Indexes on Player(match, position) and Player(match, rol)"""
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_player__match_position" '
+        'ON "Player" ("match", "position")'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_player__match_rol" '
+        'ON "Player" ("match", "rol")'
+    )
+
+
+def _move_logs_record(conn: sqlite3.Connection):
+    """Match.logs_record into LogEntry rows. The infection marks become
+    entries only visible to the infected player"""
+    if "logs_record" not in _columns(conn, "Match"):
+        return
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "LogEntry" ('
+        '"match" INTEGER NOT NULL REFERENCES "Match" ("id") ON DELETE CASCADE, '
+        '"seq" INTEGER NOT NULL, "text" TEXT NOT NULL, "target" TEXT, '
+        'PRIMARY KEY ("match", "seq"))'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_logentry__match_target" '
+        'ON "LogEntry" ("match", "target")'
+    )
+    entries = []
+    for match_id, record in conn.execute('SELECT "id", "logs_record" FROM "Match"'):
+        for seq, log in enumerate(json.loads(record or "[]"), start=1):
+            if "$" in log:
+                entries.append((match_id, seq, INFECTED_LOG, log.split("$")[1]))
+            else:
+                entries.append((match_id, seq, log, None))
+    conn.executemany('INSERT INTO "LogEntry" VALUES (?, ?, ?, ?)', entries)
+    conn.execute('ALTER TABLE "Match" DROP COLUMN "logs_record"')
+
+
+def _add_match_seed(conn: sqlite3.Connection):
+    """Match.seed, a new one for each match"""
+    if "seed" in _columns(conn, "Match"):
+        return
+    conn.execute('ALTER TABLE "Match" ADD COLUMN "seed" INTEGER')
+    # Las partidas sin iniciar la reemplazan al iniciarse
+    conn.execute('UPDATE "Match" SET "seed" = abs(random()) % 2147483648')
+
+
+def _add_match_shuffles(conn: sqlite3.Connection):
+    """Match.shuffles, the number of reshuffles of the draw deck"""
+    if "shuffles" not in _columns(conn, "Match"):
+        conn.execute('ALTER TABLE "Match" ADD COLUMN "shuffles" INTEGER DEFAULT 0')
+
+
+def _move_chat_record(conn: sqlite3.Connection):
+    """Match.chat_record into ChatMessage rows"""
+    if "chat_record" not in _columns(conn, "Match"):
+        return
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "ChatMessage" ('
+        '"match" INTEGER NOT NULL REFERENCES "Match" ("id") ON DELETE CASCADE, '
+        '"seq" INTEGER NOT NULL, "author" TEXT NOT NULL, "message" TEXT NOT NULL, '
+        '"timestamp" REAL, "target" TEXT, PRIMARY KEY ("match", "seq"))'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_chatmessage__match_target" '
+        'ON "ChatMessage" ("match", "target")'
+    )
+    messages = []
+    for match_id, record in conn.execute('SELECT "id", "chat_record" FROM "Match"'):
+        for seq, raw in enumerate(json.loads(record or "[]"), start=1):
+            msg = json.loads(raw)
+            messages.append(
+                (
+                    match_id,
+                    seq,
+                    msg.get("author", ""),
+                    msg.get("message", ""),
+                    msg.get("timestamp"),
+                    msg.get("target"),
+                )
+            )
+    conn.executemany('INSERT INTO "ChatMessage" VALUES (?, ?, ?, ?, ?, ?)', messages)
+    conn.execute('ALTER TABLE "Match" DROP COLUMN "chat_record"')
+
+
+def _card_locations(conn: sqlite3.Connection, match_id: int, seed: int, top_card) -> dict:
+    """Old card id -> (location, owner, position) of the cards of a match
+    in the Deck, Card_Deck and Card_Player tables"""
+    players = conn.execute(
+        'SELECT COUNT(*) FROM "Player" WHERE "match" = ?', (match_id,)
+    ).fetchone()[0]
+    # Las cartas del mazo inicial que no están en ningún mazo ni mano
+    locations = {
+        card: (OUT, None, None)
+        for card, number in conn.execute('SELECT "id", "number" FROM "Card"')
+        if number is None or number <= players
+    }
+    decks = conn.execute(
+        'SELECT "card", "deck_is_discard" FROM "Card_Deck" '
+        'WHERE "deck_match" = ? ORDER BY "card"',
+        (match_id,),
+    ).fetchall()
+    for card, is_discard in decks:
+        if is_discard:
+            locations[card] = (DISCARD, None, None)
+    # El mazo no tenía orden: se roba en el orden de una mezcla con la semilla
+    pile = [card for card, is_discard in decks if not is_discard]
+    Random(seed).shuffle(pile)
+    if top_card is not None:
+        pile.append(top_card)
+    for position, card in enumerate(pile):
+        locations[card] = (DECK, None, position)
+    hands = conn.execute(
+        'SELECT "card", "player" FROM "Card_Player" '
+        'JOIN "Player" ON "Player"."id" = "Card_Player"."player" '
+        'WHERE "Player"."match" = ?',
+        (match_id,),
+    )
+    for card, player in hands:
+        locations[card] = (HAND, player, None)
+    return locations
+
+
+def _move_cards_to_match_cards(conn: sqlite3.Connection):
+    """The Deck table and the Card_Deck and Card_Player join tables into
+    one MatchCard row per card of each started match. Card ids become
+    catalog ids, also in Match.played_card, exchange_card and exchange_json"""
+    if "Deck" not in _tables(conn):
+        return
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "MatchCard" ('
+        '"match" INTEGER NOT NULL REFERENCES "Match" ("id") ON DELETE CASCADE, '
+        '"card" INTEGER NOT NULL, "location" INTEGER NOT NULL, '
+        '"owner" INTEGER REFERENCES "Player" ("id") ON DELETE SET NULL, '
+        '"position" INTEGER, PRIMARY KEY ("match", "card"))'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_matchcard__owner" ON "MatchCard" ("owner")'
+    )
+    # Las cartas se registraban todas juntas en el orden del catálogo: la
+    # n-ésima fila de Card es la carta n del catálogo
+    catalog = {
+        card: n
+        for n, (card,) in enumerate(
+            conn.execute('SELECT "id" FROM "Card" ORDER BY "id"'), start=1
+        )
+    }
+    matches = conn.execute(
+        'SELECT "id", "seed", "top_card", "played_card", "exchange_card", '
+        '"exchange_json" FROM "Match" WHERE "id" IN (SELECT "match" FROM "Deck")'
+    ).fetchall()
+    for match_id, seed, top_card, played, exchanged, exchange_json in matches:
+        locations = _card_locations(conn, match_id, seed, top_card)
+        conn.executemany(
+            'INSERT INTO "MatchCard" VALUES (?, ?, ?, ?, ?)',
+            [
+                (match_id, catalog[card], location, owner, position)
+                for card, (location, owner, position) in locations.items()
+            ],
+        )
+        exchange = {
+            player: catalog.get(card, card)
+            for player, card in json.loads(exchange_json or "{}").items()
+        }
+        conn.execute(
+            'UPDATE "Match" SET "played_card" = ?, "exchange_card" = ?, '
+            '"exchange_json" = ? WHERE "id" = ?',
+            (
+                catalog.get(played, played),
+                catalog.get(exchanged, exchanged),
+                json.dumps(exchange),
+                match_id,
+            ),
+        )
+    conn.execute('DROP TABLE IF EXISTS "Card_Deck"')
+    conn.execute('DROP TABLE IF EXISTS "Card_Player"')
+    conn.execute('DROP TABLE "Deck"')
+    if "top_card" in _columns(conn, "Match"):
+        conn.execute('ALTER TABLE "Match" DROP COLUMN "top_card"')
+
+
+MIGRATIONS = [
+    _add_match_counters,
+    _add_player_indexes,
+    _move_logs_record,
+    _add_match_seed,
+    _add_match_shuffles,
+    _move_chat_record,
+    _move_cards_to_match_cards,
+]
+
+
+def migrate(filename: str):
+    """Bring an existing database file up to date with the current schema.
+    New files are left to Pony"""
+    if not os.path.exists(filename):
+        return
+    conn = sqlite3.connect(filename)
+    try:
+        with conn:
+            if not {"Match", "Player"} <= _tables(conn):
+                return
+            for migration in MIGRATIONS:
+                migration(conn)
+    finally:
+        conn.close()
@@ -2,9 +2,13 @@ from pony.orm import *
 from Database.Database import Card
 from Database.exceptions import *
 from Game.cards.cards import *
+from Game.match_state import MatchState
+from enum import IntFlag
+from types import MappingProxyType
+from typing import NamedTuple
 
 
-# --------- Card functions --------- #
+# --------- Card rules --------- #
 
 TARGET_CARDS = [
     "Lanzallamas",
@@ -55,111 +59,171 @@ DEFEND_EXCHANGE = [
 GLOBAL_EXCHANGE = ["Seducción", "¿No podemos ser amigos?"]
 
 
-@db_session
+# --------- Card catalog --------- #
+
+
+class CardFlag(IntFlag):
+    NONE = 0
+    TARGET = 1
+    TARGET_ADJACENT = 2
+    TARGET_NOT_QUARANTINED = 4
+    CAN_TARGET_CASTER = 8
+    DEFENSIBLE = 16
+    DEFEND_EXCHANGE = 32
+    GLOBAL_EXCHANGE = 64
+
+
+class CardEntry(NamedTuple):
+    id: int
+    card_name: str
+    number: int
+    type: int
+    flags: CardFlag
+
+
+def _card_flags(card_name: str) -> CardFlag:
+    flags = CardFlag.NONE
+    if card_name in TARGET_CARDS:
+        flags |= CardFlag.TARGET
+    if card_name in TARGET_ADJACENT:
+        flags |= CardFlag.TARGET_ADJACENT
+    if card_name in TARGET_NOT_QUARANTINED:
+        flags |= CardFlag.TARGET_NOT_QUARANTINED
+    if card_name in CAN_TARGET_CASTER:
+        flags |= CardFlag.CAN_TARGET_CASTER
+    if card_name in DEFENSIBLE_CARD:
+        flags |= CardFlag.DEFENSIBLE
+    if card_name in DEFEND_EXCHANGE:
+        flags |= CardFlag.DEFEND_EXCHANGE
+    if card_name in GLOBAL_EXCHANGE:
+        flags |= CardFlag.GLOBAL_EXCHANGE
+    return flags
+
+
+def _build_catalog() -> MappingProxyType:
+    """Ids are assigned in template order, the same order used to register
+    the cards in the database"""
+    catalog = {}
+    card_id = 1
+    for card in card_templates:
+        for rep in card.repetitions:
+            for _ in range(rep.amount):
+                catalog[card_id] = CardEntry(
+                    id=card_id,
+                    card_name=card.card_name,
+                    number=rep.number,
+                    type=card.type.value,
+                    flags=_card_flags(card.card_name),
+                )
+                card_id += 1
+    return MappingProxyType(catalog)
+
+
+CARD_CATALOG = _build_catalog()
+
+
+def get_card_entry(card_id: int) -> CardEntry:
+    entry = CARD_CATALOG.get(card_id)
+    if entry is None:
+        raise CardNotFound("Carta no encontrada")
+    return entry
+
+
+def _has_flag(card_id: int, flag: CardFlag) -> bool:
+    return bool(get_card_entry(card_id).flags & flag)
+
+
+# --------- Card functions --------- #
+
+
 def can_target_caster(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in CAN_TARGET_CASTER
+    return _has_flag(card_id, CardFlag.CAN_TARGET_CASTER)
 
 
 @db_session
-def get_card_by_id(card_id: int) -> Card:
-    if not Card.exists(id=card_id):
-        raise CardNotFound("Carta no encontrada")
+def get_card_by_id(card_id: int, match=None) -> Card:
+    get_card_entry(card_id)
+    if isinstance(match, MatchState):
+        return match.get_card(card_id)
     return Card[card_id]
 
 
-@db_session
 def card_exists(card_id: int) -> bool:
-    return Card.exists(id=card_id)
+    return card_id in CARD_CATALOG
 
 
-@db_session
 def get_card_name(card_id: int) -> str:
-    return get_card_by_id(card_id).card_name
+    return get_card_entry(card_id).card_name
+
+
+def get_card_type(card_id: int) -> int:
+    return get_card_entry(card_id).type
 
 
-@db_session
 def is_defensa(card_id: int) -> bool:
-    card = get_card_by_id(card_id)
-    return card.type == CardType.DEFENSA.value
+    return get_card_type(card_id) == CardType.DEFENSA.value
 
 
-@db_session
 def is_panic(card_id: int) -> bool:
-    card = get_card_by_id(card_id)
-    return card.type == CardType.PANICO.value
+    return get_card_type(card_id) == CardType.PANICO.value
 
 
-@db_session
 def is_contagio(card_id: int) -> bool:
-    card = get_card_by_id(card_id)
-    return card.type == CardType.CONTAGIO.value
+    return get_card_type(card_id) == CardType.CONTAGIO.value
 
 
-@db_session
 def has_defense(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in DEFENSIBLE_CARD.keys()
+    return _has_flag(card_id, CardFlag.DEFENSIBLE)
 
 
-@db_session
 def can_defend(defense_card: int, action_card: int) -> bool:
     defense_card_name = get_card_name(defense_card)
     action_card_name = get_card_name(action_card)
     return DEFENSIBLE_CARD[action_card_name] == defense_card_name
 
 
-@db_session
 def defend_exchange(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in DEFEND_EXCHANGE
+    return _has_flag(card_id, CardFlag.DEFEND_EXCHANGE)
 
 
-@db_session
 def requires_target(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in TARGET_CARDS
+    return _has_flag(card_id, CardFlag.TARGET)
 
 
-@db_session
 def requires_adjacent_target(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in TARGET_ADJACENT
+    return _has_flag(card_id, CardFlag.TARGET_ADJACENT)
 
 
-@db_session
 def requires_target_not_quarantined(card_id: int) -> bool:
-    card_name = get_card_name(card_id)
-    return card_name in TARGET_NOT_QUARANTINED
+    return _has_flag(card_id, CardFlag.TARGET_NOT_QUARANTINED)
 
 
-@db_session
 def allows_global_exchange(card_id: int) -> bool:
     if card_id is None:
         return False
-    card_name = get_card_name(card_id)
-    return card_name in GLOBAL_EXCHANGE
+    return _has_flag(card_id, CardFlag.GLOBAL_EXCHANGE)
 
 
 # ----- Register Cards ----- #
 
 
-def _register_rep(rep, card):
-    for _ in range(rep.amount):
-        Card(card_name=card.card_name, number=rep.number, type=card.type.value)
-
-
 @db_session
 def _register_cards():
     Card.select().delete()
-    for card in card_templates:
-        for rep in card.repetitions:
-            _register_rep(rep, card)
+    for entry in CARD_CATALOG.values():
+        Card(
+            id=entry.id,
+            card_name=entry.card_name,
+            number=entry.number,
+            type=entry.type,
+        )
 
 
 @db_session
 def _are_cards_registered():
-    return Card.select().count() == amount_cards()
+    registered = {c.id: (c.card_name, c.number, c.type) for c in Card.select()}
+    expected = {e.id: (e.card_name, e.number, e.type) for e in CARD_CATALOG.values()}
+    return registered == expected
 
 
 # Register Cards
@@ -0,0 +1,56 @@
+from pony.orm import *
+from Database.exceptions import *
+from Database.Database import ChatMessage
+from Database.models.Match import *
+from Database.models.Match import _get_match
+from Game.match_state import MatchState, chat_entry, chat_record
+
+# Cantidad de mensajes por página del historial de chat
+CHAT_PAGE_SIZE = 50
+
+
+@db_session
+def save_chat_message(match_id: int, msg_data: dict) -> int:
+    """Append a message to the match chat. Messages with a "target" are only
+    visible to that player. Returns the sequence number of the message"""
+    match = _get_match(match_id)
+    if isinstance(match, MatchState):
+        return match.chat_log.append(msg_data)["seq"]
+    seq = (max(m.seq for m in ChatMessage if m.match == match) or 0) + 1
+    ChatMessage(
+        match=match,
+        seq=seq,
+        author=msg_data.get("author", ""),
+        message=msg_data.get("message", ""),
+        timestamp=msg_data.get("timestamp"),
+        target=msg_data.get("target"),
+    )
+    return seq
+
+
+@db_session
+def get_chat_page(
+    match_id: int, player_name: str, before: int = None, limit: int = CHAT_PAGE_SIZE
+) -> list:
+    """Last limit messages visible to the player with a sequence number
+    lower than before, in order"""
+    match = _get_match(match_id)
+    if isinstance(match, MatchState):
+        return match.chat_log.page(player_name, before, limit)
+    query = select(
+        m
+        for m in ChatMessage
+        if m.match == match and (m.target is None or m.target == player_name)
+    )
+    if before is not None:
+        query = query.filter(lambda m: m.seq < before)
+    messages = query.order_by(desc(ChatMessage.seq))[:limit]
+    return [chat_record(chat_entry(message)) for message in reversed(messages)]
+
+
+@db_session
+def reset_chat_record(match_id: int):
+    match = _get_match(match_id)
+    if isinstance(match, MatchState):
+        match.chat_log.clear()
+    delete(m for m in ChatMessage if m.match.id == match_id)
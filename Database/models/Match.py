@@ -1,9 +1,19 @@
 from pony.orm import *
 from Database.exceptions import *
-from Database.Database import Match, GAME_STATE, Deck
+from Database.Database import (
+    Match,
+    MatchCard,
+    LogEntry,
+    GAME_STATE,
+    ROL,
+    CARD_LOCATION,
+)
 from Game.cards.cards import *
 from Database.models.Player import *
-from random import randrange
+from Game.match_state import match_states, MatchState, DeckState
+from Game.seat_ring import seat_rings, SeatRing
+from Game.lobby_index import lobby_index
+from random import Random, randrange
 from time import time
 import json
 
@@ -12,23 +22,23 @@ import json
 
 @db_session
 def _get_match(match_id: int) -> Match:
-    if not Match.exists(id=match_id):
+    match = match_states.get(match_id) or Match.get(id=match_id)
+    if match is None:
         raise MatchNotFound("Partida no encontrada")
-    return Match[match_id]
+    return match
 
 
 @db_session
 def _get_match_by_name(match_name: str) -> Match:
-    if not Match.exists(name=match_name):
+    match = match_states.get_by_name(match_name) or Match.get(name=match_name)
+    if match is None:
         raise MatchNotFound("Partida no encontrada")
-    return Match.get(name=match_name)
+    return match
 
 
 @db_session
 def get_match_id(match_name):
-    if not match_exists(match_name):
-        raise MatchNotFound("Partida no encontrada")
-    return Match.get(name=match_name).id
+    return _get_match_by_name(match_name).id
 
 
 @db_session
@@ -38,7 +48,7 @@ def get_match_games(match_id):
 
 @db_session
 def get_match_players(match_id):
-    return Match[match_id].players
+    return _get_match(match_id).players
 
 
 @db_session
@@ -49,12 +59,12 @@ def get_match_players_names(match_id):
 
 @db_session
 def get_match_max_players(match_id):
-    return Match[match_id].max_players
+    return _get_match(match_id).max_players
 
 
 @db_session
 def get_match_min_players(match_id):
-    return Match[match_id].min_players
+    return _get_match(match_id).min_players
 
 
 @db_session
@@ -64,16 +74,20 @@ def get_match_quantity():
 
 @db_session
 def get_match_quantity_player(match_id):
-    return Match[match_id].players.count()
+    return _get_match(match_id).players.count()
 
 
 @db_session
 def match_exists(match_name: str) -> bool:
+    if match_states.get_by_name(match_name) is not None:
+        return True
     return Match.exists(name=match_name)
 
 
 @db_session
 def check_match_existence(match_id: int) -> bool:
+    if match_states.is_loaded(match_id):
+        return True
     return Match.exists(id=match_id)
 
 
@@ -137,12 +151,12 @@ def set_match_turn(match_id: int, player_name: str):
 
 @db_session
 def get_game_state(match_id: int) -> int:
-    return Match[match_id].game_state
+    return _get_match(match_id).game_state
 
 
 @db_session
 def set_game_state(match_id: int, state: int):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.game_state = state
 
 
@@ -153,38 +167,42 @@ def get_match_name(match_id: int) -> str:
 
 
 @db_session
-def get_discard_deck(match_id: int) -> Deck:
+def get_discard_deck(match_id: int) -> DeckState:
     match = _get_match(match_id)
-    return Deck.get(match=match, is_discard=True)
+    if not isinstance(match, MatchState):
+        raise MatchNotStarted("Partida no ha iniciado")
+    return match.get_deck(is_discard=True)
 
 
 @db_session
-def get_deck(match_id: int) -> Deck:
+def get_deck(match_id: int) -> DeckState:
     match = _get_match(match_id)
-    return Deck.get(match=match, is_discard=False)
+    if not isinstance(match, MatchState):
+        raise MatchNotStarted("Partida no ha iniciado")
+    return match.get_deck(is_discard=False)
 
 
 @db_session
 def set_played_card(match_id: int, card_id: int):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.played_card = card_id
 
 
 @db_session
 def set_turn_player(match_id: int, player_name: str):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.turn_player = player_name
 
 
 @db_session
 def set_target_player(match_id: int, player_name: str):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.target_player = player_name
 
 
 @db_session
 def get_played_card(match_id: int) -> int:
-    return Match[match_id].played_card
+    return _get_match(match_id).played_card
 
 
 @db_session
@@ -197,23 +215,23 @@ def last_played_card(match_id: int) -> str:
 
 @db_session
 def get_turn_player(match_id: int) -> str:
-    return Match[match_id].turn_player
+    return _get_match(match_id).turn_player
 
 
 @db_session
 def get_target_player(match_id: int) -> str:
-    return Match[match_id].target_player
+    return _get_match(match_id).target_player
 
 
 @db_session
 def clean_played_card(match_id: int):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.played_card = None
 
 
 @db_session
 def clean_played_card_data(match_id: int):
-    match = Match[match_id]
+    match = _get_match(match_id)
     match.played_card = None
     match.turn_player = None
     match.target_player = None
@@ -229,11 +247,13 @@ def assign_next_turn_to(match_id: int, player_name: str):
 @db_session
 def delete_match(match_name):
     match = Match.get(name=match_name)
+    # El estado en memoria lo descarta el event loop (match_states.evict)
+    seat_rings.invalidate(match.id)
+    lobby_index.remove(match.id)
     for player in match.players:
         player.match = None
         player.is_host = False
         player.in_game = False
-        player.cards.clear()
     match.delete()
 
 
@@ -246,10 +266,12 @@ def db_add_player(player_name: str, match_name: str):
     match = _get_match_by_name(match_name)
     if player.match:
         raise PlayerAlreadyInMatch("Jugador ya está en partida")
-    if len(match.players) >= match.max_players:
+    if match.player_count >= match.max_players:
         raise MatchIsFull("La partida está completa")
     match.players.add(player)
     player.match = match
+    match.player_count += 1
+    lobby_index.put(_lobby_entry(match))
 
 
 @db_session
@@ -263,12 +285,12 @@ def db_get_players(match_name: str) -> list[str]:
 
 @db_session
 def get_match_info(match_id):
-    match = Match[match_id]
+    match = _get_match(match_id)
     return {
         "name": match.name,
         "min_players": match.min_players,
         "max_players": match.max_players,
-        "players": match.players.count(),
+        "players": match.player_count,
     }
 
 
@@ -348,123 +370,85 @@ def get_players_positions(match_name: str) -> list:
     return positions
 
 
-def _apply_n(n: int, f: callable, const, acum):
-    if n == 0:
-        return acum
-    return _apply_n(n - 1, f, const, f(const, acum))
+@db_session
+def _seat_ring(match_id: int) -> SeatRing:
+    return seat_rings.get(_get_match(match_id))
 
 
+@db_session
 def is_three_steps_from(player_name: str, target_name: str) -> bool:
+    ring = _seat_ring(get_player_match(player_name))
     caster_position = get_player_position(player_name)
     target_position = get_player_position(target_name)
-
-    left = _apply_n(
-        3, get_previous_player_position, get_player_match(player_name), caster_position
+    return target_position in (
+        ring.left(caster_position, 3),
+        ring.right(caster_position, 3),
     )
 
-    right = _apply_n(
-        3, get_next_player_position, get_player_match(player_name), caster_position
-    )
-
-    return target_position == left or target_position == right
-
 
 @db_session
 def _is_adyacent(player: Player, player_target: Player) -> bool:
-    is_next = (
-        get_next_player_position(player.match.id, player.position)
-        == player_target.position
+    ring = _seat_ring(player.match.id)
+    return player_target.position in (
+        ring.left(player.position),
+        ring.right(player.position),
     )
-    is_previous = (
-        get_previous_player_position(player.match.id, player.position)
-        == player_target.position
-    )
-    return is_next or is_previous
 
 
 @db_session
 def all_players_alive(match_id: int) -> bool:
     match = _get_match(match_id)
-    for player in match.players:
-        if not player.is_alive:
-            return False
-    return True
+    return match.alive_count == match.player_count
 
 
 @db_session
 def get_next_player(match_id: int) -> str:
     match = _get_match(match_id)
     next_pos = get_next_player_position(match_id, match.current_player)
-    return _get_player_by_position(match_id, next_pos).player_name
+    return get_player_name_by_position(match_id, next_pos)
 
 
 @db_session
 def _get_player_by_position(match_id: int, position: int) -> Player:
-    match = _get_match(match_id)
-    return match.players.filter(lambda p: p.position == position).first()
+    return get_player_by_name(get_player_name_by_position(match_id, position))
 
 
 @db_session
 def get_player_name_by_position(match_id: int, position: int) -> str:
-    match = _get_match(match_id)
-    return match.players.filter(lambda p: p.position == position).first().player_name
+    return _seat_ring(match_id).seats[position]
 
 
 @db_session
 def get_next_player_position(match_id: int, start: int) -> int:
     match = _get_match(match_id)
-    current_player = start
-    total_players = match.players.count()
-    direction = 1 if match.clockwise else -1
-
-    while True:
-        current_player = (current_player - direction) % total_players
-        player = _get_player_by_position(match_id, current_player)
-        if player.is_alive:
-            return current_player
+    ring = seat_rings.get(match)
+    return ring.left(start) if match.clockwise else ring.right(start)
 
 
 @db_session
 def get_previous_player_position(match_id: int, start: int) -> int:
     match = _get_match(match_id)
-    current_player = start
-    total_players = match.players.count()
-    direction = 1 if match.clockwise else -1
-
-    while True:
-        current_player = (current_player + direction) % total_players
-        player = _get_player_by_position(match_id, current_player)
-        if player.is_alive:
-            return current_player
+    ring = seat_rings.get(match)
+    return ring.right(start) if match.clockwise else ring.left(start)
 
 
 @db_session
 def get_next_player_from(match_id: int, player_name: str) -> str:
     player_position = get_player_position(player_name)
     next_pos = get_next_player_position(match_id, player_position)
-    return _get_player_by_position(match_id, next_pos).player_name
+    return get_player_name_by_position(match_id, next_pos)
 
 
 @db_session
 def get_right_alive_player(match_id: int, player: str) -> str:
-    player_position = get_player_position(player)
-    match = _get_match(match_id)
-    clockwise = match.clockwise
-    match.clockwise = False
-    next_pos = get_next_player_position(match_id, player_position)
-    match.clockwise = clockwise
-    return _get_player_by_position(match_id, next_pos).player_name
+    ring = _seat_ring(match_id)
+    return ring.seats[ring.right(get_player_position(player))]
 
 
 @db_session
 def get_left_alive_player(match_id: int, player: str) -> str:
-    player_position = get_player_position(player)
-    match = _get_match(match_id)
-    clockwise = match.clockwise
-    match.clockwise = True
-    next_pos = get_next_player_position(match_id, player_position)
-    match.clockwise = clockwise
-    return _get_player_by_position(match_id, next_pos).player_name
+    ring = _seat_ring(match_id)
+    return ring.seats[ring.left(get_player_position(player))]
 
 
 @db_session
@@ -476,9 +460,7 @@ def set_next_turn(match_id: int):
 @db_session
 def get_player_in_turn(match_id: int) -> str:
     match = _get_match(match_id)
-    for player in match.players:
-        if player.position == match.current_player:
-            return player.player_name
+    return get_player_name_by_position(match_id, match.current_player)
 
 
 @db_session
@@ -502,37 +484,61 @@ def is_adyacent(player_name: str, target_name: str) -> bool:
     return _is_adyacent(player, target)
 
 
+def _lobby_entry(match: Match) -> dict:
+    """Entry of the match in the lobby index"""
+    return {
+        "id": match.id,
+        "name": match.name,
+        "min_players": match.min_players,
+        "max_players": match.max_players,
+        "players": match.player_count,
+        "has_password": bool(match.password),
+        "initiated": match.initiated,
+    }
+
+
 @db_session
 def get_match_list():
-    match_list = Match.select()[:]
+    query = select(
+        (
+            m.id,
+            m.name,
+            m.min_players,
+            m.max_players,
+            m.player_count,
+            m.password,
+            m.initiated,
+        )
+        for m in Match
+    )
     res_list = []
-    for match in match_list:
+    for id, name, min_players, max_players, players, password, initiated in query:
         res_list.append(
             {
-                "name": match.name,
-                "min_players": match.min_players,
-                "max_players": match.max_players,
-                "players": match.players.count(),
+                "id": id,
+                "name": name,
+                "min_players": min_players,
+                "max_players": max_players,
+                "players": players,
+                "has_password": bool(password),
+                "initiated": initiated,
             }
         )
     return res_list
 
 
 @db_session
-def _create_deck(match: Match):
-    deck = Deck(match=match, is_discard=False)
-    disc_deck = Deck(match=match, is_discard=True)
-    num_player = match.players.count()
+def load_lobby_index():
+    lobby_index.load(get_match_list())
 
-    for card in Card.select():
-        if card.number is None or card.number <= num_player:
-            deck.cards.add(card)
-            card.deck.add(deck)
 
-    match.deck.add(deck)
-    match.deck.add(disc_deck)
-    deck.match = match
-    disc_deck.match = match
+def _create_deck(num_players: int) -> list:
+    """Ids of the catalog cards used in a match of num_players"""
+    return [
+        card.id
+        for card in CARD_CATALOG.values()
+        if card.number is None or card.number <= num_players
+    ]
 
 
 @db_session
@@ -542,9 +548,10 @@ def started_match(match_name):
     match.current_player = 0
     position = -1
     match.game_state = GAME_STATE["DRAW_CARD"]
+    match.seed = randrange(2**31)
+    match.shuffles = 0
     # create deck and deal cards
-    _create_deck(match)
-    _deal_cards(match)
+    hands = _deal_cards(match, _create_deck(match.players.count()))
     for player in match.players:
         player.in_game = True
         player.is_alive = True
@@ -552,38 +559,57 @@ def started_match(match_name):
         player.in_quarantine = 0
         position += 1
         match.obstacles.append(False)
-        if player.cards.select(lambda c: c.card_name == "La Cosa").first():
-            player.rol = 2  # La Cosa
+        if any(get_card_name(card) == "La Cosa" for card in hands[player]):
+            player.rol = ROL["LA_COSA"]
         else:
-            player.rol = 1
+            player.rol = ROL["HUMANO"]
+    match.player_count = match.players.count()
+    match.alive_count = match.player_count
+    lobby_index.put(_lobby_entry(match))
 
+    seat_rings.invalidate(match.id)
+    # El estado en memoria lo carga quien inicia la partida (load_match)
     return match
 
 
 @db_session
-def _deal_cards(match: Match):
-    deck = match.deck.filter(lambda d: not d.is_discard).first()
+def _deal_cards(match: Match, deck: list) -> dict:
+    """Creates one MatchCard per card of the deck, 4 of them in each hand and
+    the rest shuffled in the draw pile. Returns the ids of the cards dealt to
+    each player"""
+    rng = Random(match.seed)
     required_cards = match.players.count() * 4
 
     # Repartir según reglas
-    deal_deck = list(
-        deck.cards.filter(
-            lambda c: c.type != CardType.CONTAGIO.value
-            and c.type != CardType.PANICO.value
-        ).random(required_cards - 1)
-    )
-    cosa_card = deck.cards.filter(lambda c: c.card_name == "La Cosa").first()
-    deal_deck = list(filter(lambda c: not c.card_name == "La Cosa", deal_deck))
-    deal_deck.insert(randrange(len(deal_deck) + 1), cosa_card)
+    dealable = [
+        card
+        for card in deck
+        if get_card_type(card) != CardType.CONTAGIO.value
+        and get_card_type(card) != CardType.PANICO.value
+        and not get_card_name(card) == "La Cosa"
+    ]
+    cosa_card = next(card for card in deck if get_card_name(card) == "La Cosa")
+    deal_deck = rng.sample(dealable, required_cards - 1)
+    deal_deck.insert(rng.randrange(len(deal_deck) + 1), cosa_card)
+
+    hands = {}
+    owners = {}
+    for player in match.players:
+        hands[player] = [deal_deck.pop() for _ in range(4)]
+        for card in hands[player]:
+            owners[card] = player
+
+    pile = [card for card in deck if card not in owners]
+    rng.shuffle(pile)
 
-    players = match.players
-    for player in players:
-        for _ in range(4):
-            card = deal_deck.pop()
-            player.cards.add(card)  # Otorgar a jugador
-            card.player.add(player)
-            deck.cards.remove(card)  # Quitar del mazo
-            card.deck.remove(deck)
+    # Una fila por carta, creadas en una sola transacción
+    for position, card in enumerate(pile):
+        MatchCard(
+            match=match, card=card, location=CARD_LOCATION["DECK"], position=position
+        )
+    for card, owner in owners.items():
+        MatchCard(match=match, card=card, location=CARD_LOCATION["HAND"], owner=owner)
+    return hands
 
 
 @db_session
@@ -656,6 +682,8 @@ def left_match(player_name, match_name):
     match = Match.get(name=match_name)
     player.match = None
     match.players.remove(player)
+    match.player_count -= 1
+    lobby_index.put(_lobby_entry(match))
 
 
 @db_session
@@ -670,8 +698,11 @@ def db_create_match(
         raise PlayerAlreadyInMatch("Jugador ya está en partida")
     match = Match(name=match_name, min_players=min_players, max_players=max_players)
     match.players.add(creator)
+    match.player_count = 1
     creator.match = match
     creator.is_host = True
+    flush()
+    lobby_index.put(_lobby_entry(match))
 
 
 @db_session
@@ -682,11 +713,12 @@ def kill_player(player_name: str):
     player_cards = player.cards.copy()
     for card in player_cards:
         player.cards.remove(card)
-        card.player.remove(player)
         discard.cards.add(card)
-        card.deck.add(discard)
+    if player.is_alive:
+        player.match.alive_count -= 1
     player.is_alive = False
     player.in_quarantine = 0
+    seat_rings.invalidate(player.match.id)
 
 
 def _are_border_cases(position1: int, position2: int, length: int) -> bool:
@@ -713,30 +745,19 @@ def set_barred_door_between(player: str, target: str) -> None:
         match.obstacles[player_position] = True
     elif get_left_alive_player(match_id, player) == target:
         match.obstacles[player_position - 1] = True
+    seat_rings.invalidate(match_id)
 
 
 @db_session
-def _door_to_right(player: str, target: str) -> bool:
-    match = _get_match(get_player_match(player))
-    player_position = get_player_position(player)
-    target_position = get_player_position(target)
-    while player_position != target_position:
-        if match.obstacles[player_position]:
-            return player_position
-        player_position = (player_position + 1) % len(match.players)
-    return -1
+def _door_to_right(player: str, target: str) -> int:
+    ring = _seat_ring(get_player_match(player))
+    return ring.door_to_right(get_player_position(player), get_player_position(target))
 
 
 @db_session
-def _door_to_left(player: str, target: str) -> bool:
-    match = _get_match(get_player_match(player))
-    player_position = get_player_position(player)
-    target_position = get_player_position(target)
-    while player_position != target_position:
-        if match.obstacles[player_position - 1]:
-            return (player_position - 1) % len(match.players)
-        player_position = (player_position - 1) % len(match.players)
-    return -1
+def _door_to_left(player: str, target: str) -> int:
+    ring = _seat_ring(get_player_match(player))
+    return ring.door_to_left(get_player_position(player), get_player_position(target))
 
 
 @db_session
@@ -781,6 +802,7 @@ def remove_all_barred_doors(match_id: int) -> None:
     match = _get_match(match_id)
     for i in range(len(match.obstacles)):
         match.obstacles[i] = False
+    seat_rings.invalidate(match_id)
 
 
 @db_session
@@ -855,27 +877,11 @@ def toggle_direction(match_id: int):
     match.clockwise = not match.clockwise
 
 
-@db_session
-def save_chat_message(match_id: int, msg_data: dict):
-    str_json = json.dumps(msg_data)
-    match = _get_match(match_id)
-    match.chat_record.append(str_json)
-
-
-@db_session
-def get_chat_record(match_id: int):
-    match = _get_match(match_id)
-    str_records = match.chat_record
-    json_record = map(lambda s: json.loads(s), str_records)
-    return list(json_record)
-
-
 @db_session
 def add_card_to_player(player_name: str, card_id: int):
     player = get_player_by_name(player_name)
-    card = Card.get(id=card_id)
+    card = get_card_by_id(card_id, player.match)
     player.cards.add(card)
-    card.player.add(player)
 
 
 @db_session
@@ -897,21 +903,41 @@ def reset_discarded(match_id: int):
 
 
 @db_session
-def reset_chat_record(match_id: int):
+def save_log(match_id: int, log: str, target: str = None) -> int:
+    """Append an entry to the log of the match. Entries with a target are
+    only visible to that player. Returns the sequence number of the entry"""
     match = _get_match(match_id)
-    match.chat_record.clear()
+    if isinstance(match, MatchState):
+        return match.game_log.append(log, target)["seq"]
+    seq = (max(e.seq for e in LogEntry if e.match == match) or 0) + 1
+    LogEntry(match=match, seq=seq, text=log, target=target)
+    return seq
 
 
 @db_session
-def save_log(match_id: int, log: str):
+def get_logs(match_id: int, player_name: str, since: int = 0) -> list:
+    """Texts of the entries visible to the player with a sequence number
+    greater than since, in order"""
     match = _get_match(match_id)
-    match.logs_record.append(log)
+    if isinstance(match, MatchState):
+        return match.game_log.tail(player_name, since)
+    query = select(
+        e
+        for e in LogEntry
+        if e.match == match
+        and e.seq > since
+        and (e.target is None or e.target == player_name)
+    )
+    return [entry.text for entry in query.order_by(LogEntry.seq)]
 
 
 @db_session
-def get_logs(match_id: int):
+def get_last_log_seq(match_id: int) -> int:
+    """Sequence number of the last entry of the log, 0 if it's empty"""
     match = _get_match(match_id)
-    return match.logs_record
+    if isinstance(match, MatchState):
+        return match.game_log.last_seq
+    return max(e.seq for e in LogEntry if e.match == match) or 0
 
 
 @db_session
@@ -942,56 +968,24 @@ def exist_door_in_position(match_id: int, position: int) -> bool:
 def remove_barred_door(index: int, match_id: int):
     match = _get_match(match_id)
     match.obstacles[index] = False
+    seat_rings.invalidate(match_id)
 
 
 @db_session
 def set_top_card(card_id: int, match_id: int):
+    """Put the card on top of the deck, it will be the next one drawn"""
     match = _get_match(match_id)
-    match.top_card = card_id
-
-
-@db_session
-def is_there_top_card(match_id: int) -> bool:
-    match = _get_match(match_id)
-    return match.top_card is not None
-
-
-@db_session
-def pop_top_card(match_id: int) -> int:
-    match = _get_match(match_id)
-
-    if match.top_card is None:
-        raise NoTopCard("No hay carta en la cima")
-
-    card_id = match.top_card
-    match.top_card = None
-
-    return card_id
+    get_deck(match_id).push(get_card_by_id(card_id, match))
 
 
 @db_session
 def get_all_players_after(player_name: str) -> list:
+    """The player followed by the alive players to his left"""
     initial_player = get_player_by_name(player_name)
-    players = [player_name]
-    match = initial_player.match
-    match_id = match.id
-
-    DIRECTION = match.clockwise
-    match.clockwise = True
-
-    next_player_pos = get_next_player_position(
-        match_id,
-        initial_player.position,
-    )
-    next_player_name = get_player_name_by_position(match_id, next_player_pos)
-    while next_player_name != player_name:
-        players.append(next_player_name)
-        next_player_pos = get_next_player_position(match_id, next_player_pos)
-        next_player_name = get_player_name_by_position(match_id, next_player_pos)
-
-    match.clockwise = DIRECTION
-
-    return players
+    ring = _seat_ring(initial_player.match.id)
+    return [player_name] + [
+        ring.seats[position] for position in ring.alive_to_left(initial_player.position)
+    ]
 
 
 @db_session
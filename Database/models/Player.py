@@ -3,6 +3,8 @@ from Database.Database import Player, ROL, GAME_STATE
 from Database.exceptions import *
 from Game.cards.cards import *
 from Database.models.Card import *
+from Game.match_state import match_states
+from Game.seat_ring import seat_rings
 
 
 # ----- Basic player functions ----- #
@@ -15,13 +17,18 @@ def create_player(new_player_name: str):
 
 @db_session
 def get_player_by_name(player_name: str) -> Player:
-    if not player_exists(player_name):
+    player = match_states.get_player(player_name) or Player.get(
+        player_name=player_name
+    )
+    if player is None:
         raise PlayerNotFound("Jugador no encontrado")
-    return Player.get(player_name=player_name)
+    return player
 
 
 @db_session
 def player_exists(player_name: str) -> bool:
+    if match_states.get_player(player_name) is not None:
+        return True
     return Player.exists(player_name=player_name)
 
 
@@ -51,8 +58,6 @@ def get_player_position(player_name: str) -> int:
 
 @db_session
 def get_player_match(player_name: str) -> int:
-    if not player_exists(player_name):
-        raise PlayerNotFound("Jugador no encontrado")
     player = get_player_by_name(player_name)
     if not player.match:
         raise PlayerNotInMatch("El jugador no está en partida")
@@ -88,7 +93,10 @@ def is_host(player_name: str) -> bool:
 @db_session
 def set_player_alive(player_name: str, alive: bool):
     player = get_player_by_name(player_name)
+    if player.is_alive != alive:
+        player.match.alive_count += 1 if alive else -1
     player.is_alive = alive
+    seat_rings.invalidate(player.match.id)
 
 
 @db_session
@@ -175,9 +183,8 @@ def get_player_cards_names(player_name: str) -> list:
 
 @db_session
 def has_card(player_name, card_id):
-    player = Player.get(player_name=player_name)
-    card = Card.get(id=card_id)
-    return card in player.cards
+    player = get_player_by_name(player_name)
+    return any(card.id == card_id for card in player.cards)
 
 
 @db_session
@@ -197,18 +204,14 @@ def count_infected_cards(player_name: str) -> int:
 def exchange_players_cards(player1: str, card1: int, player2: str, card2: int):
     player1 = get_player_by_name(player1)
     player2 = get_player_by_name(player2)
-    card1 = get_card_by_id(card1)
-    card2 = get_card_by_id(card2)
+    card1 = get_card_by_id(card1, player1.match)
+    card2 = get_card_by_id(card2, player2.match)
 
     player1.cards.remove(card1)
     player2.cards.remove(card2)
-    card1.player.remove(player1)
-    card2.player.remove(player2)
 
     player1.cards.add(card2)
     player2.cards.add(card1)
-    card1.player.add(player2)
-    card2.player.add(player1)
 
 
 @db_session
@@ -216,3 +219,4 @@ def toggle_places(playerA_name, playerB_name):
     playerA = get_player_by_name(playerA_name)
     playerB = get_player_by_name(playerB_name)
     playerA.position, playerB.position = playerB.position, playerA.position
+    seat_rings.invalidate(playerA.match.id)
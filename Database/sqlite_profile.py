@@ -0,0 +1,49 @@
+# Perfiles de ajuste de SQLite, aplicados al abrir cada conexión.
+# LACOSA_SQLITE_PROFILE elige el perfil:
+#   default: los valores de SQLite (journal de rollback, sincronización FULL)
+#   tuned: WAL, así los lectores (por ejemplo el listado del lobby) no esperan
+#          a las escrituras de las partidas, sincronización NORMAL (en WAL no
+#          se pierde consistencia, sólo las últimas transacciones si se corta
+#          la luz), mmap, caché de páginas más grande y tablas temporales en
+#          memoria.
+#
+# Benchmark: python -m Database.benchmark
+
+import os
+import sqlite3
+
+PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -32 * 1024,  # en KiB: 32 MiB
+        "busy_timeout": 5000,  # ms
+        "temp_store": "MEMORY",
+    },
+}
+
+# Sentencias preparadas que guarda cada conexión (sqlite3 usa 128)
+STATEMENT_CACHE = {
+    "default": 128,
+    "tuned": 512,
+}
+
+PROFILE = os.environ.get("LACOSA_SQLITE_PROFILE", "tuned")
+
+if PROFILE not in PROFILES:
+    raise ValueError(f"Perfil de SQLite desconocido: {PROFILE}")
+
+
+def apply_profile(connection: sqlite3.Connection, profile: str = PROFILE):
+    """Set the pragmas of the profile on a new connection"""
+    cursor = connection.cursor()
+    for pragma, value in PROFILES[profile].items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def connect_kwargs(profile: str = PROFILE) -> dict:
+    """Extra arguments for sqlite3.connect"""
+    return {"cached_statements": STATEMENT_CACHE[profile]}
@@ -1,14 +1,22 @@
 from Database.Database import *
 from Game.game_exception import *
 from connection.connections import WebSocket, ConnectionManager
+from connection.pubsub import bus_from_env
+from connection.shards import ShardRouter
+from connection.lobby_sync import LobbySync
 from typing import Optional
 from Database.models.Card import *
 from Database.models.Player import *
 from Database.models.Match import *
 from Database.models.Deck import *
+from Database.models.Chat import *
 from connection.socket_messages import *
+from Game.match_state import match_states
+from Game.state_versions import state_versions
 
-manager = ConnectionManager()
+manager = ConnectionManager(bus=bus_from_env())
+shard_router = ShardRouter(manager.bus)
+lobby_sync = LobbySync(manager.bus)
 
 
 # Contiene aquellas funciones que son auxiliares a la lógica del juego
@@ -109,6 +117,53 @@ def end_player_turn(player_name: str):
     clear_target_obstacle(match_id)
     set_game_state(match_id, GAME_STATE["DRAW_CARD"])
     decrease_all_quarantines(match_id)
+    match_states.flush(match_id)
+
+
+# ------- Game state push --------
+
+
+def game_state_messages(match_id: int) -> dict:
+    """Current content of each game state message, keyed by message type"""
+    game_state = get_game_state(match_id)
+    messages = {
+        POSITIONS: get_players_positions(get_match_name(match_id)),
+        MATCH_STATE: {
+            "turn": get_player_in_turn(match_id),
+            "game_state": game_state,
+        },
+        DEAD_PLAYERS: get_dead_players(match_id),
+        QUARANTINE: get_quarantined_players(match_id),
+        LOGS_SEQ: get_last_log_seq(match_id),
+    }
+    if game_state == GAME_STATE["WAIT_DEFENSE"]:
+        messages[DEFENSE_STAMP] = get_stamp(match_id)
+    return messages
+
+
+async def send_full_state(match_id: int, player_name: str):
+    """Send the whole game state and its version to one player"""
+    for message_type, content in game_state_messages(match_id).items():
+        await manager.send_message_to(message_type, content, player_name)
+    if get_game_state(match_id) == GAME_STATE["VUELTA_Y_VUELTA"]:
+        selected = int(player_name in get_exchange_json(match_id))
+        await manager.send_message_to(ALREADY_SELECTED, selected, player_name)
+    version = state_versions.get(match_id).version
+    await manager.send_message_to(STATE_VERSION, version, player_name)
+
+
+def logs_record(match_id: int, player_name: str, since: int = 0) -> dict:
+    """Log entries after since visible to the player, with the sequence
+    number of the last entry of the log"""
+    return {
+        "seq": get_last_log_seq(match_id),
+        "logs": get_logs(match_id, player_name, since),
+    }
+
+
+async def send_logs_record(match_id: int, player_name: str, since: int = 0):
+    record = logs_record(match_id, player_name, since)
+    await manager.send_message_to(LOGS_RECORD, record, player_name)
 
 
 # ------- Chat logic --------
@@ -133,18 +188,10 @@ def gen_chat_message(match_id: int, player_name: str, content: str):
 
     return msg
 
-def get_chat_records_for(match_id: int, player_name: str):
-    records = get_chat_record(match_id)
-    filtered_records = []
-    for record in records:
-        if "target" in record:
-            if record["target"] == player_name:
-                del record["target"]
-                filtered_records.append(record)
-        else:
-            filtered_records.append(record)
-    return filtered_records
-        
+def get_chat_records_for(match_id: int, player_name: str, before: int = None):
+    """Page of the chat history visible to the player"""
+    return get_chat_page(match_id, player_name, before)
+
 
 # ------- Pick Card logic --------
 
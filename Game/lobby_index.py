@@ -0,0 +1,195 @@
+# Índice en memoria de las partidas del lobby.
+# Se carga una vez de la base de datos y después lo actualizan las funciones
+# que crean, modifican, inician o borran partidas, así el listado no consulta
+# SQLite en cada pedido. Cada cambio incrementa la versión, que junto con la
+# época del proceso forma el ETag del listado.
+#
+# Las escrituras llegan desde el hilo de la base de datos (y desde el event
+# loop las que hicieron otros procesos, ver connection/lobby_sync.py) y las
+# lecturas desde el event loop: el estado se reemplaza entero en cada cambio (copy-on-write)
+# y los lectores trabajan sobre la referencia que tomaron.
+#
+# La carga es perezosa y corre en un carril de la base mientras otros carriles
+# pueden estar creando o borrando partidas. Hasta que el índice se carga, cada
+# cambio se anota y se aplica sobre lo leído: la lectura puede no ver una
+# transacción que todavía no se confirmó, pero su cambio ya llegó al índice.
+#
+# Los suscriptores (ver connection/lobby_feed.py) reciben cada cambio en el
+# hilo que lo hizo, después de aplicarlo: created, updated, started o deleted.
+
+from bisect import bisect_right
+from secrets import token_hex
+from threading import Lock
+from types import MappingProxyType
+
+# Páginas calculadas que se guardan por versión del índice
+MAX_CACHED_PAGES = 64
+
+CREATED = "created"
+UPDATED = "updated"
+STARTED = "started"
+DELETED = "deleted"
+
+
+class _LobbySnapshot:
+    def __init__(self, version: int, entries: dict):
+        self.version = version
+        # id de la partida -> entrada del listado
+        self.entries = MappingProxyType(entries)
+        self.ids = sorted(entries.keys())
+
+
+class LobbyIndex:
+    def __init__(self):
+        self.epoch = token_hex(4)
+        self.loaded = False
+        self._lock = Lock()
+        self._snapshot = _LobbySnapshot(0, {})
+        self._pages = {}
+        # id de la partida -> entrada (None si se borró), mientras no se cargó
+        self._changes = {}
+        self._listeners: tuple = ()
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def _etag(self, version: int) -> str:
+        return f'"{self.epoch}-{version}"'
+
+    @property
+    def etag(self) -> str:
+        return self._etag(self.version)
+
+    def _replace(self, entries: dict):
+        self._snapshot = _LobbySnapshot(self._snapshot.version + 1, entries)
+        self._pages = {}
+
+    def subscribe(self, listener: callable):
+        """listener(event, entry, version) is called after every change"""
+        self._listeners = self._listeners + (listener,)
+
+    def _notify(self, event: str, entry: dict, version: int):
+        for listener in self._listeners:
+            listener(event, entry, version)
+
+    def load(self, entries: list):
+        """Fill the index with the given entries, read from the database.
+        The changes made since the index was cleared win over them"""
+        with self._lock:
+            if self.loaded:
+                # Otra carga concurrente ganó: lo leído acá puede ser más viejo
+                return
+            loaded = {entry["id"]: entry for entry in entries}
+            for match_id, entry in self._changes.items():
+                if entry is None:
+                    loaded.pop(match_id, None)
+                else:
+                    loaded[match_id] = entry
+            self._changes = {}
+            self._replace(loaded)
+            self.loaded = True
+
+    def put(self, entry: dict):
+        """Add or update the entry of a match"""
+        with self._lock:
+            if not self.loaded:
+                self._changes[entry["id"]] = entry
+            previous = self._snapshot.entries.get(entry["id"])
+            if previous == entry:
+                return
+            entries = dict(self._snapshot.entries)
+            entries[entry["id"]] = entry
+            self._replace(entries)
+            version = self.version
+        if previous is None:
+            event = CREATED
+        elif entry["initiated"] and not previous["initiated"]:
+            event = STARTED
+        else:
+            event = UPDATED
+        self._notify(event, entry, version)
+
+    def remove(self, match_id: int):
+        with self._lock:
+            if not self.loaded:
+                self._changes[match_id] = None
+            entry = self._snapshot.entries.get(match_id)
+            if entry is None:
+                return
+            entries = dict(self._snapshot.entries)
+            del entries[match_id]
+            self._replace(entries)
+            version = self.version
+        self._notify(DELETED, entry, version)
+
+    def get(self, match_id: int) -> dict:
+        return self._snapshot.entries.get(match_id)
+
+    def listing(self) -> tuple[int, list]:
+        """Version and public entries of every match"""
+        snapshot = self._snapshot
+        return snapshot.version, [
+            public_entry(snapshot.entries[match_id]) for match_id in snapshot.ids
+        ]
+
+    def clear(self):
+        """Forget every entry, the index must be loaded again"""
+        with self._lock:
+            self._replace({})
+            self._changes = {}
+            self.loaded = False
+
+    def page(self, params) -> tuple[str, dict]:
+        """ETag and listing of the matches that pass the filters of params
+        (see MatchListParams), starting after params.cursor"""
+        snapshot = self._snapshot
+        key = (snapshot.version, tuple(sorted(params.model_dump().items())))
+        page = self._pages.get(key)
+        if page is None:
+            page = _build_page(snapshot, params)
+            if len(self._pages) >= MAX_CACHED_PAGES:
+                self._pages.clear()
+            self._pages[key] = page
+        return self._etag(snapshot.version), page
+
+
+def public_entry(entry: dict) -> dict:
+    """What clients see of an entry"""
+    return {k: v for k, v in entry.items() if k != "id"}
+
+
+def _passes(entry: dict, params) -> bool:
+    if params.filter == "open" and (
+        entry["initiated"] or entry["players"] >= entry["max_players"]
+    ):
+        return False
+    if params.name and params.name.lower() not in entry["name"].lower():
+        return False
+    if params.has_password is not None and entry["has_password"] != params.has_password:
+        return False
+    if params.min_player_count is not None and entry["players"] < params.min_player_count:
+        return False
+    if params.max_player_count is not None and entry["players"] > params.max_player_count:
+        return False
+    return True
+
+
+def _build_page(snapshot: _LobbySnapshot, params) -> dict:
+    start = 0 if params.cursor is None else bisect_right(snapshot.ids, params.cursor)
+    ids = []
+    for match_id in snapshot.ids[start:]:
+        if _passes(snapshot.entries[match_id], params):
+            ids.append(match_id)
+            if params.limit is not None and len(ids) > params.limit:
+                break
+
+    next_cursor = None
+    if params.limit is not None and len(ids) > params.limit:
+        ids = ids[: params.limit]
+        next_cursor = ids[-1]
+    matches = [public_entry(snapshot.entries[match_id]) for match_id in ids]
+    return {"Matches": matches, "next_cursor": next_cursor}
+
+
+lobby_index = LobbyIndex()
@@ -0,0 +1,567 @@
+from pony.orm import *
+from Database.Database import (
+    Match,
+    Player,
+    MatchCard,
+    ChatMessage,
+    LogEntry,
+    CARD_LOCATION,
+)
+from Database.exceptions import *
+from Database.executor import submit_db, run_db, run_match_db, on_db_thread
+from concurrent.futures import Future, wait
+from bisect import bisect_left, bisect_right
+from functools import partial
+from collections import defaultdict
+from heapq import merge
+from random import Random, sample
+from time import time
+import os
+
+# Estado en memoria de las partidas iniciadas.
+# Mientras una partida está cargada, los objetos de este módulo reemplazan a
+# las entidades de Pony en las funciones de Database/models (exponen los mismos
+# atributos), y la base de datos sólo recibe snapshots al terminar cada turno
+# o cada FLUSH_INTERVAL segundos, escritos en el carril de la partida
+# (Database/executor.py).
+#
+# El registro de partidas y sus objetos sólo se usan desde el event loop: en
+# los hilos de la base el registro aparece vacío y las funciones de
+# Database/models leen las filas. Para cargar una partida se arma su estado
+# en el hilo de la base (read_match_state) y se registra en el loop
+# (load_match).
+
+FLUSH_INTERVAL = float(os.environ.get("LACOSA_FLUSH_INTERVAL", "5"))
+
+MATCH_FIELDS = (
+    "name",
+    "password",
+    "min_players",
+    "max_players",
+    "player_count",
+    "alive_count",
+    "initiated",
+    "clockwise",
+    "current_player",
+    "seed",
+    "shuffles",
+    "game_state",
+    "played_card",
+    "turn_player",
+    "target_player",
+    "target_obstacle",
+    "exchange_card",
+    "exchange_player",
+    "position_exchange_victim",
+    "last_infected",
+    "timestamp",
+    "amount_discarded",
+)
+PLAYER_FIELDS = (
+    "is_host",
+    "position",
+    "rol",
+    "is_alive",
+    "in_game",
+    "in_quarantine",
+)
+
+
+class StateSet:
+    """In-memory stand-in for a Pony Set attribute, keyed by object id"""
+
+    def __init__(self, items=()):
+        self._items = {item.id: item for item in items}
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return getattr(item, "id", None) in self._items
+
+    def add(self, item):
+        self._items[item.id] = item
+
+    def remove(self, item):
+        self._items.pop(item.id, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def copy(self):
+        return StateSet(self)
+
+    def count(self) -> int:
+        return len(self._items)
+
+    def is_empty(self) -> bool:
+        return not self._items
+
+    def filter(self, f: callable):
+        return StateSet(item for item in self if f(item))
+
+    select = filter
+
+    def first(self):
+        return next(iter(self._items.values()), None)
+
+    def random(self, n: int) -> list:
+        items = list(self._items.values())
+        return sample(items, min(n, len(items)))
+
+
+class ChatLog:
+    """Append-only chat of a match. Each message is stored once with its
+    sequence number, and indexed by recipient (None: for every player)"""
+
+    def __init__(self, entries=()):
+        self._entries: dict[int, dict] = {}
+        self._index: dict = defaultdict(list)
+        self._unsaved: list[dict] = []
+        self.last_seq = 0
+        for entry in entries:
+            self._add(entry)
+        self.saved_seq = self.last_seq  # última entrada escrita en la base
+
+    def _add(self, entry: dict):
+        self._entries[entry["seq"]] = entry
+        self._index[entry["target"]].append(entry["seq"])
+        self.last_seq = max(self.last_seq, entry["seq"])
+
+    def append(self, msg_data: dict) -> dict:
+        entry = {
+            "seq": self.last_seq + 1,
+            "author": msg_data.get("author", ""),
+            "message": msg_data.get("message", ""),
+            "timestamp": msg_data.get("timestamp"),
+            "target": msg_data.get("target"),
+        }
+        self._add(entry)
+        self._unsaved.append(entry)
+        return entry
+
+    def _seqs(self, target, before: int, limit: int) -> list:
+        seqs = self._index.get(target, [])
+        end = len(seqs) if before is None else bisect_left(seqs, before)
+        return seqs[max(0, end - limit) : end]
+
+    def page(self, player_name: str, before: int = None, limit: int = 50) -> list:
+        """Last limit messages visible to player_name with seq < before"""
+        seqs = list(
+            merge(
+                self._seqs(None, before, limit),
+                self._seqs(player_name, before, limit),
+            )
+        )[-limit:]
+        return [chat_record(self._entries[seq]) for seq in seqs]
+
+    def unsaved(self) -> list:
+        """Entries not written to the database yet"""
+        self._unsaved = [e for e in self._unsaved if e["seq"] > self.saved_seq]
+        return list(self._unsaved)
+
+    def mark_saved(self, seq: int):
+        # La llama el hilo de la base cuando la escritura terminó: sólo avanza
+        # la marca, las entradas se descartan en el event loop
+        self.saved_seq = max(self.saved_seq, seq)
+
+    def clear(self):
+        # last_seq se conserva: los números de secuencia nunca se reutilizan
+        self._entries.clear()
+        self._index.clear()
+        self._unsaved.clear()
+
+
+class GameLog:
+    """Append-only log of the plays of a match. As in ChatLog, each entry
+    has its sequence number and is indexed by who can see it (None: every
+    player)"""
+
+    def __init__(self, entries=()):
+        self._entries: dict[int, dict] = {}
+        self._index: dict = defaultdict(list)
+        self._unsaved: list[dict] = []
+        self.last_seq = 0
+        for entry in entries:
+            self._add(entry)
+        self.saved_seq = self.last_seq  # última entrada escrita en la base
+
+    def _add(self, entry: dict):
+        self._entries[entry["seq"]] = entry
+        self._index[entry["target"]].append(entry["seq"])
+        self.last_seq = max(self.last_seq, entry["seq"])
+
+    def append(self, text: str, target: str = None) -> dict:
+        entry = {"seq": self.last_seq + 1, "text": text, "target": target}
+        self._add(entry)
+        self._unsaved.append(entry)
+        return entry
+
+    def _seqs(self, target, since: int) -> list:
+        seqs = self._index.get(target, [])
+        return seqs[bisect_right(seqs, since) :]
+
+    def tail(self, player_name: str, since: int = 0) -> list:
+        """Texts of the entries visible to player_name with seq > since"""
+        seqs = merge(self._seqs(None, since), self._seqs(player_name, since))
+        return [self._entries[seq]["text"] for seq in seqs]
+
+    def unsaved(self) -> list:
+        """Entries not written to the database yet"""
+        self._unsaved = [e for e in self._unsaved if e["seq"] > self.saved_seq]
+        return list(self._unsaved)
+
+    def mark_saved(self, seq: int):
+        # La llama el hilo de la base cuando la escritura terminó: sólo avanza
+        # la marca, las entradas se descartan en el event loop
+        self.saved_seq = max(self.saved_seq, seq)
+
+
+def log_entry(entry: LogEntry) -> dict:
+    return {"seq": entry.seq, "text": entry.text, "target": entry.target}
+
+
+def chat_entry(message: ChatMessage) -> dict:
+    return {
+        "seq": message.seq,
+        "author": message.author,
+        "message": message.message,
+        "timestamp": message.timestamp,
+        "target": message.target,
+    }
+
+
+def chat_record(entry: dict) -> dict:
+    """What a player receives of a chat message"""
+    return {
+        "seq": entry["seq"],
+        "author": entry["author"],
+        "message": entry["message"],
+        "timestamp": entry["timestamp"],
+    }
+
+
+class CardState:
+    def __init__(self, card):
+        """card: entry of the card catalog"""
+        self.id = card.id
+        self.card_name = card.card_name
+        self.number = card.number
+        self.type = card.type
+        # La ubicación de la carta es el mazo o la mano que la contiene: sólo
+        # se persiste esa (MatchCard)
+
+
+class DeckState:
+    def __init__(self, match, is_discard: bool):
+        self.id = int(is_discard)
+        self.match = match
+        self.is_discard = is_discard
+        self.cards = StateSet()
+        # Orden de robo, ya mezclado: el último elemento es la cima
+        self.pile: list[CardState] = []
+
+    def shuffle(self):
+        """Materialize a new draw order with the match RNG"""
+        self.pile = sorted(self.cards, key=lambda card: card.id)
+        self.match.shuffles += 1
+        self.match.shuffle_rng().shuffle(self.pile)
+
+    def push(self, card: CardState):
+        """Put the card on top of the deck"""
+        self.cards.add(card)
+        self.pile.append(card)
+
+    def pop(self) -> CardState:
+        """Take the card on top of the deck"""
+        card = self.pile.pop()
+        self.cards.remove(card)
+        return card
+
+
+class PlayerState:
+    def __init__(self, player: Player, match):
+        self.id = player.id
+        self.player_name = player.player_name
+        self.match = match
+        self.cards = StateSet()
+        for field in PLAYER_FIELDS:
+            setattr(self, field, getattr(player, field))
+
+
+class MatchState:
+    def __init__(self, match: Match):
+        self.id = match.id
+        for field in MATCH_FIELDS:
+            setattr(self, field, getattr(match, field))
+        # PostgreSQL devuelve los booleanos de IntArray como 1/0
+        self.obstacles = [bool(o) for o in match.obstacles]
+        self.exchange_json = dict(match.exchange_json)
+        self.chat_log = ChatLog(
+            chat_entry(message) for message in match.chat.order_by(ChatMessage.seq)
+        )
+        self.game_log = GameLog(
+            log_entry(entry) for entry in match.logs.order_by(LogEntry.seq)
+        )
+        self.players = StateSet()
+        self.draw_deck = DeckState(self, is_discard=False)
+        self.discard_deck = DeckState(self, is_discard=True)
+        self.cards = {}
+        self.last_flush = time()
+
+        players = {}
+        for player in sorted(match.players, key=lambda p: p.id):
+            players[player.id] = PlayerState(player, self)
+            self.players.add(players[player.id])
+
+        from Database.models.Card import get_card_entry
+
+        positions = {}
+        for match_card in match.cards:
+            card_state = CardState(get_card_entry(match_card.card))
+            self.cards[card_state.id] = card_state
+            if match_card.location == CARD_LOCATION["HAND"]:
+                player_state = players[match_card.owner.id]
+                player_state.cards.add(card_state)
+            elif match_card.location != CARD_LOCATION["OUT"]:
+                deck_state = self.get_deck(
+                    match_card.location == CARD_LOCATION["DISCARD"]
+                )
+                deck_state.cards.add(card_state)
+                positions[card_state] = match_card.position
+
+        self.draw_deck.pile = sorted(
+            self.draw_deck.cards, key=lambda card: positions[card]
+        )
+
+    def get_card(self, card_id: int) -> CardState:
+        if card_id not in self.cards:
+            raise CardNotFound("Carta no encontrada")
+        return self.cards[card_id]
+
+    def shuffle_rng(self) -> Random:
+        # Cada mezcla tiene su propio RNG, derivado de la semilla y del número
+        # de mezcla: el orden no depende de cuándo se cargó la partida
+        return Random(f"{self.seed}:{self.shuffles}")
+
+    def get_deck(self, is_discard: bool) -> DeckState:
+        return self.discard_deck if is_discard else self.draw_deck
+
+
+def take_snapshot(state: MatchState) -> dict:
+    """Plain copy of a match state, safe to hand to the database thread"""
+    return {
+        "id": state.id,
+        "fields": {field: getattr(state, field) for field in MATCH_FIELDS},
+        "obstacles": list(state.obstacles),
+        "exchange_json": dict(state.exchange_json),
+        "chat": state.chat_log.unsaved(),
+        "logs": state.game_log.unsaved(),
+        "players": [
+            {
+                "id": player.id,
+                "fields": {field: getattr(player, field) for field in PLAYER_FIELDS},
+            }
+            for player in state.players
+        ],
+        "cards": card_locations(state),
+    }
+
+
+def card_locations(state: MatchState) -> dict:
+    """card id -> (CARD_LOCATION, id of the owner, position in the deck)"""
+    locations = {
+        card_id: (CARD_LOCATION["OUT"], None, None) for card_id in state.cards
+    }
+    for card in state.discard_deck.cards:
+        locations[card.id] = (CARD_LOCATION["DISCARD"], None, None)
+    for position, card in enumerate(state.draw_deck.pile):
+        locations[card.id] = (CARD_LOCATION["DECK"], None, position)
+    for player in state.players:
+        for card in player.cards:
+            locations[card.id] = (CARD_LOCATION["HAND"], player.id, None)
+    return locations
+
+
+@db_session
+def write_snapshot(snapshot: dict):
+    """Write a match snapshot to the database in one transaction"""
+    match = Match.get(id=snapshot["id"])
+    if match is None:
+        return
+
+    for field, value in snapshot["fields"].items():
+        setattr(match, field, value)
+    if list(match.obstacles) != snapshot["obstacles"]:
+        match.obstacles = snapshot["obstacles"]
+    if dict(match.exchange_json) != snapshot["exchange_json"]:
+        match.exchange_json = snapshot["exchange_json"]
+
+    saved_seq = max(m.seq for m in ChatMessage if m.match == match) or 0
+    for entry in snapshot["chat"]:
+        if entry["seq"] > saved_seq:
+            ChatMessage(match=match, **entry)
+
+    saved_seq = max(e.seq for e in LogEntry if e.match == match) or 0
+    for entry in snapshot["logs"]:
+        if entry["seq"] > saved_seq:
+            LogEntry(match=match, **entry)
+
+    players = {}
+    for player_data in snapshot["players"]:
+        player = Player[player_data["id"]]
+        players[player.id] = player
+        for field, value in player_data["fields"].items():
+            setattr(player, field, value)
+
+    # Mover una carta es actualizar su fila
+    for match_card in match.cards:
+        location, owner_id, position = snapshot["cards"][match_card.card]
+        owner = match_card.owner.id if match_card.owner is not None else None
+        if (match_card.location, owner, match_card.position) != (
+            location,
+            owner_id,
+            position,
+        ):
+            match_card.location = location
+            match_card.owner = players.get(owner_id)
+            match_card.position = position
+
+
+def _mark_saved(state: MatchState, snapshot: dict, future: Future):
+    """Mark the chat and log entries of the snapshot as saved once it's
+    written. If the write failed they go again in the next snapshot"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    if snapshot["chat"]:
+        state.chat_log.mark_saved(snapshot["chat"][-1]["seq"])
+    if snapshot["logs"]:
+        state.game_log.mark_saved(snapshot["logs"][-1]["seq"])
+
+
+class MatchStateStore:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._matches: dict[int, MatchState] = {}
+        self._names: dict[str, MatchState] = {}
+        self._players: dict[str, PlayerState] = {}
+
+    def add(self, state: MatchState) -> MatchState:
+        """Register the state, unless the match was loaded meanwhile: then
+        the loaded one is kept and returned"""
+        current = self._matches.get(state.id)
+        if current is not None:
+            return current
+        self._matches[state.id] = state
+        self._names[state.name] = state
+        for player in state.players:
+            self._players[player.player_name] = player
+        return state
+
+    def load(self, match_id: int) -> MatchState:
+        """Load the match reading its rows in this thread. On the event loop
+        use load_match, which doesn't block it"""
+        if match_id in self._matches:
+            return self._matches[match_id]
+        state = read_match_state(match_id)
+        return None if state is None else self.add(state)
+
+    def get(self, match_id: int) -> MatchState:
+        if on_db_thread():
+            return None
+        return self._matches.get(match_id)
+
+    def get_by_name(self, match_name: str) -> MatchState:
+        if on_db_thread():
+            return None
+        return self._names.get(match_name)
+
+    def get_player(self, player_name: str) -> PlayerState:
+        if on_db_thread():
+            return None
+        return self._players.get(player_name)
+
+    def is_loaded(self, match_id: int) -> bool:
+        return match_id in self._matches
+
+    def flush(self, match_id: int) -> Future:
+        """Queue a snapshot of the match in its database lane"""
+        state = self._matches.get(match_id)
+        if state is None:
+            return None
+        state.last_flush = time()
+        snapshot = take_snapshot(state)
+        future = submit_db(match_id, write_snapshot, snapshot)
+        future.add_done_callback(partial(_mark_saved, state, snapshot))
+        return future
+
+    def flush_if_due(self, match_id: int):
+        state = self._matches.get(match_id)
+        if state is not None and time() - state.last_flush >= self.flush_interval:
+            self.flush(match_id)
+
+    def flush_all(self, owns: callable = None):
+        """Flush the loaded matches for which owns(match_id) holds (all of
+        them if it's None) and wait for the writes"""
+        futures = [
+            self.flush(match_id)
+            for match_id in list(self._matches.keys())
+            if owns is None or owns(match_id)
+        ]
+        wait(futures)
+
+    def evict(self, match_id: int):
+        state = self._matches.pop(match_id, None)
+        if state is None:
+            return
+        self._names.pop(state.name, None)
+        for player in state.players:
+            self._players.pop(player.player_name, None)
+
+    def clear(self):
+        self._matches.clear()
+        self._names.clear()
+        self._players.clear()
+
+
+match_states = MatchStateStore()
+
+
+@db_session
+def read_match_state(match_id: int) -> MatchState:
+    """State of the started match built from its rows, not registered.
+    None if the match doesn't exist or isn't initiated"""
+    match = Match.get(id=match_id)
+    if match is None or not match.initiated:
+        return None
+    return MatchState(match)
+
+
+async def load_match(match_id: int) -> MatchState:
+    """Load the started match in memory, if it isn't already. Only the
+    worker that owns the match loads it (see connection/shards.py): the
+    others read its rows"""
+    state = match_states.get(match_id)
+    if state is None:
+        state = await run_match_db(match_id, read_match_state, match_id)
+        if state is not None:
+            state = match_states.add(state)
+    return state
+
+
+async def run_for_match(match_id: int, fn: callable, *args):
+    """Calls on a match loaded in memory stay on the event loop, the rest go
+    to the database lane of the match"""
+    if match_states.is_loaded(match_id):
+        return fn(*args)
+    return await run_match_db(match_id, fn, *args)
+
+
+async def run_for_player(player_name: str, fn: callable, *args):
+    """Same as run_for_match, for players of a match loaded in memory"""
+    if match_states.get_player(player_name) is not None:
+        return fn(*args)
+    return await run_db(fn, *args)
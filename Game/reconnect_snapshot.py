@@ -0,0 +1,85 @@
+# Snapshot de reconexión.
+# Un jugador que se conecta a una partida iniciada recibe todo el estado en
+# un único mensaje, armado en una sola sesión de base de datos. La parte
+# común a todos los jugadores (posiciones, obstáculos, cuarentena, turno...)
+# se codifica una vez por versión del estado y la reusan todos los que se
+# conecten con esa versión, por ejemplo al reconectarse todos tras un deploy.
+# Sólo la parte propia del jugador (mano, rol, registro, chat) se arma para
+# cada uno.
+#
+# La versión (ver Game/state_versions.py) no cubre los obstáculos, el
+# sentido ni el sello de defensa, que se envían fuera del estado versionado:
+# también forman parte de la clave.
+
+from pony.orm import db_session
+from Game.app_auxiliars import *
+from connection.serializer import dumps, encode_with_parts
+
+
+class SnapshotCache:
+    def __init__(self):
+        # id de la partida -> (clave, parte común codificada)
+        self._matches: dict[int, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, match_id: int, key: tuple, build: callable) -> str:
+        """Encoded common part of the match for key, built with build() if
+        it isn't cached"""
+        cached = self._matches.get(match_id)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        encoded = build()
+        self._matches[match_id] = (key, encoded)
+        return encoded
+
+    def forget(self, match_id: int):
+        self._matches.pop(match_id, None)
+
+    def clear(self):
+        self._matches.clear()
+        self.hits = self.misses = 0
+
+
+snapshot_cache = SnapshotCache()
+
+
+def _match_part(match_id: int) -> str:
+    messages = game_state_messages(match_id)
+    messages[OBSTACLES] = get_obstacles(match_id)
+    messages[DIRECTION] = get_direction(match_id)
+    messages[DEFENSE_STAMP] = get_stamp(match_id)
+    return dumps(messages).decode("utf-8")
+
+
+@db_session
+def reconnect_snapshot(match_id: int, player_name: str, logs_since: int = 0) -> str:
+    """Encoded snapshot message for the player. Its content has the state
+    version, the common part ("match") and the player's part ("player"),
+    each keyed by the message type it replaces. Pre: the game state of the
+    match was already pushed, so its version is current"""
+    version = state_versions.get(match_id).version
+    key = (
+        version,
+        tuple(get_obstacles(match_id)),
+        get_direction(match_id),
+        get_stamp(match_id),
+    )
+    match_part = snapshot_cache.get(match_id, key, lambda: _match_part(match_id))
+
+    player_part = {
+        INITIAL_STATE: get_game_state_for(player_name),
+        LOGS_RECORD: logs_record(match_id, player_name, logs_since),
+        CHAT_RECORD: get_chat_records_for(match_id, player_name),
+    }
+    if get_game_state(match_id) == GAME_STATE["VUELTA_Y_VUELTA"]:
+        selected = int(player_name in get_exchange_json(match_id))
+        player_part[ALREADY_SELECTED] = selected
+
+    return encode_with_parts(
+        RECONNECT_SNAPSHOT,
+        {"version": version},
+        {"match": match_part, "player": dumps(player_part).decode("utf-8")},
+    )
@@ -0,0 +1,92 @@
+# Índice de los asientos de cada partida.
+# Guarda qué jugador está en cada posición, qué asientos siguen vivos y dónde
+# hay puertas atrancadas, así las consultas de turno, adyacencia y obstáculos
+# se responden en memoria sin recorrer la mesa jugador por jugador. Se
+# invalida al morir un jugador, al intercambiar lugares o al cambiar una
+# puerta.
+#
+# Convenciones de la mesa: a la derecha de la posición p está p + 1 y a la
+# izquierda p - 1. La puerta i está entre los asientos i e i + 1.
+
+from bisect import bisect_left, bisect_right
+
+
+def _rotate(bits: int, shift: int, size: int) -> int:
+    """Rotate a size-bit mask shift places to the right"""
+    full = (1 << size) - 1
+    return ((bits >> shift) | (bits << (size - shift))) & full
+
+
+class SeatRing:
+    """Seats, alive players and doors of a match"""
+
+    def __init__(self, match):
+        players = sorted(match.players, key=lambda p: p.position)
+        self.size = len(players)
+        self.seats = [player.player_name for player in players]
+        self.alive = 0
+        for player in players:
+            if player.is_alive:
+                self.alive |= 1 << player.position
+        self.doors = 0
+        for index, door in enumerate(match.obstacles):
+            if door:
+                self.doors |= 1 << index
+        # Asientos vivos en orden creciente
+        self._order = [p for p in range(self.size) if self.alive >> p & 1]
+
+    def is_alive(self, position: int) -> bool:
+        return bool(self.alive >> position & 1)
+
+    def right(self, position: int, steps: int = 1) -> int:
+        """Seat of the steps-th alive player to the right of position"""
+        first = bisect_right(self._order, position)
+        return self._order[(first + steps - 1) % len(self._order)]
+
+    def left(self, position: int, steps: int = 1) -> int:
+        """Seat of the steps-th alive player to the left of position"""
+        first = bisect_left(self._order, position) - 1
+        return self._order[(first - steps + 1) % len(self._order)]
+
+    def alive_to_left(self, position: int) -> list:
+        """Alive seats other than position, going left from it"""
+        first = bisect_left(self._order, position)
+        seats = self._order[:first][::-1] + self._order[first:][::-1]
+        return [seat for seat in seats if seat != position]
+
+    def door_to_right(self, start: int, end: int) -> int:
+        """First door crossed going right from start to end, -1 if none"""
+        length = (end - start) % self.size
+        doors = _rotate(self.doors, start, self.size) & ((1 << length) - 1)
+        if not doors:
+            return -1
+        return (start + (doors & -doors).bit_length() - 1) % self.size
+
+    def door_to_left(self, start: int, end: int) -> int:
+        """First door crossed going left from start to end, -1 if none"""
+        length = (start - end) % self.size
+        doors = _rotate(self.doors, end, self.size) & ((1 << length) - 1)
+        if not doors:
+            return -1
+        return (end + doors.bit_length() - 1) % self.size
+
+
+class SeatRings:
+    def __init__(self):
+        self._matches: dict = {}
+
+    def get(self, match) -> SeatRing:
+        """Ring of the match, built from it if there is none"""
+        ring = self._matches.get(match.id)
+        if ring is None:
+            ring = self._matches[match.id] = SeatRing(match)
+        return ring
+
+    def invalidate(self, match_id: int):
+        self._matches.pop(match_id, None)
+
+    def clear(self):
+        self._matches.clear()
+
+
+seat_rings = SeatRings()
@@ -0,0 +1,59 @@
+# Versionado del estado de partida enviado a los jugadores.
+# Por cada partida se recuerda el último contenido enviado de cada mensaje de
+# estado, así sólo se envían los que cambiaron. Cada envío con cambios
+# incrementa la versión: si un cliente ve un salto en la versión pide una
+# resincronización completa.
+
+_MISSING = object()
+
+
+class StateVersion:
+    """Last game state pushed to the players of a match"""
+
+    def __init__(self):
+        self.version = 0
+        self._sent = {}
+        self._dirty = False
+
+    def changed(self, key, content) -> bool:
+        """Record content as sent under key. Returns False if it was
+        already the last content sent"""
+        if self._sent.get(key, _MISSING) == content:
+            return False
+        self._sent[key] = content
+        self._dirty = True
+        return True
+
+    def discard(self, message_type: str):
+        """Forget the per-player contents of a message type"""
+        for key in list(self._sent.keys()):
+            if isinstance(key, tuple) and key[0] == message_type:
+                del self._sent[key]
+
+    def commit(self) -> bool:
+        """Close a push. Returns True if it changed something, in which case
+        the version is incremented"""
+        if not self._dirty:
+            return False
+        self._dirty = False
+        self.version += 1
+        return True
+
+
+class StateVersions:
+    def __init__(self):
+        self._matches: dict[int, StateVersion] = {}
+
+    def get(self, match_id: int) -> StateVersion:
+        if match_id not in self._matches:
+            self._matches[match_id] = StateVersion()
+        return self._matches[match_id]
+
+    def forget(self, match_id: int):
+        self._matches.pop(match_id, None)
+
+    def clear(self):
+        self._matches.clear()
+
+
+state_versions = StateVersions()
@@ -31,3 +31,10 @@ def get_random_string_num(length):
     num = string.digits
     result_str = "".join(random.choice(num) for i in range(length))
     return result_str
+
+
+# First catalog id of a card with the given name
+def card_id_by_name(card_name):
+    from Database.models.Card import CARD_CATALOG
+
+    return next(e.id for e in CARD_CATALOG.values() if e.card_name == card_name)
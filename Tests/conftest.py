@@ -0,0 +1,16 @@
+import pytest
+from Game.match_state import match_states
+from Game.state_versions import state_versions
+from Game.seat_ring import seat_rings
+from Game.lobby_index import lobby_index
+from Game.reconnect_snapshot import snapshot_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_match_states():
+    yield
+    match_states.clear()
+    state_versions.clear()
+    seat_rings.clear()
+    lobby_index.clear()
+    snapshot_cache.clear()
@@ -3,7 +3,6 @@ from unittest import TestCase
 from Database.Database import *
 from app import *
 from app import (
-    _send_initial_state,
     _send_lobby_players,
     _send_game_state,
 )
@@ -24,6 +23,8 @@ class _WebStub:
             "match_name": "match1",
             "player_name": "player1",
         }
+        self.query_params = {}
+        self.scope = {}
 
     async def accept(self):
         self.accepted = True
@@ -50,49 +51,6 @@ class _WebStub:
 socket = _WebStub()
 
 
-@pytest.mark.asyncio
-async def test_send_initial_state(mocker):
-    socket.reset()
-    mocker.patch("app.get_match_name", return_value="match1")
-    game_state = mocker.patch("app.get_game_state_for")
-    players_pos = mocker.patch("app.get_players_positions")
-    obstacles = mocker.patch("app.get_obstacles")
-    quarantined_players = mocker.patch("app.get_quarantined_players")
-    direction = mocker.patch("app.get_direction")
-    stamp = mocker.patch("app.get_stamp")
-    logs = mocker.patch("app.get_logs")
-    game_state.return_value = {
-        "hand": ["Card1", "Card2", "Card3", "Card4"],
-        "locations": [0, 1, 2, 3],
-        "current_turn": 1,
-        "role": ROL["HUMANO"],
-    }
-    players_pos.return_value = [0, 1, 2, 3]
-    obstacles.return_value = [False, False, True, False]
-    quarantined_players.return_value = {
-        "player1": 0,
-        "player2": 1,
-        "player3": 2,
-        "player4": 3,
-    }
-    direction.return_value = 1
-    stamp.return_value = 1
-    logs.return_value = ["log1", "log2", "log3", "log4"]
-
-    mocker.patch("app.manager.send_message_to", side_effect=socket.send_message_to)
-    mocker.patch("app.manager.broadcast", side_effect=socket.broadcast)
-    await _send_initial_state(1, "player1")
-
-    assert socket.buff_size() == 7
-    assert socket.get(0) == game_state.return_value
-    assert socket.get(1) == players_pos.return_value
-    assert socket.get(2) == obstacles.return_value
-    assert socket.get(3) == quarantined_players.return_value
-    assert socket.get(4) == direction.return_value
-    assert socket.get(5) == stamp.return_value
-    assert socket.get(6) == logs.return_value
-
-
 @pytest.mark.asyncio
 async def test_send_lobby_players(mocker):
     socket.reset()
@@ -107,40 +65,93 @@ async def test_send_lobby_players(mocker):
     assert socket.get(0) == ["player1", "player2", "player3", "player4"]
 
 
+def _mock_game_state(mocker, game_state):
+    mocker.patch("Game.app_auxiliars.get_match_name", return_value="match1")
+    mocker.patch("Game.app_auxiliars.get_game_state", return_value=game_state)
+    mocker.patch("app.get_game_state", return_value=game_state)
+    mocker.patch.object(match_states, "is_loaded", return_value=True)
+    mocker.patch("Game.app_auxiliars.get_player_in_turn", return_value=2)
+    mocker.patch("Game.app_auxiliars.get_dead_players", return_value=["player2"])
+    mocker.patch(
+        "Game.app_auxiliars.get_players_positions", return_value=[0, 1, 2, 3]
+    )
+    mocker.patch(
+        "Game.app_auxiliars.get_quarantined_players",
+        return_value={"player1": 0, "player2": 1, "player3": 2, "player4": 3},
+    )
+    mocker.patch("Game.app_auxiliars.get_stamp", return_value=1)
+    mocker.patch("Game.app_auxiliars.get_last_log_seq", return_value=7)
+
+
 @pytest.mark.asyncio
 async def test_send_game_state(mocker):
     socket.reset()
-    mocker.patch("app.get_match_name", return_value="match1")
-    game_state = mocker.patch(
-        "app.get_game_state", return_value=GAME_STATE["WAIT_DEFENSE"]
-    )
-    mocker.patch("app.get_game_state_for", return_value=game_state.return_value)
-    mocker.patch("app.get_player_in_turn", return_value=2)
-    dead_players = mocker.patch("app.get_dead_players", return_value=["player2"])
-    players_pos = mocker.patch("app.get_players_positions")
-    quarantined_players = mocker.patch("app.get_quarantined_players")
+    _mock_game_state(mocker, GAME_STATE["WAIT_DEFENSE"])
     mocker.patch("app.manager.broadcast", side_effect=socket.broadcast)
-    stamp = mocker.patch("app.get_stamp", return_value=1)
-
-    players_pos.return_value = [0, 1, 2, 3]
-    quarantined_players.return_value = {
-        "player1": 0,
-        "player2": 1,
-        "player3": 2,
-        "player4": 3,
-    }
 
     await _send_game_state(1)
 
-    assert socket.buff_size() == 5
-    assert socket.get(0) == players_pos.return_value
+    assert socket.buff_size() == 7
+    assert socket.get(0) == [0, 1, 2, 3]
     assert socket.get(1) == {
         "turn": 2,
-        "game_state": game_state.return_value,
+        "game_state": GAME_STATE["WAIT_DEFENSE"],
     }
-    assert socket.get(2) == dead_players.return_value
-    assert socket.get(3) == quarantined_players.return_value
-    assert socket.get(4) == stamp.return_value
+    assert socket.get(2) == ["player2"]
+    assert socket.get(3) == {"player1": 0, "player2": 1, "player3": 2, "player4": 3}
+    assert socket.get(4) == 7  # Última entrada del registro
+    assert socket.get(5) == 1
+    assert socket.get(6) == 1  # Versión del estado
+
+
+@pytest.mark.asyncio
+async def test_send_game_state_only_changes(mocker):
+    socket.reset()
+    _mock_game_state(mocker, GAME_STATE["WAIT_DEFENSE"])
+    broadcast = mocker.patch("app.manager.broadcast", side_effect=socket.broadcast)
+
+    await _send_game_state(1)
+    socket.reset()
+    await _send_game_state(1)
+    assert socket.buff_size() == 0
+
+    mocker.patch("Game.app_auxiliars.get_dead_players", return_value=["player3"])
+    await _send_game_state(1)
+
+    assert socket.messages == [["player3"], 2]
+    assert broadcast.call_args_list[-2].args[0] == DEAD_PLAYERS
+    assert broadcast.call_args_list[-1].args[0] == STATE_VERSION
+
+
+@pytest.mark.asyncio
+async def test_send_full_state(mocker):
+    socket.reset()
+    _mock_game_state(mocker, GAME_STATE["PLAY_TURN"])
+    mocker.patch("app.manager.broadcast", side_effect=socket.broadcast)
+    send_message_to = mocker.patch(
+        "Game.app_auxiliars.manager.send_message_to",
+        side_effect=socket.send_message_to,
+    )
+    await _send_game_state(1)
+    socket.reset()
+
+    await handle_request(
+        json.dumps({"message_type": RESYNC, "message_content": {}}),
+        1,
+        "player1",
+        socket,
+    )
+
+    assert [call.args[0] for call in send_message_to.call_args_list] == [
+        POSITIONS,
+        MATCH_STATE,
+        DEAD_PLAYERS,
+        QUARANTINE,
+        LOGS_SEQ,
+        STATE_VERSION,
+    ]
+    assert all(call.args[2] == "player1" for call in send_message_to.call_args_list)
+    assert socket.get(5) == 1
 
 
 @pytest.mark.asyncio
@@ -192,5 +203,41 @@ async def test_websocket_exception(mocker):
     socket.reset()
     mocker.patch("app.manager.connect", side_effect=Exception)
     mocker.patch("app.get_match_id", return_value=1)
+    disconnect = mocker.patch("app.manager.disconnect")
     await websocket_endpoint(socket)
     assert socket.accepted == False
+    disconnect.assert_called_once_with("player1", 1, socket)
+
+
+@pytest.mark.asyncio
+async def test_player_request_finishes_match(mocker):
+    mocker.patch("app.match_exists", return_value=True)
+    mocker.patch("app._is_match_initiated", return_value=False)
+    mocker.patch("app.handle_request", side_effect=FinishedMatchException)
+    delete_match = mocker.patch("app.delete_match")
+    send_game_state = mocker.patch("app._send_game_state")
+
+    finished = await shard_router.call(1, PLAYER_REQUEST, "match1", "player1", "{}")
+
+    assert finished
+    assert delete_match.called
+    assert send_game_state.called
+
+
+
+@pytest.mark.asyncio
+async def test_player_request_loads_started_match(mocker):
+    mocker.patch("app.match_exists", return_value=True)
+    mocker.patch("app._is_match_initiated", return_value=True)
+    calls = []
+    load_match = mocker.patch(
+        "app.load_match", side_effect=lambda *args: calls.append("load")
+    )
+    mocker.patch("app.handle_request", side_effect=lambda *args: calls.append("request"))
+    mocker.patch("app._send_game_state")
+
+    finished = await shard_router.call(1, PLAYER_REQUEST, "match1", "player1", "{}")
+
+    assert not finished
+    load_match.assert_called_once_with(1)
+    assert calls == ["load", "request"]
@@ -144,44 +144,14 @@ class test_gen_chat_message(TestCase):
 
 
 class test_get_chat_records_for(TestCase):
-    @patch("Game.app_auxiliars.get_chat_record")
-    def test_get_chat_record_for(self, mock_get_chat_record):
-        records = [
-            {
-                "author": "player1",
-                "message": "message1",
-                "timestamp": 1,
-            },
-            {
-                "author": "player2",
-                "message": "message2",
-                "timestamp": 2,
-                "target": "player1",
-            },
-            {
-                "author": "player3",
-                "message": "message3",
-                "timestamp": 3,
-                "target": "player2",
-            },
-        ]
-        expected = [
-            {
-                "author": "player1",
-                "message": "message1",
-                "timestamp": 1,
-            },
-            {
-                "author": "player2",
-                "message": "message2",
-                "timestamp": 2,
-            }
-        ]
-        mock_get_chat_record.return_value = records
-        filtered = get_chat_records_for(1, "player1")
-
-        mock_get_chat_record.assert_called_once_with(1)
-        self.assertEqual(filtered, expected)
+    @patch("Game.app_auxiliars.get_chat_page")
+    def test_get_chat_record_for(self, mock_get_chat_page):
+        page = [{"seq": 1, "author": "player1", "message": "message1", "timestamp": 1}]
+        mock_get_chat_page.return_value = page
+
+        self.assertEqual(get_chat_records_for(1, "player1"), page)
+        self.assertEqual(get_chat_records_for(1, "player1", 10), page)
+        mock_get_chat_page.assert_called_with(1, "player1", 10)
 
 
 class test_toggle_positions_in_pairs(TestCase):
@@ -6,6 +6,7 @@ from unittest.mock import AsyncMock
 from Game.app_auxiliars import *
 import random
 from time import time
+from Tests.auxiliar_functions import card_id_by_name
 from Game.app_auxiliars import (
     _omit_revelaciones,
     _reveal_hand,
@@ -412,7 +413,6 @@ class TestDiscardCard(TestCase):
         player = Mock()
         card = Mock()
         player.cards = set({card})
-        card.player = set({player})
         discard_deck = Mock()
         discard_deck.cards = set({})
 
@@ -841,42 +841,30 @@ class test_play_olvidadizo(TestCase):
 
 
 class test_can_target_caster(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="SomeCard")
-    def test_can_target_caster(self, mock_get_card_name):
-        card_id = 1
-        res = can_target_caster(card_id)
-        mock_get_card_name.assert_called_once_with(card_id)
+    def test_can_target_caster_false(self):
+        res = can_target_caster(card_id_by_name("Lanzallamas"))
         self.assertEqual(res, False)
 
-    @patch("Database.models.Card.get_card_name", return_value="Uno, dos..")
-    def test_can_target_caster(self, mock_get_card_name):
-        card_id = 1
-        res = can_target_caster(card_id)
-        mock_get_card_name.assert_called_once_with(card_id)
+    def test_can_target_caster(self):
+        res = can_target_caster(card_id_by_name("Uno, dos.."))
         self.assertEqual(res, True)
 
 
 class test_get_card_by_id(TestCase):
-    @patch("Database.models.Card.Card.exists")
-    def test_get_card_by_id_not_exist(self, mock_get_card_by_id):
-        card_id = 1
-        mock_get_card_by_id.return_value = False
+    def test_get_card_by_id_not_exist(self):
+        card_id = amount_cards() + 1
         with self.assertRaises(CardNotFound) as e:
             get_card_by_id(card_id)
         self.assertEqual(str(e.exception), "Carta no encontrada")
 
 
 class test_allows_global_exchange(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_allows_global_exchange(self, *args):
-        card_id = 1
-        res = allows_global_exchange(card_id)
+    def test_allows_global_exchange_false(self):
+        res = allows_global_exchange(card_id_by_name("Lanzallamas"))
         self.assertEqual(res, False)
 
-    @patch("Database.models.Card.get_card_name", return_value="Seducción")
-    def test_allows_global_exchange(self, *args):
-        card_id = 2
-        res = allows_global_exchange(card_id)
+    def test_allows_global_exchange(self):
+        res = allows_global_exchange(card_id_by_name("Seducción"))
         self.assertEqual(res, True)
 
     def test_allows_global_exchange_none(self, *args):
@@ -0,0 +1,84 @@
+from unittest import TestCase
+from Database.Database import *
+from Tests.auxiliar_functions import *
+from Game.app_auxiliars import *
+from Game.match_state import match_states, ChatLog
+from Tests.test_match_state import _start_match, _query_count
+
+
+def _create_lobby(n_players: int = 3):
+    match_name = generate_unique_testing_name()
+    players = [generate_unique_testing_name() for _ in range(n_players)]
+    for player in players:
+        create_player(player)
+    db_create_match(match_name, players[0], 4, 12)
+    for player in players[1:]:
+        db_add_player(player, match_name)
+    return get_match_id(match_name), players
+
+
+def _msg(author: str, message: str, target: str = None) -> dict:
+    msg = {"author": author, "message": message, "timestamp": 1.0}
+    if target is not None:
+        msg["target"] = target
+    return msg
+
+
+class test_chat_log(TestCase):
+    def test_page_by_recipient(self):
+        chat = ChatLog()
+        chat.append(_msg("a", "para todos"))
+        chat.append(_msg("", "a b", target="b"))
+        chat.append(_msg("", "a c", target="c"))
+        chat.append(_msg("b", "otra para todos"))
+
+        page = chat.page("b")
+        self.assertEqual([m["seq"] for m in page], [1, 2, 4])
+        self.assertNotIn("target", page[0])
+        self.assertEqual([m["seq"] for m in chat.page("c", limit=2)], [3, 4])
+        self.assertEqual([m["seq"] for m in chat.page("b", before=4, limit=1)], [2])
+        self.assertEqual(chat.page("b", before=1), [])
+
+    def test_clear_keeps_sequence(self):
+        chat = ChatLog()
+        chat.append(_msg("a", "1"))
+        chat.clear()
+        self.assertEqual(chat.page("a"), [])
+        self.assertEqual(chat.append(_msg("a", "2"))["seq"], 2)
+
+
+class test_chat_store(TestCase):
+    def test_lobby_chat(self):
+        match_id, players = _create_lobby()
+        save_chat_message(match_id, _msg(players[0], "hola"))
+        save_chat_message(match_id, _msg("", "privado", target=players[1]))
+        save_chat_message(match_id, _msg(players[2], "chau"))
+
+        page = get_chat_page(match_id, players[1])
+        self.assertEqual([m["message"] for m in page], ["hola", "privado", "chau"])
+        page = get_chat_page(match_id, players[2])
+        self.assertEqual([m["seq"] for m in page], [1, 3])
+        page = get_chat_page(match_id, players[1], before=3, limit=1)
+        self.assertEqual([m["message"] for m in page], ["privado"])
+
+        reset_chat_record(match_id)
+        self.assertEqual(get_chat_page(match_id, players[1]), [])
+
+    def test_started_match_chat(self):
+        match_id, players = _start_match()
+        before = _query_count()
+        save_chat_message(match_id, _msg(players[0], "hola"))
+        save_chat_message(match_id, _msg("", "privado", target=players[1]))
+        self.assertEqual(len(get_chat_page(match_id, players[1])), 2)
+        self.assertEqual(_query_count(), before)
+
+        match_states.flush(match_id).result()
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        page = get_chat_page(match_id, players[1])
+        self.assertEqual([m["message"] for m in page], ["hola", "privado"])
+        self.assertEqual(len(get_chat_page(match_id, players[2])), 1)
+        self.assertEqual(
+            match_states.load(match_id).chat_log.page(players[1]), page
+        )
@@ -2,6 +2,11 @@ from Game.app_auxiliars import *
 from Tests.auxiliar_functions import *
 from connection.connections import *
 import pytest
+import asyncio
+import json
+from connection import serializer
+from connection.serializer import encode_message
+from connection.socket_messages import BATCH
 from Game.app_auxiliars import *
 
 
@@ -14,8 +19,8 @@ class _WebStub:
     async def accept(self):
         self.accepted = True
 
-    async def send_json(self, msg):
-        self.messages.append(msg)
+    async def send_text(self, frame):
+        self.messages.append(json.loads(frame))
 
     def buff_size(self):
         return len(self.messages)
@@ -158,6 +163,26 @@ async def test_send_send_message_to(mocker):
     assert websocket_stub.buff_size() == 1
 
 
+@pytest.mark.asyncio
+async def test_infected_log_is_only_for_the_infected(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+    mocker.patch("connection.connections.get_player_match", return_value=1)
+    save_log = mocker.patch("connection.connections.save_log")
+
+    websocket_stub = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(websocket_stub, 1, "test_player")
+
+    await cm.send_message_to(INFECTED, "", "test_player")
+
+    save_log.assert_called_once_with(1, INFECTED_LOG, "test_player")
+    assert websocket_stub.messages == [
+        {"message_type": INFECTED, "message_content": ""},
+        {"message_type": PLAY_NOTIFICATION, "message_content": INFECTED_LOG},
+    ]
+
+
 @pytest.mark.asyncio
 async def test_send_error_message(mocker):
     mocker.patch("connection.connections.check_match_existence", return_value=True)
@@ -210,3 +235,304 @@ async def test_broadcast(mocker):
     }
     assert mocked_websocketp1.buff_size() == 1
     assert mocked_websocketp2.buff_size() == 1
+
+
+
+@pytest.mark.asyncio
+async def test_broadcast_persists_only_chat(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+    run_for_match = mocker.patch("connection.connections.run_for_match")
+
+    cm = ConnectionManager()
+    await cm.connect(_WebStub(), 1, "test_player")
+
+    await cm.broadcast("test_type", "test_content", 1)
+    run_for_match.assert_not_called()
+
+    await cm.broadcast(CHAT_NOTIFICATION, {"message": "hola"}, 1)
+    run_for_match.assert_called_once_with(
+        1, cm.persist_broadcast, CHAT_NOTIFICATION, {"message": "hola"}, 1
+    )
+
+class _SlowWebStub(_WebStub):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.closed = False
+
+    async def send_text(self, frame):
+        await asyncio.sleep(self.delay)
+        self.messages.append(json.loads(frame))
+
+    async def close(self):
+        self.closed = True
+
+
+class _BrokenWebStub(_WebStub):
+    async def send_text(self, frame):
+        raise RuntimeError("Socket closed")
+
+
+@pytest.mark.asyncio
+async def test_broadcast_isolates_failed_sockets(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    match_id = 1
+    healthy = _WebStub()
+    broken = _BrokenWebStub()
+    slow = _SlowWebStub(delay=1)
+
+    cm = ConnectionManager(send_timeout=0.05)
+
+    await cm.connect(broken, match_id, "broken")
+    await cm.connect(healthy, match_id, "healthy")
+    await cm.connect(slow, match_id, "slow")
+
+    report = await cm.broadcast("test_type", "test_content", match_id)
+    await asyncio.sleep(0)
+
+    assert report == BroadcastReport(delivered=1, timed_out=1, failed=1)
+    assert healthy.buff_size() == 1
+    assert list(cm.connections[match_id].keys()) == ["healthy"]
+    assert slow.closed
+
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_concurrently(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    match_id = 1
+    sockets = [_SlowWebStub(delay=0.05) for _ in range(12)]
+
+    cm = ConnectionManager()
+    for i, socket in enumerate(sockets):
+        await cm.connect(socket, match_id, f"player{i}")
+
+    start = asyncio.get_running_loop().time()
+    report = await cm.broadcast("test_type", "test_content", match_id)
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert report.delivered == 12
+    assert elapsed < 0.05 * 6
+    assert all(socket.buff_size() == 1 for socket in sockets)
+
+
+@pytest.mark.asyncio
+async def test_send_personal_message_evicts_failed_socket(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    match_id = 1
+    player_name = "test_player"
+    cm = ConnectionManager()
+    await cm.connect(_BrokenWebStub(), match_id, player_name)
+
+    await cm.send_personal_message("test_type", "test_content", match_id, player_name)
+
+    assert player_name not in cm.connections[match_id].keys()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_once(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+    encode = mocker.patch(
+        "connection.connections.encode_message", side_effect=encode_message
+    )
+
+    match_id = 1
+    sockets = [_WebStub() for _ in range(5)]
+    cm = ConnectionManager()
+    for i, socket in enumerate(sockets):
+        await cm.connect(socket, match_id, f"player{i}")
+
+    await cm.broadcast("test_type", {"turno": "ñandú"}, match_id)
+
+    encode.assert_called_once()
+    for socket in sockets:
+        assert socket.get(0) == {
+            "message_type": "test_type",
+            "message_content": {"turno": "ñandú"},
+        }
+
+
+def test_stdlib_encoder_format():
+    msg = {"message_type": "chat", "message_content": {"texto": "cañón", "n": [1]}}
+    expected = json.dumps(msg, separators=(",", ":"), ensure_ascii=False)
+    assert encode_message("chat", msg["message_content"]) == expected
+    assert serializer._stdlib_dumps(msg) == expected.encode("utf-8")
+    # Mismo JSON que WebSocket.send_json, que escapa los caracteres no ASCII
+    assert json.loads(expected) == json.loads(json.dumps(msg, separators=(",", ":")))
+
+
+@pytest.mark.asyncio
+async def test_connections_copy_on_write(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    cm = ConnectionManager()
+    await cm.connect(_WebStub(), 1, "player1")
+    snapshot = cm.connections[1]
+
+    await cm.connect(_WebStub(), 1, "player2")
+    await cm.connect(_WebStub(), 2, "player3")
+    cm.disconnect("player1", 1)
+
+    assert list(snapshot.keys()) == ["player1"]
+    assert list(cm.connections[1].keys()) == ["player2"]
+    assert list(cm.connections[2].keys()) == ["player3"]
+    with pytest.raises(TypeError):
+        cm.connections[1]["player4"] = _WebStub()
+
+
+@pytest.mark.asyncio
+async def test_disconnect_keeps_reconnected_socket(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    old_socket = _WebStub()
+    new_socket = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(old_socket, 1, "test_player")
+    await cm.connect(new_socket, 1, "test_player")
+
+    cm.disconnect("test_player", 1, old_socket)
+    assert cm.connections[1]["test_player"] is new_socket
+
+    cm.disconnect("test_player", 1, new_socket)
+    assert 1 not in cm.connections
+
+
+@pytest.mark.asyncio
+async def test_batch_sends_single_frame_in_order(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    match_id = 1
+    socket1 = _WebStub()
+    socket2 = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(socket1, match_id, "player1")
+    await cm.connect(socket2, match_id, "player2")
+
+    async with cm.batch(match_id):
+        await cm.broadcast("first", 1, match_id)
+        await cm.send_personal_message("personal", 2, match_id, "player1")
+        async with cm.batch(match_id):
+            await cm.broadcast("third", 3, match_id)
+        assert socket1.buff_size() == 0
+
+    assert socket1.messages == [
+        {
+            "message_type": BATCH,
+            "message_content": [
+                {"message_type": "first", "message_content": 1},
+                {"message_type": "personal", "message_content": 2},
+                {"message_type": "third", "message_content": 3},
+            ],
+        }
+    ]
+    assert socket2.messages == [
+        {
+            "message_type": BATCH,
+            "message_content": [
+                {"message_type": "first", "message_content": 1},
+                {"message_type": "third", "message_content": 3},
+            ],
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_single_message_is_not_wrapped(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    socket = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(socket, 1, "player1")
+
+    async with cm.batch(1):
+        await cm.broadcast("test_type", "test_content", 1)
+    async with cm.batch(1):
+        pass
+
+    assert socket.messages == [
+        {"message_type": "test_type", "message_content": "test_content"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_have_their_own_batch(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    socket = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(socket, 1, "player1")
+    release = asyncio.Event()
+
+    async def slow_request():
+        async with cm.batch(1):
+            await cm.broadcast("slow", 1, 1)
+            await release.wait()
+
+    slow = asyncio.ensure_future(slow_request())
+    await asyncio.sleep(0)
+    async with cm.batch(1):
+        await cm.broadcast("fast", 2, 1)
+
+    assert socket.messages == [{"message_type": "fast", "message_content": 2}]
+    release.set()
+    await slow
+    assert socket.get(1) == {"message_type": "slow", "message_content": 1}
+
+
+@pytest.mark.asyncio
+async def test_error_goes_in_the_batch(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    socket = _WebStub()
+    cm = ConnectionManager()
+    await cm.connect(socket, 1, "player1")
+
+    async with cm.batch(1):
+        await cm.broadcast("first", 1, 1)
+        await cm.send_error_message("test_error", PlayerSocket(cm, 1, "player1"))
+
+    assert socket.messages == [
+        {
+            "message_type": BATCH,
+            "message_content": [
+                {"message_type": "first", "message_content": 1},
+                {"message_type": "error", "message_content": "test_error"},
+            ],
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_window_joins_batches(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+    socket = _WebStub()
+    cm = ConnectionManager(batch_window=0.05)
+    await cm.connect(socket, 1, "player1")
+
+    async with cm.batch(1):
+        await cm.broadcast("first", 1, 1)
+    async with cm.batch(1):
+        await cm.broadcast("second", 2, 1)
+    assert socket.buff_size() == 0
+
+    await asyncio.sleep(0.1)
+    assert socket.buff_size() == 1
+    assert [msg["message_type"] for msg in socket.get(0)["message_content"]] == [
+        "first",
+        "second",
+    ]
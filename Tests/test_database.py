@@ -12,10 +12,33 @@ from Tests.test_deck import _pset
 from Database.models.Match import (
     _is_adyacent,
 )
+from Game.seat_ring import seat_rings
+from Game.match_state import match_states
 
 # python3 -m unittest Tests.test_database
 
 
+def _seated_match(num_players: int, dead=(), obstacles=None) -> Mock:
+    """Started match whose players p0, p1, ... sit in that order"""
+    match = Mock()
+    match.id = 1
+    match.clockwise = True
+    match.players = []
+    for position in range(num_players):
+        player = Mock()
+        player.player_name = f"p{position}"
+        player.position = position
+        player.is_alive = position not in dead
+        player.match = match
+        match.players.append(player)
+    match.obstacles = obstacles or [False] * num_players
+    return match
+
+
+def _position_of(player_name: str) -> int:
+    return int(player_name[1:])
+
+
 class test_db_create_match(TestCase):
     def test_db_create_match(self):
         player_name = generate_unique_testing_name()
@@ -112,6 +135,7 @@ class test_db_add_player(TestCase):
 
         mock_match = Mock()
         mock_match.players = set()
+        mock_match.player_count = 0
         mock_match.max_players = max_players
         mock_get_match.return_value = mock_match
 
@@ -121,6 +145,7 @@ class test_db_add_player(TestCase):
         mock_get_match.assert_called_once_with(match_name)
         self.assertEqual(mock_player.match, mock_match)
         self.assertEqual(mock_match.players, {mock_player})
+        self.assertEqual(mock_match.player_count, 1)
 
     @patch("Database.models.Match.get_player_by_name")
     @patch("Database.models.Match._get_match_by_name")
@@ -157,6 +182,7 @@ class test_db_add_player(TestCase):
 
         mock_match = Mock()
         mock_match.players = {Mock() for _ in range(max_players)}
+        mock_match.player_count = max_players
         mock_match.max_players = max_players
         mock_get_match.return_value = mock_match
 
@@ -171,11 +197,13 @@ class test_db_add_player(TestCase):
 
 
 class test_pick_random_card(TestCase):
-    @patch("Database.models.Deck.is_there_top_card", return_value=False)
+    @patch("Database.models.Deck.new_deck_from_discard")
     @patch("Database.models.Deck.is_deck_empty", return_value=False)
     @patch("Database.models.Deck.get_player_by_name")
     @patch("Database.models.Deck.get_deck")
-    def test_pick_random_card(self, mock_get_deck, mock_get_player, *args):
+    def test_pick_random_card(
+        self, mock_get_deck, mock_get_player, mock_is_deck_empty, mock_new_deck
+    ):
         mock_player = Mock()
         mock_deck = Mock()
         mock_player.cards = set()
@@ -185,54 +213,36 @@ class test_pick_random_card(TestCase):
 
         mock_card = Mock()
         mock_card.id = 2
-        mock_deck.cards.random.return_value = [mock_card]
+        mock_deck.pop.return_value = mock_card
 
         card_id = pick_random_card("test_player")
 
         mock_get_player.assert_called_once_with("test_player")
         mock_get_deck.assert_called_once_with(mock_player.match.id)
-        mock_deck.cards.random.assert_called_once_with(1)
-        mock_deck.cards.remove.assert_called_once_with(mock_card)
+        mock_deck.pop.assert_called_once_with()
+        mock_new_deck.assert_not_called()
         assert mock_card in mock_player.cards
         self.assertEqual(card_id, mock_card.id)
 
-    @patch("Database.models.Deck.is_there_top_card", return_value=True)
-    @patch("Database.models.Deck.is_deck_empty", return_value=False)
-    @patch("Database.models.Deck.pop_top_card", return_value=1)
-    @patch("Database.models.Deck.get_card_by_id")
+    @patch("Database.models.Deck.new_deck_from_discard")
+    @patch("Database.models.Deck.is_deck_empty", return_value=True)
     @patch("Database.models.Deck.get_player_by_name")
     @patch("Database.models.Deck.get_deck")
-    def test_pick_random_card_top(
-        self,
-        mock_get_deck,
-        mock_get_player,
-        mock_get_card,
-        mock_pop_top_card,
-        mock_is_deck_empty,
-        mock_is_there_top_card,
+    def test_pick_random_card_empty_deck(
+        self, mock_get_deck, mock_get_player, mock_is_deck_empty, mock_new_deck
     ):
         mock_player = Mock()
         mock_player.cards = set()
-
-        mock_deck = Mock()
-
         mock_get_player.return_value = mock_player
-        mock_get_deck.return_value = mock_deck
 
         mock_card = Mock()
         mock_card.id = 1
-
-        mock_get_card.return_value = mock_card
+        mock_get_deck.return_value.pop.return_value = mock_card
 
         card_id = pick_random_card("test_player")
 
-        mock_get_player.assert_called_once_with("test_player")
-        mock_get_deck.assert_not_called()
-        mock_deck.cards.random.assert_not_called()
-        mock_deck.cards.remove.assert_not_called()
-        mock_pop_top_card.assert_called_once_with(mock_player.match.id)
         mock_is_deck_empty.assert_called_once_with(mock_player.match.id)
-        mock_is_there_top_card.assert_called_once_with(mock_player.match.id)
+        mock_new_deck.assert_called_once_with(mock_player.match.id)
         assert mock_card in mock_player.cards
         self.assertEqual(card_id, mock_card.id)
 
@@ -257,6 +267,7 @@ class test_new_deck_from_discard(TestCase):
         mock_get_deck.assert_called_once_with(1)
         mock_get_discard_deck.assert_called_once_with(1)
         self.assertEqual(mock_deck.cards, [mock_card_1, mock_card_2])
+        mock_deck.shuffle.assert_called_once_with()
 
 
 class test_get_dead_players(TestCase):
@@ -349,6 +360,7 @@ class test_get_game_state_for(TestCase):
         db_add_player(player_name4, match_name)
 
         started_match(match_name)
+        match_states.load(get_match_id(match_name))
 
         game_state1 = get_game_state_for(player_name1)
         game_state2 = get_game_state_for(player_name2)
@@ -514,50 +526,34 @@ class test_exchange_players_card(TestCase):
 
         player1.cards = {card1}
         player2.cards = {card2}
-        card1.player = {player1}
-        card2.player = {player2}
 
         exchange_players_cards("player1_name", 1, "player2_name", 2)
 
         self.assertEqual(player1.cards, {card2})
         self.assertEqual(player2.cards, {card1})
-        self.assertEqual(card1.player, {player2})
-        self.assertEqual(card2.player, {player1})
 
 
 class TestGetNextPlayerPosition(TestCase):
     @patch("Database.models.Match._get_match")
-    @patch("Database.models.Match._get_player_by_position")
-    def test_get_next_player_position(
-        self, mock_get_player_by_position, mock_get_match
-    ):
-        mock_match = mock_get_match.return_value
-        mock_match.players.count.return_value = 4
-        mock_match.clockwise = True
-
-        mock_player = Mock(is_alive=True)
-        mock_get_player_by_position.side_effect = [mock_player] * 4
+    def test_get_next_player_position(self, mock_get_match):
+        mock_get_match.return_value = _seated_match(4)
 
         result = get_next_player_position(1, 0)
         self.assertEqual(result, 3)
 
     @patch("Database.models.Match._get_match")
-    @patch("Database.models.Match._get_player_by_position")
-    def test_get_next_player_position_dead_player(
-        self, mock_get_player_by_position, mock_get_match
-    ):
-        mock_match = mock_get_match.return_value
-        mock_match.players.count.return_value = 4
-        mock_match.clockwise = True
-
-        mock_player = Mock(is_alive=True)
-        mock_dead_player = Mock(is_alive=False)
-        mock_get_player_by_position.side_effect = [
-            mock_dead_player,
-            mock_player,
-            mock_player,
-            mock_player,
-        ]
+    def test_get_next_player_position_dead_player(self, mock_get_match):
+        mock_get_match.return_value = _seated_match(4, dead=[3])
+
+        result = get_next_player_position(1, 0)
+
+        self.assertEqual(result, 2)
+
+    @patch("Database.models.Match._get_match")
+    def test_get_next_player_position_counterclockwise(self, mock_get_match):
+        match = _seated_match(4, dead=[1])
+        match.clockwise = False
+        mock_get_match.return_value = match
 
         result = get_next_player_position(1, 0)
 
@@ -566,16 +562,8 @@ class TestGetNextPlayerPosition(TestCase):
 
 class TestGetPreviousPlayerPosition(TestCase):
     @patch("Database.models.Match._get_match")
-    @patch("Database.models.Match._get_player_by_position")
-    def test_get_previous_player_position(
-        self, mock_get_player_by_position, mock_get_match
-    ):
-        mock_match = mock_get_match.return_value
-        mock_match.players.count.return_value = 4
-        mock_match.clockwise = True
-
-        mock_player = Mock(is_alive=True)
-        mock_get_player_by_position.side_effect = [mock_player] * 4
+    def test_get_previous_player_position(self, mock_get_match):
+        mock_get_match.return_value = _seated_match(4)
 
         result = get_previous_player_position(1, 0)
 
@@ -585,19 +573,12 @@ class TestGetPreviousPlayerPosition(TestCase):
 class TestGetPlayerInTurn(TestCase):
     @patch("Database.models.Match._get_match")
     def test_get_player_in_turn(self, mock_get_match):
-        match = Mock()
-        player1 = Mock()
-        player2 = Mock()
-        player3 = Mock()
-
-        match.players = [player1, player2, player3]
+        match = _seated_match(3)
         match.current_player = 2
-        player2.name = "player2"
-        player2.position = 2
 
         mock_get_match.return_value = match
         result = get_player_in_turn(1)
-        self.assertEqual(result, player2.player_name)
+        self.assertEqual(result, "p2")
 
 
 class TestGetCardsFunction(TestCase):
@@ -668,149 +649,143 @@ class test_is_in_quarantine(TestCase):
 
 
 class test_requires_target(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_requires_target(self, mock_get_card_name):
-        result = requires_target(1)
+    def test_requires_target(self):
+        result = requires_target(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_name", return_value="Determinación")
-    def test_requires_target_false(self, mock_get_card_name):
-        result = requires_target(20)
+    def test_requires_target_false(self):
+        result = requires_target(card_id_by_name("Whisky"))
         self.assertEqual(result, False)
 
 
 class test_requires_adjacent_target(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_requires_adjacent_target(self, mock_get_card_name):
-        result = requires_adjacent_target(1)
+    def test_requires_adjacent_target(self):
+        result = requires_adjacent_target(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_name", return_value="Seducción")
-    def requires_adjacent_target_false(self, mock_get_card_name):
-        result = requires_adjacent_target(20)
+    def test_requires_adjacent_target_false(self):
+        result = requires_adjacent_target(card_id_by_name("Seducción"))
         self.assertEqual(result, False)
 
 
 class test_requires_target_not_quarantined(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="Seducción")
-    def test_requires_target_not_quarantined(self, mock_get_card_name):
-        result = requires_target_not_quarantined(1)
+    def test_requires_target_not_quarantined(self):
+        result = requires_target_not_quarantined(card_id_by_name("Seducción"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_requires_target_not_quarantined_false(self, mock_get_card_name):
-        result = requires_target_not_quarantined(20)
+    def test_requires_target_not_quarantined_false(self):
+        result = requires_target_not_quarantined(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, False)
 
 
 class test_has_defense(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_has_defense(self, mock_get_card_name):
-        result = has_defense(1)
+    def test_has_defense(self):
+        result = has_defense(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_name", return_value="Hacha")
-    def test_has_defense_false(self, mock_get_card_name):
-        result = has_defense(20)
+    def test_has_defense_false(self):
+        result = has_defense(card_id_by_name("Hacha"))
         self.assertEqual(result, False)
 
 
 class test_defend_exchange(TestCase):
-    @patch("Database.models.Card.get_card_name", return_value="¡Fallaste!")
-    def test_defend_exchange(self, mock_get_card_name):
-        result = defend_exchange(1)
+    def test_defend_exchange(self):
+        result = defend_exchange(card_id_by_name("¡Fallaste!"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_name", return_value="Lanzallamas")
-    def test_defend_exchange_false(self, mock_get_card_name):
-        result = defend_exchange(20)
+    def test_defend_exchange_false(self):
+        result = defend_exchange(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, False)
 
 
 class tests_is_defensa(TestCase):
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_defensa(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.DEFENSA.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_defensa(1)
+    def test_is_defensa(self):
+        result = is_defensa(card_id_by_name("Aterrador"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_defense_false(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.ACCION.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_defensa(20)
+    def test_is_defense_false(self):
+        result = is_defensa(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, False)
 
 
 class test_is_panic(TestCase):
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_panic(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.PANICO.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_panic(1)
+    def test_is_panic(self):
+        result = is_panic(card_id_by_name("Revelaciones"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_panic_false(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.ACCION.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_panic(20)
+    def test_is_panic_false(self):
+        result = is_panic(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, False)
 
 
 class test_is_is_contagio(TestCase):
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_contagio(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.CONTAGIO.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_contagio(1)
+    def test_is_contagio(self):
+        result = is_contagio(card_id_by_name("¡Infectado!"))
         self.assertEqual(result, True)
 
-    @patch("Database.models.Card.get_card_by_id")
-    def test_is_contagio_false(self, mock_get_card_by_id):
-        mock_card = Mock()
-        mock_card.type = CardType.ACCION.value
-        mock_get_card_by_id.return_value = mock_card
-        result = is_contagio(20)
+    def test_is_contagio_false(self):
+        result = is_contagio(card_id_by_name("Lanzallamas"))
         self.assertEqual(result, False)
 
 
+class test_card_catalog(TestCase):
+    def test_catalog_matches_templates(self):
+        self.assertEqual(len(CARD_CATALOG), amount_cards())
+
+    @db_session
+    def test_catalog_matches_registered_cards(self):
+        for card in Card.select():
+            entry = CARD_CATALOG[card.id]
+            self.assertEqual(entry.card_name, card.card_name)
+            self.assertEqual(entry.number, card.number)
+            self.assertEqual(entry.type, card.type)
+
+    def test_get_card_entry_not_found(self):
+        with self.assertRaises(CardNotFound):
+            get_card_entry(amount_cards() + 1)
+
+    @patch("Database.models.Card.Card.exists")
+    def test_predicates_dont_query_cards(self, mock_exists):
+        card_id = card_id_by_name("Uno, dos..")
+        self.assertTrue(requires_target(card_id))
+        self.assertTrue(can_target_caster(card_id))
+        self.assertTrue(is_panic(card_id))
+        mock_exists.assert_not_called()
+
+
 def test_exist_door_between(mocker):
     mocker.patch("Database.models.Match.get_player_match", return_value=1)
     mock_match = mocker.patch("Database.models.Match._get_match")
-    mocker.patch("Database.models.Match.len", return_value=4)
-    players_pos = mocker.patch("Database.models.Match.get_player_position")
-    right_player = mocker.patch("Database.models.Match.get_right_alive_player")
-    left_player = mocker.patch("Database.models.Match.get_left_alive_player")
+    mocker.patch("Database.models.Match.get_player_position", side_effect=_position_of)
 
-    match = Mock()
-    match.obstacles = [False, False, False, False]
-    mock_match.return_value = match
-    players_pos.side_effect = [2, 2, 0, 2]
+    mock_match.return_value = _seated_match(4)
+    assert exist_door_between("p2", "p3") == False
+
+    seat_rings.clear()
+    mock_match.return_value = _seated_match(4, obstacles=[False, False, True, False])
+    assert exist_door_between("p3", "p2") == True
+    assert exist_door_between("p2", "p3") == True
+    assert exist_door_between("p3", "p0") == False
 
-    exist = exist_door_between("player1", "player2")
-    assert exist == False
+    seat_rings.clear()
+    mock_match.return_value = _seated_match(4, obstacles=[False, False, False, True])
+    assert exist_door_between("p3", "p0") == True
+    assert exist_door_between("p0", "p3") == True
+    assert exist_door_between("p0", "p1") == False
 
-    players_pos.side_effect = [3, 3, 2, 3]
-    match.obstacles = [False, False, True, False]
-    exist = exist_door_between("player1", "player2")
-    assert exist == True
 
-    players_pos.side_effect = [3, 0, 3, 0, 3]
-    match.obstacles = [False, False, False, True]
-    exist = exist_door_between("player1", "player2")
-    assert exist == True
+def test_exist_door_between_dead_neighbour(mocker):
+    mocker.patch("Database.models.Match.get_player_match", return_value=1)
+    mock_match = mocker.patch("Database.models.Match._get_match")
+    mocker.patch("Database.models.Match.get_player_position", side_effect=_position_of)
 
-    players_pos.side_effect = [3, 3, 3, 0]
-    match.obstacles = [False, False, False, True]
-    exist = exist_door_between("player1", "player2")
-    assert exist == True
+    # p1 está muerto: p0 y p2 son adyacentes, con la puerta 1 entre ellos
+    mock_match.return_value = _seated_match(
+        4, dead=[1], obstacles=[False, True, False, False]
+    )
+    assert get_first_door_between("p0", "p2") == 1
+    assert get_first_door_between("p2", "p0") == 1
+    assert get_first_door_between("p2", "p3") == -1
 
 
 def test_is_adjacent_to_obstacle(mocker):
@@ -834,60 +809,25 @@ def test_is_adjacent_to_obstacle(mocker):
 
 def test_get_right_alive_player(mocker):
     match = mocker.patch("Database.models.Match._get_match")
-    mocker.patch("Database.models.Match.get_player_position", return_value=0)
-    mocker.patch("Database.models.Match.get_next_player_position", return_value=1)
-
-    def _get_player_by_position(match_id, position):
-        return mock_match.players[position]
-
-    mocker.patch(
-        "Database.models.Match._get_player_by_position",
-        side_effect=_get_player_by_position,
-    )
-
-    mock_match = Mock()
-    mock_match.current_player = 0
-    player1 = Mock()
-    player1.player_name = "player1"
-    player1.position = 0
-    player2 = Mock()
-    player2.player_name = "player2"
-    player2.position = 1
-    mock_match.players = [player1, player2]
-    mock_match.clockwise = True
+    mocker.patch("Database.models.Match.get_player_position", side_effect=_position_of)
+    mock_match = _seated_match(4, dead=[1])
     match.return_value = mock_match
 
-    res = get_right_alive_player(1, "player1")
-    assert res == player2.player_name
+    assert get_right_alive_player(1, "p0") == "p2"
+    assert get_right_alive_player(1, "p3") == "p0"
+    assert mock_match.clockwise == True
 
 
 def test_get_left_alive_player(mocker):
     match = mocker.patch("Database.models.Match._get_match")
-    mocker.patch("Database.models.Match.get_player_position", return_value=1)
-    mocker.patch("Database.models.Match.get_next_player_position", return_value=0)
-
-    def _get_player_by_position(match_id, position):
-        return mock_match.players[position]
-
-    mocker.patch(
-        "Database.models.Match._get_player_by_position",
-        side_effect=_get_player_by_position,
-    )
-
-    mock_match = Mock()
-    mock_match.current_player = 1
-    player1 = Mock()
-    player1.player_name = "player1"
-    player1.position = 0
-    player2 = Mock()
-    player2.player_name = "player2"
-    player2.position = 1
-    mock_match.players = [player1, player2]
-    mock_match.clockwise = True
+    mocker.patch("Database.models.Match.get_player_position", side_effect=_position_of)
+    mock_match = _seated_match(4, dead=[1])
+    mock_match.clockwise = False
     match.return_value = mock_match
 
-    res = get_left_alive_player(1, "player2")
-    assert res == player1.player_name
+    assert get_left_alive_player(1, "p2") == "p0"
+    assert get_left_alive_player(1, "p0") == "p3"
+    assert mock_match.clockwise == False
 
 
 def test_get_alive_players(mocker):
@@ -1000,58 +940,39 @@ class test_discarded(TestCase):
 
 
 class test_is_three_steps_from(TestCase):
-    @patch("Database.models.Match.get_player_position")
-    @patch("Database.models.Match.get_previous_player_position")
-    @patch("Database.models.Match.get_next_player_position")
+    @patch("Database.models.Match._get_match", return_value=_seated_match(5))
+    @patch("Database.models.Match.get_player_position", side_effect=_position_of)
     @patch("Database.models.Match.get_player_match", return_value=1)
-    def test_is_three_steps_from(
-        self,
-        mock_get_player_match,
-        mock_get_next_player_position,
-        mock_get_previous_player_position,
-        mock_get_player_position,
-    ):
-        positions = {
-            "p1": 0,
-            "p2": 1,
-            "p3": 2,
-            "p4": 3,
-            "p5": 4,
-        }
-
-        def _get_next_player_position(match_id, position):
-            return (position + 1) % 5
-
-        def _get_previous_player_position(match_id, position):
-            return (position - 1) % 5
-
-        def _get_player_position(player_name):
-            return positions[player_name]
-
-        mock_get_next_player_position.side_effect = _get_next_player_position
-        mock_get_previous_player_position.side_effect = _get_previous_player_position
-        mock_get_player_position.side_effect = _get_player_position
-
+    def test_is_three_steps_from(self, *args):
         # Inicial
-        self.assertTrue(is_three_steps_from("p1", "p4"))
-        self.assertTrue(is_three_steps_from("p1", "p3"))
-        self.assertFalse(is_three_steps_from("p1", "p2"))
-        self.assertFalse(is_three_steps_from("p1", "p5"))
-        self.assertFalse(is_three_steps_from("p1", "p1"))
+        self.assertTrue(is_three_steps_from("p0", "p3"))
+        self.assertTrue(is_three_steps_from("p0", "p2"))
+        self.assertFalse(is_three_steps_from("p0", "p1"))
+        self.assertFalse(is_three_steps_from("p0", "p4"))
+        self.assertFalse(is_three_steps_from("p0", "p0"))
 
         # Intermedio
-        self.assertTrue(is_three_steps_from("p3", "p5"))
-        self.assertTrue(is_three_steps_from("p3", "p1"))
-        self.assertFalse(is_three_steps_from("p3", "p4"))
-        self.assertFalse(is_three_steps_from("p3", "p2"))
-        self.assertFalse(is_three_steps_from("p3", "p3"))
+        self.assertTrue(is_three_steps_from("p2", "p4"))
+        self.assertTrue(is_three_steps_from("p2", "p0"))
+        self.assertFalse(is_three_steps_from("p2", "p3"))
+        self.assertFalse(is_three_steps_from("p2", "p1"))
+        self.assertFalse(is_three_steps_from("p2", "p2"))
 
         # Final
-        self.assertTrue(is_three_steps_from("p5", "p3"))
-        self.assertTrue(is_three_steps_from("p5", "p2"))
-        self.assertFalse(is_three_steps_from("p5", "p4"))
-        self.assertFalse(is_three_steps_from("p5", "p5"))
-        self.assertFalse(is_three_steps_from("p5", "p1"))
+        self.assertTrue(is_three_steps_from("p4", "p2"))
+        self.assertTrue(is_three_steps_from("p4", "p1"))
+        self.assertFalse(is_three_steps_from("p4", "p3"))
+        self.assertFalse(is_three_steps_from("p4", "p4"))
+        self.assertFalse(is_three_steps_from("p4", "p0"))
+
+    @patch("Database.models.Match._get_match", return_value=_seated_match(5, [1]))
+    @patch("Database.models.Match.get_player_position", side_effect=_position_of)
+    @patch("Database.models.Match.get_player_match", return_value=1)
+    def test_is_three_steps_from_dead_player(self, *args):
+        # Los muertos no cuentan como pasos
+        self.assertTrue(is_three_steps_from("p0", "p4"))
+        self.assertFalse(is_three_steps_from("p0", "p3"))
+        self.assertTrue(is_three_steps_from("p0", "p2"))
 
 
 class test_remove_all_barred_doors(TestCase):
@@ -1091,59 +1012,28 @@ class test_revoke_all_quarantines(TestCase):
 
 
 class test_get_all_players_after(TestCase):
+    @patch("Database.models.Match._get_match")
     @patch("Database.models.Match.get_player_by_name")
-    @patch("Database.models.Match.get_player_name_by_position")
-    @patch("Database.models.Match.get_next_player_position")
-    def test_get_all_players_after(
-        self,
-        mock_get_next_player_position,
-        mock_get_player_name_by_position,
-        mock_get_player_by_name,
-    ):
-        match = Mock()
+    def test_get_all_players_after(self, mock_get_player_by_name, mock_get_match):
+        match = _seated_match(5)
         match.clockwise = False
-
-        ps = []
-        for i in range(5):
-            player = Mock()
-            player.player_name = f"p{i}"
-            player.position = i
-            player.match = match
-            ps.append(player)
-
-        mock_get_player_by_name.side_effect = ps
-
-        def _get_next_player_position(match_id, position):
-            return (position + 1) % 5
-
-        def _get_player_name_by_position(match_id, position):
-            for player in ps:
-                if player.position == position:
-                    return player.player_name
-
-        mock_get_next_player_position.side_effect = _get_next_player_position
-        mock_get_player_name_by_position.side_effect = _get_player_name_by_position
+        mock_get_match.return_value = match
+        mock_get_player_by_name.side_effect = (
+            lambda name: match.players[_position_of(name)]
+        )
 
         result = get_all_players_after("p0")
-        self.assertEqual(result, ["p0", "p1", "p2", "p3", "p4"])
+        self.assertEqual(result, ["p0", "p4", "p3", "p2", "p1"])
         self.assertFalse(match.clockwise)
 
-        result = get_all_players_after("p1")
-        self.assertEqual(result, ["p1", "p2", "p3", "p4", "p0"])
-        self.assertFalse(match.clockwise)
-
-        match.clockwise = True
         result = get_all_players_after("p2")
-        self.assertEqual(result, ["p2", "p3", "p4", "p0", "p1"])
-        self.assertTrue(match.clockwise)
-
-        result = get_all_players_after("p3")
-        self.assertEqual(result, ["p3", "p4", "p0", "p1", "p2"])
-        self.assertTrue(match.clockwise)
+        self.assertEqual(result, ["p2", "p1", "p0", "p4", "p3"])
+        self.assertFalse(match.clockwise)
 
+        match.players[3].is_alive = False
+        seat_rings.clear()
         result = get_all_players_after("p4")
-        self.assertEqual(result, ["p4", "p0", "p1", "p2", "p3"])
-        self.assertTrue(match.clockwise)
+        self.assertEqual(result, ["p4", "p2", "p1", "p0"])
 
 
 class test_assign_next_turn_to(TestCase):
@@ -1313,109 +1203,91 @@ class test_get_players_positions(TestCase):
 
 
 class test_is_adyacent(TestCase):
-    @patch("Database.models.Match.get_previous_player_position")
-    @patch("Database.models.Match.get_next_player_position")
-    def test_is_adyacent_is_next(self, mock_next_player, mock_previos_player):
-        player = Mock()
-        player.match.id = 1
-        player.position = 1
-        player_target = Mock()
-        player_target.match.id = 1
-        player_target.position = 2
-        mock_next_player.return_value = 2
-        mock_previos_player.return_value = 0
-
-        result = _is_adyacent(player, player_target)
-        self.assertTrue(result)
-
-    @patch("Database.models.Match.get_previous_player_position")
-    @patch("Database.models.Match.get_next_player_position")
-    def test_is_adyacent_is_previous(self, mock_next_player, mock_previos_player):
-        player = Mock()
-        player.match.id = 1
-        player.position = 1
-        player_target = Mock()
-        player_target.match.id = 1
-        player_target.position = 0
-        mock_next_player.return_value = 2
-        mock_previos_player.return_value = 0
-
-        result = _is_adyacent(player, player_target)
-        self.assertTrue(result)
-
-    @patch("Database.models.Match.get_previous_player_position")
-    @patch("Database.models.Match.get_next_player_position")
-    def test_is_not_adyacent(self, mock_next_player, mock_previos_player):
-        player = Mock()
-        player.match.id = 1
-        player.position = 1
-        player_target = Mock()
-        player_target.match.id = 1
-        player_target.position = 3
-        mock_next_player.return_value = 2
-        mock_previos_player.return_value = 0
+    @patch("Database.models.Match._get_match")
+    def test_is_adyacent(self, mock_get_match):
+        match = _seated_match(5, dead=[3])
+        mock_get_match.return_value = match
+        p0, p1, p2, p3, p4 = match.players
 
-        result = _is_adyacent(player, player_target)
-        self.assertFalse(result)
+        self.assertTrue(_is_adyacent(p1, p2))
+        self.assertTrue(_is_adyacent(p1, p0))
+        self.assertTrue(_is_adyacent(p0, p4))
+        self.assertTrue(_is_adyacent(p2, p4))
+        self.assertFalse(_is_adyacent(p1, p4))
+        self.assertFalse(_is_adyacent(p0, p2))
 
 
 class test_all_players_alive(TestCase):
     @patch("Database.models.Match._get_match")
     def test_all_players_alive(self, mock_get_match):
         match_mock = Mock()
-        player1 = Mock(player_name="Player1", is_alive=True)
-        player2 = Mock(player_name="Player2", is_alive=True)
-        player3 = Mock(player_name="Player3", is_alive=True)
-        player4 = Mock(player_name="Player4", is_alive=True)
-        match_mock.players = [player1, player2, player3, player4]
+        match_mock.player_count = 4
+        match_mock.alive_count = 4
         mock_get_match.return_value = match_mock
         result = all_players_alive(1)
         self.assertTrue(result)
 
     @patch("Database.models.Match._get_match")
-    def test_all_players_alive(self, mock_get_match):
+    def test_not_all_players_alive(self, mock_get_match):
         match_mock = Mock()
-        player1 = Mock(player_name="Player1", is_alive=True)
-        player2 = Mock(player_name="Player2", is_alive=True)
-        player3 = Mock(player_name="Player3", is_alive=True)
-        player4 = Mock(player_name="Player4", is_alive=False)
-        match_mock.players = [player1, player2, player3, player4]
+        match_mock.player_count = 4
+        match_mock.alive_count = 3
         mock_get_match.return_value = match_mock
         result = all_players_alive(1)
         self.assertFalse(result)
 
 
 class test_get_match_list(TestCase):
-    @patch("Database.models.Match.Match.select")
-    def test_get_match_list(self, mock_select):
-        match1 = Mock()
-        match1.name = "match1"
-        match1.min_players = 4
-        match1.max_players = 12
-        match1.players = _pset(["player1", "player2", "player3"])
-        match2 = Mock()
-        match2.name = "match2"
-        match2.min_players = 5
-        match2.max_players = 11
-        match2.players = _pset(["player4", "player5", "player6"])
-        mock_select.return_value = [match1, match2]
+    def test_get_match_list(self):
+        match_name = generate_unique_testing_name()
+        players = [generate_unique_testing_name() for _ in range(3)]
+        for player in players:
+            create_player(player)
+        db_create_match(match_name, players[0], 4, 12)
+        for player in players[1:]:
+            db_add_player(player, match_name)
 
         result = get_match_list()
-        expected = [
+
+        self.assertIn(
             {
-                "name": "match1",
+                "id": get_match_id(match_name),
+                "name": match_name,
                 "min_players": 4,
                 "max_players": 12,
                 "players": 3,
+                "has_password": False,
+                "initiated": False,
             },
+            result,
+        )
+
+        left_match(players[2], match_name)
+        result = get_match_list()
+        self.assertIn(
             {
-                "name": "match2",
-                "min_players": 5,
-                "max_players": 11,
-                "players": 3,
+                "id": get_match_id(match_name),
+                "name": match_name,
+                "min_players": 4,
+                "max_players": 12,
+                "players": 2,
+                "has_password": False,
+                "initiated": False,
             },
-        ]
-        self.assertEqual(result, expected)
+            result,
+        )
+
+    def test_get_match_list_single_query(self):
+        for _ in range(3):
+            player = generate_unique_testing_name()
+            create_player(player)
+            db_create_match(generate_unique_testing_name(), player, 4, 12)
+
+        with db_session:
+            before = db.local_stats[None].db_count
+            get_match_list()
+            after = db.local_stats[None].db_count
+        self.assertEqual(after - before, 1)
 
 
 class test_get_quarantined_players(TestCase):
@@ -1447,10 +1319,10 @@ class test_kill_player(TestCase):
         player_mock = Mock()
         player_mock.is_alive = True
         player_mock.in_quarantine = 1
+        player_mock.match.alive_count = 4
         player_mock.cards = _pset([])
         for i in range(4):
             card = Mock()
-            card.player = _pset([player_mock])
             player_mock.cards.add(card)
 
         mock_discard = Mock()
@@ -1462,5 +1334,6 @@ class test_kill_player(TestCase):
 
         self.assertFalse(player_mock.is_alive)
         self.assertEqual(player_mock.in_quarantine, 0)
+        self.assertEqual(player_mock.match.alive_count, 3)
         self.assertEqual(player_mock.cards.count(), 0)
         self.assertEqual(mock_discard.cards.count(), 4)
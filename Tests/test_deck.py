@@ -3,8 +3,10 @@ from unittest import TestCase
 from Database.Database import *
 from Tests.auxiliar_functions import *
 from Database.models.Match import _create_deck, _deal_cards
+from Database.models.Card import CARD_CATALOG
 import random
 from Game.app_auxiliars import *
+from Game.match_state import match_states
 
 
 class _pset(set):
@@ -32,185 +34,145 @@ class _pset(set):
 
 
 class test_init_game_aux(TestCase):
-    id = 0
-
-    def __side_effect(*args, **kwargs):
-        match = kwargs["match"]
-        is_discard = kwargs["is_discard"]
-        deck = Mock()
-        deck.is_discard = is_discard
-        deck.cards = set()
-        deck.match = match
-
-        return deck
-
-    def __gen_mocked_cards(self):
-        cards = []
-        for c in card_templates:
-            for rep in c.repetitions:
-                for _ in range(rep.amount):
-                    card = Mock()
-                    card.id = id
-                    card.card_name = c.card_name
-                    card.number = rep.number
-                    card.type = c.type.value
-                    card.player = set()
-                    card.deck = set()
-                    cards.append(card)
-                    self.id = self.id + 1
-        return cards
-
-    @patch("Database.models.Match.Deck", side_effect=__side_effect)
-    @patch("Database.models.Match.Card")
-    def test_create_deck(self, mock_Card, mock_Deck):
+    def test_create_deck(self):
         n_players = 4
 
-        match = Mock()
-        match.players = Mock()
-        match.players.count.return_value = n_players
-        match.deck = set()
-        mock_Card.select.return_value = self.__gen_mocked_cards()
-
-        _create_deck(match)
-
-        for d in match.deck:
-            if d.is_discard:
-                d_deck = d
-            else:
-                deck = d
-
-        contains_cosa = False
-        for c in deck.cards:
-            self.assertTrue(deck in c.deck)
-            self.assertTrue(c.number is None or c.number <= n_players)
-            self.assertTrue(c.type in CardType._value2member_map_)
-            self.assertTrue(c.card_name in [c.card_name for c in card_templates])
-
-            if c.card_name == "La Cosa":
-                contains_cosa = True
-
-        self.assertTrue(contains_cosa)
+        deck = _create_deck(n_players)
 
-        self.assertTrue(len(deck.cards) > 4 * n_players)
-        self.assertEqual(deck.match, match)
-
-        self.assertEqual(len(d_deck.cards), 0)
-        self.assertEqual(d_deck.match, match)
-
-        self.assertEqual(len(match.deck), 2)
-
-        self.assertEqual(mock_Deck.call_count, 2)
-        mock_Card.select.assert_called()
-
-    def __gen_mocked_deck(self, num_players):
-        cards = self.__gen_mocked_cards()
-        deck = Mock()
-        deck.cards = _pset()
-        deck.is_discard = False
-        for c in cards:
-            if c.number is None or c.number <= num_players:
-                deck.cards.add(c)
-                c.deck.add(deck)
-        return deck
+        self.assertEqual(len(deck), len(set(deck)))
+        self.assertTrue(len(deck) > 4 * n_players)
+        self.assertIn("La Cosa", [get_card_name(c) for c in deck])
+        for card_id in deck:
+            number = CARD_CATALOG[card_id].number
+            self.assertTrue(number is None or number <= n_players)
+        self.assertTrue(len(_create_deck(12)) > len(deck))
 
     def __mock_players(self, num_players):
         players = _pset()
         for i in range(num_players):
             player = Mock()
             player.player_name = "player" + str(i)
-            player.cards = _pset()
             players.add(player)
         return players
 
-    def test_deal_cards(self):
+    @patch("Database.models.Match.MatchCard")
+    def test_deal_cards(self, mock_match_card):
         num_players = 4
 
         match = Mock()
+        match.seed = 1
         match.players = self.__mock_players(num_players)
-        match.deck = _pset()
-        match.deck.add(self.__gen_mocked_deck(num_players))
-
-        _deal_cards(match)
-
-        contains_cosa = False
-        for player in match.players:
-            self.assertEqual(player.cards.count(), 4)
-            for card in player.cards:
-                if card.card_name == "La Cosa":
-                    contains_cosa = True
-                self.assertTrue(card in player.cards)
-                self.assertTrue(player in card.player)
-                self.assertFalse(card in match.deck)
-                self.assertFalse(match.deck in card.deck)
-
-        self.assertTrue(contains_cosa)
+        deck = _create_deck(num_players)
+
+        hands = _deal_cards(match, deck)
+
+        dealt = [card for hand in hands.values() for card in hand]
+        self.assertEqual(len(dealt), 4 * num_players)
+        self.assertEqual(len(set(dealt)), len(dealt))
+        self.assertIn("La Cosa", [get_card_name(c) for c in dealt])
+        for card in dealt:
+            if get_card_name(card) != "La Cosa":
+                self.assertNotIn(
+                    get_card_type(card), [CardType.CONTAGIO.value, CardType.PANICO.value]
+                )
+
+        # Una fila por carta del mazo, con su ubicación y dueño
+        self.assertEqual(mock_match_card.call_count, len(deck))
+        rows = {
+            call.kwargs["card"]: call.kwargs for call in mock_match_card.call_args_list
+        }
+        for player, hand in hands.items():
+            for card in hand:
+                self.assertEqual(rows[card]["location"], CARD_LOCATION["HAND"])
+                self.assertEqual(rows[card]["owner"], player)
+        in_deck = [c for c in deck if c not in dealt]
+        for card in in_deck:
+            self.assertEqual(rows[card]["location"], CARD_LOCATION["DECK"])
+            self.assertIsNone(rows[card].get("owner"))
+        self.assertEqual(
+            sorted(rows[card]["position"] for card in in_deck),
+            list(range(len(in_deck))),
+        )
+
+    @patch("Database.models.Match.MatchCard")
+    def test_deal_cards_same_seed(self, mock_match_card):
+        match = Mock()
+        match.seed = 7
+        match.players = self.__mock_players(4)
+
+        def rows():
+            return {
+                call.kwargs["card"]: call.kwargs.get("position")
+                for call in mock_match_card.call_args_list
+            }
+
+        _deal_cards(match, _create_deck(4))
+        first = rows()
+        mock_match_card.reset_mock()
+        _deal_cards(match, _create_deck(4))
+
+        self.assertEqual(rows(), first)
+
+    def test_started_match_cards(self):
+        match_name = generate_unique_testing_name()
+        players = [generate_unique_testing_name() for _ in range(4)]
+        for player in players:
+            create_player(player)
+        db_create_match(match_name, players[0], 4, 12)
+        for player in players[1:]:
+            db_add_player(player, match_name)
+        started_match(match_name)
+        match_states.load(get_match_id(match_name))
+        match_id = get_match_id(match_name)
+
+        with db_session:
+            match = Match[match_id]
+            self.assertEqual(match.cards.count(), len(_create_deck(4)))
+            self.assertEqual(
+                count(c for c in MatchCard if c.match == match and c.owner is not None),
+                16,
+            )
+        for player in players:
+            self.assertEqual(len(get_player_hand(player)), 4)
 
 
 class test_set_top_card(TestCase):
+    @patch("Database.models.Match.get_card_by_id")
+    @patch("Database.models.Match.get_deck")
     @patch("Database.models.Match._get_match")
-    def test_set_top_card(self, mock_get_match):
+    def test_set_top_card(self, mock_get_match, mock_get_deck, mock_get_card):
         card_id = 1
 
         match = Mock()
         match.id = 1
-        match.top_card = None
 
         mock_get_match.return_value = match
 
         set_top_card(card_id, match.id)
 
         mock_get_match.assert_called_once_with(match.id)
-        self.assertEqual(match.top_card, card_id)
-
-
-class test_is_there_top_card(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_is_there_top_card(self, mock_get_match):
-        match = Mock()
-        match.id = 1
-        match.top_card = None
-
-        mock_get_match.return_value = match
-
-        assert not is_there_top_card(match.id)
-        mock_get_match.assert_called_once_with(match.id)
-
-        match.top_card = 1
-
-        assert is_there_top_card(match.id)
-        mock_get_match.call_count == 2
-
-
-class test_pop_top_card(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_pop_top_card(self, mock_get_match):
-        card_id = 1
-
-        match = Mock()
-        match.id = 1
-        match.top_card = card_id
-
-        mock_get_match.return_value = match
-
-        card = pop_top_card(match.id)
-
-        mock_get_match.assert_called_once_with(match.id)
-
-        self.assertEqual(card, card_id)
-        self.assertEqual(match.top_card, None)
-
-    @patch("Database.models.Match._get_match")
-    def test_pop_top_card_empty(self, mock_get_match):
-        match = Mock()
-        match.id = 1
-        match.top_card = None
-
-        mock_get_match.return_value = match
-
-        with self.assertRaises(NoTopCard):
-            pop_top_card(match.id)
-
-        mock_get_match.assert_called_once_with(match.id)
+        mock_get_card.assert_called_once_with(card_id, match)
+        mock_get_deck.return_value.push.assert_called_once_with(
+            mock_get_card.return_value
+        )
+
+    def test_top_card_is_drawn_next(self):
+        match_name = generate_unique_testing_name()
+        players = [generate_unique_testing_name() for _ in range(4)]
+        for player in players:
+            create_player(player)
+        db_create_match(match_name, players[0], 4, 12)
+        for player in players[1:]:
+            db_add_player(player, match_name)
+        started_match(match_name)
+        match_states.load(get_match_id(match_name))
+        match_id = get_match_id(match_name)
+
+        card_id = get_player_hand(players[0])[0]["card_id"]
+        remove_player_card(players[0], card_id)
+        set_top_card(card_id, match_id)
+
+        self.assertEqual(pick_random_card(players[1]), card_id)
 
 
 class test_remove_player_card(TestCase):
@@ -222,8 +184,6 @@ class test_remove_player_card(TestCase):
         player = Mock()
 
         card = Mock()
-        card.player = []
-        card.player.append(player)
         player.cards = []
         player.cards.append(card)
 
@@ -233,7 +193,6 @@ class test_remove_player_card(TestCase):
         remove_player_card(player_name, card_id)
 
         mock_get_player_by_name.assert_called_once_with(player_name)
-        mock_get_card_by_id.assert_called_once_with(card_id)
+        mock_get_card_by_id.assert_called_once_with(card_id, player.match)
 
         self.assertFalse(card in player.cards)
-        self.assertFalse(player in card.player)
@@ -0,0 +1,54 @@
+from Database.executor import run_db, run_match_db, submit_db, DbLanes
+from Game.match_state import match_states, run_for_match
+from unittest.mock import Mock
+import threading
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_run_db_runs_outside_event_loop():
+    thread = await run_db(threading.current_thread)
+    assert thread is not threading.current_thread()
+    assert thread.name.startswith("lacosa-db")
+
+
+@pytest.mark.asyncio
+async def test_run_db_raises_job_exception():
+    def _fail():
+        raise ValueError("error")
+
+    with pytest.raises(ValueError):
+        await run_db(_fail)
+
+
+def test_submit_db_keeps_order():
+    calls = []
+    futures = [submit_db(1, calls.append, i) for i in range(50)]
+    for future in futures:
+        future.result()
+    assert calls == list(range(50))
+
+
+def test_match_jobs_share_a_lane():
+    lanes = DbLanes(3)
+    threads = [
+        lanes.for_match(match_id).submit(threading.current_thread).result()
+        for match_id in (1, 4, 2)
+    ]
+    assert threads[0] is threads[1]
+    assert threads[0] is not threads[2]
+
+
+@pytest.mark.asyncio
+async def test_match_writes_and_snapshots_keep_order():
+    calls = []
+    submit_db(1, calls.append, "snapshot")
+    await run_match_db(1, calls.append, "write")
+    assert calls == ["snapshot", "write"]
+
+
+@pytest.mark.asyncio
+async def test_run_for_match_loaded_stays_on_loop(mocker):
+    mocker.patch.object(match_states, "is_loaded", return_value=True)
+    thread = await run_for_match(1, threading.current_thread)
+    assert thread is threading.current_thread()
@@ -0,0 +1,215 @@
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+from Tests.auxiliar_functions import *
+from Game.app_auxiliars import *
+from Game.lobby_index import LobbyIndex, CREATED, DELETED, public_entry
+from connection.lobby_feed import LobbyFeed, _coalesce
+from connection.lobby_sync import LobbySync
+from connection.pubsub import InProcessBus, InProcessHub
+from connection.socket_messages import LOBBY_MATCHES, LOBBY_CHANGES
+from app import app
+import pytest
+import asyncio
+import json
+
+
+class _LobbyWebStub:
+    def __init__(self, send_delay: float = 0):
+        self.messages = []
+        self.accepted = False
+        self.closed = False
+        self.send_delay = send_delay
+        self.received = asyncio.Event()
+        self._disconnected = asyncio.Event()
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, frame):
+        await asyncio.sleep(self.send_delay)
+        self.messages.append(json.loads(frame))
+        self.received.set()
+
+    async def receive_text(self):
+        await self._disconnected.wait()
+        raise WebSocketDisconnect()
+
+    async def close(self):
+        self.closed = True
+        self._disconnected.set()
+
+    def disconnect(self):
+        self._disconnected.set()
+
+
+def _entry(match_id: int, players: int = 1, initiated: bool = False) -> dict:
+    return {
+        "id": match_id,
+        "name": f"match{match_id}",
+        "min_players": 4,
+        "max_players": 12,
+        "players": players,
+        "has_password": False,
+        "initiated": initiated,
+    }
+
+
+async def _wait_messages(websocket: _LobbyWebStub, count: int):
+    while len(websocket.messages) < count:
+        websocket.received.clear()
+        await asyncio.wait_for(websocket.received.wait(), 1)
+
+
+def test_lobby_index_keeps_changes_made_while_loading():
+    index = LobbyIndex()
+    # Lo que leyó la carga, antes de que se confirmaran los cambios de otro
+    # carril que ya llegaron al índice
+    read = [_entry(1), _entry(2)]
+    index.put(_entry(3))
+    index.put(_entry(1, players=2))
+    index.remove(2)
+
+    index.load(read)
+    index.load([_entry(1)])
+
+    assert index.listing()[1] == [
+        public_entry(_entry(1, players=2)),
+        public_entry(_entry(3)),
+    ]
+
+
+def test_coalesce():
+    created = {"event": "created", "version": 1, "match": {"players": 1}}
+    updated = {"event": "updated", "version": 2, "match": {"players": 2}}
+    deleted = {"event": "deleted", "version": 3, "match": {}}
+
+    assert _coalesce(None, updated) == updated
+    assert _coalesce(created, updated) == {**updated, "event": "created"}
+    assert _coalesce(created, deleted) == deleted
+    # Un cambio viejo no pisa al más nuevo
+    assert _coalesce(updated, {**created, "version": 1}) == updated
+
+
+@pytest.mark.asyncio
+async def test_lobby_feed_snapshot_and_changes():
+    index = LobbyIndex()
+    index.load([_entry(1)])
+    feed = LobbyFeed(index)
+    websocket = _LobbyWebStub()
+
+    serving = asyncio.ensure_future(feed.serve(websocket))
+    await _wait_messages(websocket, 1)
+    index.put(_entry(2))
+    await _wait_messages(websocket, 2)
+    index.put(_entry(2, initiated=True))
+    await _wait_messages(websocket, 3)
+    index.remove(1)
+    await _wait_messages(websocket, 4)
+    websocket.disconnect()
+    await serving
+
+    assert websocket.accepted
+    snapshot, created, started, deleted = websocket.messages
+    assert snapshot["message_type"] == LOBBY_MATCHES
+    assert snapshot["message_content"]["matches"] == [
+        {k: v for k, v in _entry(1).items() if k != "id"}
+    ]
+    assert created["message_type"] == LOBBY_CHANGES
+    assert [c["event"] for c in created["message_content"]["changes"]] == ["created"]
+    assert started["message_content"]["changes"][0]["event"] == "started"
+    assert deleted["message_content"]["changes"] == [
+        {"event": "deleted", "match": {"name": "match1"}}
+    ]
+    versions = [m["message_content"]["version"] for m in websocket.messages]
+    assert versions == sorted(versions)
+    assert feed.subscriber_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_lobby_feed_coalesces_slow_client():
+    index = LobbyIndex()
+    index.load([_entry(1)])
+    feed = LobbyFeed(index)
+    websocket = _LobbyWebStub()
+
+    serving = asyncio.ensure_future(feed.serve(websocket))
+    await _wait_messages(websocket, 1)
+    websocket.send_delay = 0.05
+    index.put(_entry(1, players=2))
+    await asyncio.sleep(0.01)
+    # Mientras se envía el primer cambio llegan tres más de la misma partida
+    for players in (3, 4, 5):
+        index.put(_entry(1, players=players))
+    await _wait_messages(websocket, 3)
+    websocket.disconnect()
+    await serving
+
+    changes = [m["message_content"]["changes"] for m in websocket.messages[1:]]
+    assert [[c["match"]["players"] for c in batch] for batch in changes] == [[2], [5]]
+
+
+@pytest.mark.asyncio
+async def test_lobby_feed_drops_stuck_client():
+    index = LobbyIndex()
+    feed = LobbyFeed(index, send_timeout=0.01)
+    websocket = _LobbyWebStub()
+
+    serving = asyncio.ensure_future(feed.serve(websocket))
+    await _wait_messages(websocket, 1)
+    websocket.send_delay = 1
+    index.put(_entry(1))
+    await asyncio.wait_for(serving, 1)
+
+    assert websocket.closed
+    assert feed.subscriber_count() == 0
+
+
+def test_lobby_feed_endpoint():
+    client = TestClient(app)
+    host = generate_unique_testing_name()
+    create_player(host)
+    match_name = generate_unique_testing_name()
+
+    with client.websocket_connect("/ws/lobby") as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["message_type"] == LOBBY_MATCHES
+
+        db_create_match(match_name, host, 4, 12)
+
+        message = websocket.receive_json()
+        assert message["message_type"] == LOBBY_CHANGES
+        change = message["message_content"]["changes"][0]
+        assert change["event"] == "created"
+        assert change["match"]["name"] == match_name
+
+
+def _workers_with_index(n: int) -> list:
+    hub = InProcessHub()
+    indexes = [LobbyIndex() for _ in range(n)]
+    for index in indexes:
+        LobbySync(InProcessBus(hub), index).start()
+    return indexes
+
+
+@pytest.mark.asyncio
+async def test_lobby_changes_reach_other_workers():
+    index1, index2 = _workers_with_index(2)
+    events = []
+    index2.subscribe(lambda event, entry, version: events.append(event))
+    etag = index2.etag
+    entry = _entry(1)
+
+    # Como desde el hilo de la base de datos
+    await asyncio.get_running_loop().run_in_executor(None, index1.put, entry)
+    await asyncio.sleep(0.01)
+
+    assert index2.get(1) == entry
+    assert index2.etag != etag
+
+    index1.remove(1)
+    await asyncio.sleep(0.01)
+
+    assert index2.get(1) is None
+    assert events == [CREATED, DELETED]
+    # Los cambios aplicados no vuelven al que los hizo
+    assert index1.version == 2
@@ -37,11 +37,126 @@ class _WebStub:
         return self.messages[index]
 
 
+def _create_lobby(prefix: str, names: list, password: str = "") -> list:
+    """Create one match per name, returns the hosts"""
+    hosts = []
+    for name in names:
+        host = generate_unique_testing_name()
+        create_player(host)
+        db_create_match(prefix + name, host, 4, 5)
+        if password:
+            # No hay endpoint para la contraseña: se cambia en la base y el
+            # índice del lobby se vuelve a cargar
+            with db_session:
+                Match.get(name=prefix + name).password = password
+            lobby_index.clear()
+        hosts.append(host)
+    return hosts
+
+
 def test_match_listing():
-    with patch("app.get_match_list", return_value=[1, 2, 3]):
-        response = client.get("/match/list")
-        assert response.status_code == 200
-        assert response.json() == {"Matches": [1, 2, 3]}
+    prefix = f"x{generate_unique_testing_name()}x"
+    _create_lobby(prefix, ["a", "b", "c"])
+
+    response = client.get("/match/list", params={"name": prefix})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "Matches": [
+            {
+                "name": prefix + name,
+                "min_players": 4,
+                "max_players": 5,
+                "players": 1,
+                "has_password": False,
+                "initiated": False,
+            }
+            for name in ["a", "b", "c"]
+        ],
+        "next_cursor": None,
+    }
+
+
+def test_match_listing_pages():
+    prefix = f"x{generate_unique_testing_name()}x"
+    _create_lobby(prefix, ["a", "b", "c"])
+
+    names = []
+    cursor = None
+    while True:
+        params = {"name": prefix, "limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        page = client.get("/match/list", params=params).json()
+        names.append([m["name"] for m in page["Matches"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert names == [[prefix + "a", prefix + "b"], [prefix + "c"]]
+
+
+def test_match_listing_filters():
+    prefix = f"x{generate_unique_testing_name()}x"
+    _create_lobby(prefix, ["a", "b"])
+    _create_lobby(prefix, ["locked"], password="1234")
+    for _ in range(4):
+        player = generate_unique_testing_name()
+        create_player(player)
+        db_add_player(player, prefix + "b")
+
+    def _names(**params):
+        response = client.get("/match/list", params={"name": prefix, **params})
+        return [m["name"] for m in response.json()["Matches"]]
+
+    assert _names(filter="open") == [prefix + "a", prefix + "locked"]
+    assert _names(has_password=True) == [prefix + "locked"]
+    assert _names(has_password=False) == [prefix + "a", prefix + "b"]
+    assert _names(min_player_count=2) == [prefix + "b"]
+    assert _names(max_player_count=1) == [prefix + "a", prefix + "locked"]
+
+
+def test_match_listing_etag():
+    prefix = f"x{generate_unique_testing_name()}x"
+    _create_lobby(prefix, ["a"])
+
+    response = client.get("/match/list")
+    etag = response.headers["ETag"]
+
+    response = client.get("/match/list", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    player = generate_unique_testing_name()
+    create_player(player)
+    db_add_player(player, prefix + "a")
+
+    response = client.get("/match/list", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_match_listing_from_memory():
+    prefix = f"x{generate_unique_testing_name()}x"
+    _create_lobby(prefix, ["a", "b"])
+    client.get("/match/list")
+
+    with patch("app.load_lobby_index") as load:
+        delete_match(prefix + "a")
+        response = client.get("/match/list", params={"name": prefix})
+    load.assert_not_called()
+    assert [m["name"] for m in response.json()["Matches"]] == [prefix + "b"]
+
+
+def test_match_listing_invalid_limit():
+    response = client.get("/match/list", params={"limit": 0})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Límite inválido"}
+
+
+def test_match_listing_invalid_filter():
+    response = client.get("/match/list", params={"filter": "closed"})
+    assert response.status_code == 422
 
 
 def _assert_match_created(response):
@@ -503,6 +618,28 @@ def test_leave_match_player_host():
     }
 
 
+def test_leave_match_host_forgets_versions():
+    nameGame = generate_unique_testing_name()
+    namePlayer_creator = generate_unique_testing_name()
+    _create_player(namePlayer_creator)
+    body_match = {
+        "match_name": nameGame,
+        "player_name": namePlayer_creator,
+        "min_players": 4,
+        "max_players": 12,
+    }
+    _assert_match_created(client.post("/match/create", json=body_match))
+    match_id = get_match_id(nameGame)
+    state_versions.get(match_id).changed(DEAD_PLAYERS, [])
+    snapshot_cache.get(match_id, (0,), lambda: "{}")
+
+    response = client.put("/match/leave", json=body_match)
+
+    assert response.status_code == 200
+    assert match_id not in state_versions._matches
+    assert match_id not in snapshot_cache._matches
+
+
 def test_leave_match_not_exist():
     nameGame = generate_unique_testing_name()
     namePlayer_creator = generate_unique_testing_name()
@@ -541,88 +678,38 @@ def test_leave_match_player_not_exist():
     assert response.json() == {"detail": "Jugador no encontrado"}
 
 
-class test_save_chat_message(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_save_chat_message(self, mock_get_match):
-        msg_data = {
-            "author": "test_user",
-            "message": "test_message",
-            "timestamp": time(),
-        }
-
-        match = Mock()
-        match.id = 1
-        match.chat_record = []
-
-        mock_get_match.return_value = match
-
-        save_chat_message(match.id, msg_data)
-
-        mock_get_match.assert_called_once_with(match.id)
-        assert match.chat_record[0] == json.dumps(msg_data)
-
-
-class test_get_chat_record(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_get_chat_record(self, mock_get_match):
-        msg_data = {
-            "author": "test_user",
-            "message": "test_message",
-            "timestamp": time(),
-        }
-
-        match = Mock()
-        match.id = 1
-        match.chat_record = []
-        match.chat_record.append(json.dumps(msg_data))
-
-        mock_get_match.return_value = match
-
-        record = get_chat_record(match.id)
-
-        mock_get_match.assert_called_once_with(match.id)
-        assert record == [msg_data]
-
-
-class test_reset_chat_record(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_reset_chat_record(self, mock_get_match):
-        match = Mock()
-        match.chat_record = ["msg1", "msg2"]
-
-        mock_get_match.return_value = match
-
-        reset_chat_record(match.id)
-
-        self.assertEqual(match.chat_record, [])
-
-
-class test_save_log(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_save_log(self, mock_get_match):
-        match = Mock()
-        match.logs_record = ["test_log1"]
-
-        mock_get_match.return_value = match
+class test_game_log(TestCase):
+    def setUp(self):
+        name = generate_unique_testing_name()
+        _create_lobby("", [name])
+        self.match_id = get_match_id(name)
 
-        save_log(match.id, "test_log2")
+    def test_save_log(self):
+        self.assertEqual(save_log(self.match_id, "log1"), 1)
+        self.assertEqual(save_log(self.match_id, "log2", "player1"), 2)
 
-        mock_get_match.assert_called_once_with(match.id)
-        self.assertEqual(match.logs_record, ["test_log1", "test_log2"])
+        self.assertEqual(get_last_log_seq(self.match_id), 2)
 
+    def test_get_logs_visibility(self):
+        save_log(self.match_id, "log1")
+        save_log(self.match_id, "infectado", "player1")
+        save_log(self.match_id, "log3")
 
-class test_get_logs_record(TestCase):
-    @patch("Database.models.Match._get_match")
-    def test_get_logs_record(self, mock_get_match):
-        match = Mock()
-        match.logs_record = ["test_log1", "test_log2"]
+        self.assertEqual(
+            get_logs(self.match_id, "player1"), ["log1", "infectado", "log3"]
+        )
+        self.assertEqual(get_logs(self.match_id, "player2"), ["log1", "log3"])
 
-        mock_get_match.return_value = match
+    def test_get_logs_since(self):
+        for i in range(1, 5):
+            save_log(self.match_id, f"log{i}")
 
-        record = get_logs(match.id)
+        self.assertEqual(get_logs(self.match_id, "player1", 2), ["log3", "log4"])
+        self.assertEqual(get_logs(self.match_id, "player1", 4), [])
 
-        mock_get_match.assert_called_once_with(match.id)
-        self.assertEqual(record, ["test_log1", "test_log2"])
+    def test_empty_log(self):
+        self.assertEqual(get_last_log_seq(self.match_id), 0)
+        self.assertEqual(get_logs(self.match_id, "player1"), [])
 
 
 @pytest.mark.asyncio
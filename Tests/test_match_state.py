@@ -0,0 +1,263 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from Database.Database import *
+from Tests.auxiliar_functions import *
+from Game.app_auxiliars import *
+from Database.models.Match import _get_match
+from Game.match_state import (
+    match_states,
+    MatchState,
+    PlayerState,
+    StateSet,
+    take_snapshot,
+    write_snapshot,
+    card_locations,
+)
+from Database.executor import db_lanes
+
+
+def _start_match(n_players: int = 4):
+    match_name = generate_unique_testing_name()
+    players = [generate_unique_testing_name() for _ in range(n_players)]
+    for player in players:
+        create_player(player)
+    db_create_match(match_name, players[0], 4, 12)
+    for player in players[1:]:
+        db_add_player(player, match_name)
+    started_match(match_name)
+    match_id = get_match_id(match_name)
+    match_states.load(match_id)
+    return match_id, players
+
+
+def _query_count():
+    return sum(stat.db_count for stat in db.local_stats.values())
+
+
+class test_state_set(TestCase):
+    def test_state_set(self):
+        a = Mock(id=1, value="a")
+        b = Mock(id=2, value="b")
+        items = StateSet([a, b])
+
+        self.assertEqual(items.count(), 2)
+        self.assertIn(a, items)
+        self.assertEqual(items.filter(lambda i: i.value == "b").first(), b)
+        self.assertIsNone(items.filter(lambda i: i.value == "c").first())
+        self.assertEqual(len(items.random(5)), 2)
+
+        copy = items.copy()
+        items.remove(a)
+        self.assertNotIn(a, items)
+        self.assertIn(a, copy)
+
+
+class test_match_state(TestCase):
+    def test_started_match_is_loaded(self):
+        match_id, players = _start_match()
+
+        self.assertIsInstance(_get_match(match_id), MatchState)
+        for player in players:
+            self.assertIsInstance(get_player_by_name(player), PlayerState)
+            self.assertEqual(len(get_player_hand(player)), 4)
+
+    def test_game_flow_without_queries(self):
+        match_id, players = _start_match()
+        turn_player = get_player_in_turn(match_id)
+        db.merge_local_stats()
+
+        before = _query_count()
+        card = pick_random_card(turn_player)
+        discard_card(turn_player, card)
+        set_game_state(match_id, GAME_STATE["EXCHANGE"])
+        toggle_direction(match_id)
+        get_game_state_for(players[1])
+        get_next_player(match_id)
+        self.assertEqual(_query_count(), before)
+
+    @db_session
+    def _db_hand(self, player_name: str) -> set:
+        return {c.card for c in Player.get(player_name=player_name).hand}
+
+    def test_flush_writes_snapshot(self):
+        match_id, players = _start_match()
+        turn_player = get_player_in_turn(match_id)
+        db_hand = self._db_hand(turn_player)
+
+        card = pick_random_card(turn_player)
+        set_game_state(match_id, GAME_STATE["PLAY_TURN"])
+        self.assertEqual(self._db_hand(turn_player), db_hand)
+
+        match_states.flush(match_id).result()
+
+        self.assertEqual(self._db_hand(turn_player), db_hand | {card})
+        with db_session:
+            self.assertEqual(Match[match_id].game_state, GAME_STATE["PLAY_TURN"])
+
+    def test_reload_after_flush(self):
+        match_id, players = _start_match()
+        turn_player = get_player_in_turn(match_id)
+        victim = next(p for p in players if p != turn_player)
+        card = pick_random_card(turn_player)
+        kill_player(victim)
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        match_states.load(match_id)
+
+        self.assertTrue(has_card(turn_player, card))
+        self.assertFalse(is_player_alive(victim))
+        self.assertEqual(len(get_discard_deck(match_id).cards), 4)
+
+    def test_reload_keeps_draw_order(self):
+        match_id, players = _start_match()
+        pick_random_card(get_player_in_turn(match_id))
+        pile = [card.id for card in get_deck(match_id).pile]
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        match_states.load(match_id)
+
+        self.assertEqual([card.id for card in get_deck(match_id).pile], pile)
+
+    def test_reshuffle_after_reload(self):
+        match_id, players = _start_match()
+        state = match_states.get(match_id)
+        state.draw_deck.shuffle()
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+        reloaded = match_states.load(match_id)
+
+        state.draw_deck.shuffle()
+        reloaded.draw_deck.shuffle()
+
+        self.assertEqual(reloaded.shuffles, 2)
+        self.assertEqual(
+            [card.id for card in reloaded.draw_deck.pile],
+            [card.id for card in state.draw_deck.pile],
+        )
+
+    def test_card_locations_after_reshuffle(self):
+        match_id, players = _start_match()
+        turn_player = get_player_in_turn(match_id)
+        while not is_deck_empty(match_id):
+            discard_card(turn_player, pick_random_card(turn_player))
+        discarded = {card.id for card in get_discard_deck(match_id).cards}
+
+        card = pick_random_card(turn_player)
+
+        deck = get_deck(match_id)
+        self.assertTrue(has_card(turn_player, card))
+        self.assertTrue(get_discard_deck(match_id).cards.is_empty())
+        self.assertEqual({c.id for c in deck.cards}, discarded - {card})
+        self.assertEqual({c.id for c in deck.pile}, discarded - {card})
+        locations = card_locations(match_states.get(match_id))
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        self.assertEqual(card_locations(match_states.load(match_id)), locations)
+
+    def test_game_log_survives_reload(self):
+        match_id, players = _start_match()
+        save_log(match_id, "log1")
+        save_log(match_id, "infectado", players[1])
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        match_states.load(match_id)
+        save_log(match_id, "log3")
+
+        self.assertEqual(get_logs(match_id, players[0]), ["log1", "log3"])
+        self.assertEqual(get_logs(match_id, players[1], 1), ["infectado", "log3"])
+        self.assertEqual(get_last_log_seq(match_id), 3)
+
+    def test_failed_flush_keeps_unsaved_entries(self):
+        match_id, players = _start_match()
+        save_log(match_id, "log1")
+        save_chat_message(match_id, {"author": players[0], "message": "hola"})
+        with patch(
+            "Game.match_state.write_snapshot", side_effect=TransactionError("caída")
+        ):
+            with self.assertRaises(TransactionError):
+                match_states.flush(match_id).result()
+
+        match_states.flush(match_id).result()
+        match_states.evict(match_id)
+
+        self.assertEqual(get_logs(match_id, players[0]), ["log1"])
+        self.assertEqual(
+            [m["message"] for m in get_chat_page(match_id, players[0])], ["hola"]
+        )
+
+    def test_flush_updates_moved_cards_only(self):
+        match_id, players = _start_match()
+        turn_player = get_player_in_turn(match_id)
+        card = next(iter(get_player_by_name(turn_player).cards)).id
+        discard_card(turn_player, card)
+
+        def _card_updates():
+            return sum(
+                stat.db_count
+                for sql, stat in db.local_stats.items()
+                if sql and sql.startswith('UPDATE "MatchCard"')
+            )
+
+        before = _card_updates()
+        write_snapshot(take_snapshot(match_states.get(match_id)))
+        self.assertEqual(_card_updates() - before, 1)
+
+        with db_session:
+            match_card = MatchCard[Match[match_id], card]
+            self.assertEqual(match_card.location, CARD_LOCATION["DISCARD"])
+            self.assertIsNone(match_card.owner)
+
+    def test_evicted_match_is_read_from_the_database(self):
+        match_id, players = _start_match()
+        match_states.evict(match_id)
+
+        self.assertNotIsInstance(get_player_by_name(players[0]), PlayerState)
+        self.assertNotIsInstance(_get_match(match_id), MatchState)
+        self.assertFalse(match_states.is_loaded(match_id))
+
+    def test_database_threads_do_not_see_the_states(self):
+        match_id, players = _start_match()
+
+        match = db_lanes.any().submit(_get_match, match_id).result()
+        player = db_lanes.any().submit(get_player_by_name, players[0]).result()
+
+        self.assertNotIsInstance(match, MatchState)
+        self.assertNotIsInstance(player, PlayerState)
+        self.assertIsInstance(_get_match(match_id), MatchState)
+
+    def test_other_workers_only_read_rows(self):
+        # Un worker que no es dueño resuelve la partida en el hilo de la base
+        match_id, players = _start_match()
+        match_states.evict(match_id)
+
+        self.assertEqual(
+            db_lanes.any().submit(get_match_id, get_match_name(match_id)).result(),
+            match_id,
+        )
+        self.assertEqual(
+            db_lanes.any().submit(get_player_match, players[0]).result(), match_id
+        )
+        self.assertFalse(match_states.is_loaded(match_id))
+
+    def test_flush_all_only_owned(self):
+        owned, _ = _start_match()
+        _start_match()
+
+        with patch.object(match_states, "flush", wraps=match_states.flush) as flush:
+            match_states.flush_all(lambda match_id: match_id == owned)
+
+        flush.assert_called_once_with(owned)
+
+    def test_finished_match_is_evicted(self):
+        from app import _match_finished
+
+        match_id, players = _start_match()
+        asyncio.run(_match_finished(match_id, get_match_name(match_id)))
+
+        self.assertFalse(match_states.is_loaded(match_id))
+        self.assertIsNone(match_states.get_player(players[0]))
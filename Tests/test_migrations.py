@@ -0,0 +1,283 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from Database.migrations import migrate
+from Database.models.Card import CARD_CATALOG
+
+
+class test_migrate(TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+        # Esquema anterior a los contadores e índices
+        conn = sqlite3.connect(self.filename)
+        with conn:
+            conn.execute('CREATE TABLE "Match" ("id" INTEGER PRIMARY KEY, "name" TEXT)')
+            conn.execute(
+                'CREATE TABLE "Player" ("id" INTEGER PRIMARY KEY, "match" INTEGER, '
+                '"position" INTEGER, "rol" INTEGER, "is_alive" BOOLEAN)'
+            )
+            conn.execute("INSERT INTO \"Match\" VALUES (1, 'a'), (2, 'b')")
+            conn.executemany(
+                'INSERT INTO "Player" VALUES (?, ?, ?, ?, ?)',
+                [(1, 1, 0, 1, 1), (2, 1, 1, 2, 0), (3, 1, 2, 1, 1), (4, None, 0, 0, 0)],
+            )
+        conn.close()
+
+    def _query(self, sql: str) -> list:
+        conn = sqlite3.connect(self.filename)
+        try:
+            with conn:
+                return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_adds_counters(self):
+        migrate(self.filename)
+
+        rows = self._query(
+            'SELECT "id", "player_count", "alive_count" FROM "Match" ORDER BY "id"'
+        )
+        self.assertEqual(rows, [(1, 3, 2), (2, 0, 0)])
+
+    def test_adds_indexes(self):
+        migrate(self.filename)
+
+        indexes = {
+            row[0]
+            for row in self._query("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        self.assertIn("idx_player__match_position", indexes)
+        self.assertIn("idx_player__match_rol", indexes)
+
+    def test_is_idempotent(self):
+        migrate(self.filename)
+        self._query('UPDATE "Match" SET "player_count" = 5 WHERE "id" = 2')
+
+        migrate(self.filename)
+
+        self.assertEqual(
+            self._query('SELECT "player_count" FROM "Match" WHERE "id" = 2'), [(5,)]
+        )
+
+    def test_moves_logs_record(self):
+        self._query('ALTER TABLE "Match" ADD COLUMN "logs_record" TEXT')
+        self._query(
+            'UPDATE "Match" SET "logs_record" = \'["log1", "$p2", "log3"]\' '
+            'WHERE "id" = 1'
+        )
+        self._query('UPDATE "Match" SET "logs_record" = \'[]\' WHERE "id" = 2')
+
+        migrate(self.filename)
+        migrate(self.filename)
+
+        self.assertEqual(
+            self._query('SELECT * FROM "LogEntry" ORDER BY "match", "seq"'),
+            [
+                (1, 1, "log1", None),
+                (1, 2, "LA COSA TE INFECTÓ!!", "p2"),
+                (1, 3, "log3", None),
+            ],
+        )
+        columns = [row[1] for row in self._query('PRAGMA table_info("Match")')]
+        self.assertNotIn("logs_record", columns)
+
+    def test_adds_shuffles(self):
+        migrate(self.filename)
+        migrate(self.filename)
+
+        self.assertEqual(
+            self._query('SELECT "shuffles" FROM "Match" ORDER BY "id"'), [(0,), (0,)]
+        )
+
+    def test_missing_file(self):
+        filename = self.filename + ".missing"
+
+        migrate(filename)
+
+        self.assertFalse(os.path.exists(filename))
+
+
+# Esquema que Pony creaba con las entidades anteriores a MatchCard y ChatMessage
+BASELINE_SCHEMA = """
+CREATE TABLE "Card" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "number" INTEGER,
+  "card_name" TEXT NOT NULL,
+  "type" INTEGER NOT NULL
+);
+CREATE TABLE "Match" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "name" TEXT UNIQUE NOT NULL,
+  "password" TEXT NOT NULL,
+  "min_players" INTEGER NOT NULL,
+  "max_players" INTEGER NOT NULL,
+  "initiated" BOOLEAN,
+  "clockwise" BOOLEAN,
+  "current_player" INTEGER NOT NULL,
+  "top_card" INTEGER,
+  "game_state" INTEGER,
+  "played_card" INTEGER,
+  "turn_player" TEXT,
+  "target_player" TEXT,
+  "target_obstacle" INTEGER,
+  "exchange_card" INTEGER,
+  "exchange_player" TEXT,
+  "position_exchange_victim" TEXT,
+  "last_infected" TEXT,
+  "obstacles" INT[] NOT NULL,
+  "exchange_json" JSON NOT NULL,
+  "timestamp" REAL,
+  "chat_record" TEXT[] NOT NULL,
+  "logs_record" TEXT[] NOT NULL,
+  "amount_discarded" INTEGER
+);
+CREATE TABLE "Deck" (
+  "match" INTEGER NOT NULL REFERENCES "Match" ("id") ON DELETE CASCADE,
+  "is_discard" BOOLEAN NOT NULL,
+  PRIMARY KEY ("match", "is_discard")
+);
+CREATE TABLE "Card_Deck" (
+  "card" INTEGER NOT NULL REFERENCES "Card" ("id") ON DELETE CASCADE,
+  "deck_match" INTEGER NOT NULL,
+  "deck_is_discard" BOOLEAN NOT NULL,
+  PRIMARY KEY ("card", "deck_match", "deck_is_discard"),
+  FOREIGN KEY ("deck_match", "deck_is_discard")
+    REFERENCES "Deck" ("match", "is_discard") ON DELETE CASCADE
+);
+CREATE INDEX "idx_card_deck" ON "Card_Deck" ("deck_match", "deck_is_discard");
+CREATE TABLE "Player" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "player_name" TEXT UNIQUE NOT NULL,
+  "match" INTEGER REFERENCES "Match" ("id") ON DELETE SET NULL,
+  "is_host" BOOLEAN,
+  "position" INTEGER,
+  "rol" INTEGER,
+  "is_alive" BOOLEAN,
+  "in_game" BOOLEAN,
+  "in_quarantine" INTEGER
+);
+CREATE INDEX "idx_player__match" ON "Player" ("match");
+CREATE TABLE "Card_Player" (
+  "card" INTEGER NOT NULL REFERENCES "Card" ("id") ON DELETE CASCADE,
+  "player" INTEGER NOT NULL REFERENCES "Player" ("id") ON DELETE CASCADE,
+  PRIMARY KEY ("card", "player")
+);
+CREATE INDEX "idx_card_player" ON "Card_Player" ("player");
+"""
+
+# Lee el archivo migrado con las entidades actuales
+MAPPING_CHECK = """
+import json
+from Database.Database import *
+
+with db_session:
+    print(json.dumps({
+        "cards": sorted(
+            (c.card, c.location, c.owner and c.owner.id, c.position)
+            for c in MatchCard.select()
+        ),
+        "chat": [(m.seq, m.author, m.target) for m in ChatMessage.select()],
+        "match": Match[1].to_dict(only=["seed", "shuffles", "played_card"]),
+    }))
+"""
+
+
+class test_migrate_baseline(TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+        # Partida iniciada de 4 jugadores en el esquema original. Las cartas
+        # se registraron más de una vez: sus ids no empiezan en 1
+        cards = [
+            (1000 + entry.id, entry.number, entry.card_name, entry.type)
+            for entry in CARD_CATALOG.values()
+        ]
+        self.used = [card for card in cards if card[1] is None or card[1] <= 4]
+        chat = [
+            json.dumps({"author": "p1", "message": "hola", "timestamp": 1.0}),
+            json.dumps({"author": "", "message": "p2 entró", "target": "p2"}),
+        ]
+        conn = sqlite3.connect(self.filename)
+        with conn:
+            conn.executescript(BASELINE_SCHEMA)
+            conn.executemany('INSERT INTO "Card" VALUES (?, ?, ?, ?)', cards)
+            conn.execute(
+                'INSERT INTO "Match" VALUES (1, \'a\', \'\', 4, 12, 1, 1, 0, ?, 2, '
+                "?, NULL, NULL, NULL, NULL, NULL, NULL, NULL, '[0,0,0,0]', '{}', "
+                "NULL, ?, '[\"log1\"]', 0)",
+                (self.used[-1][0], self.used[0][0], json.dumps(chat)),
+            )
+            conn.executemany(
+                'INSERT INTO "Player" VALUES (?, ?, 1, ?, ?, 1, 1, 1, 0)',
+                [(p, f"p{p}", p == 1, p - 1) for p in range(1, 5)],
+            )
+            conn.execute('INSERT INTO "Deck" VALUES (1, 0), (1, 1)')
+            hands = [(self.used[i][0], (i - 1) // 4 + 1) for i in range(1, 17)]
+            conn.executemany('INSERT INTO "Card_Player" VALUES (?, ?)', hands)
+            conn.executemany(
+                'INSERT INTO "Card_Deck" VALUES (?, 1, 0)',
+                [(card[0],) for card in self.used[17:-2]],
+            )
+            conn.execute('INSERT INTO "Card_Deck" VALUES (?, 1, 1)', (self.used[-2][0],))
+        conn.close()
+
+    def _read_with_current_schema(self) -> dict:
+        env = {**os.environ, "LACOSA_DATABASE_URL": f"sqlite:///{self.filename}"}
+        result = subprocess.run(
+            [sys.executable, "-c", MAPPING_CHECK],
+            env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout)
+
+    def test_generates_mapping(self):
+        migrate(self.filename)
+        migrate(self.filename)
+
+        state = self._read_with_current_schema()
+
+        catalog_id = {card[0]: card[0] - 1000 for card in self.used}
+        locations = {card: rest for card, *rest in state["cards"]}
+        self.assertEqual(set(locations), set(catalog_id.values()))
+        self.assertEqual(locations[catalog_id[self.used[0][0]]], [3, None, None])
+        self.assertEqual(locations[catalog_id[self.used[1][0]]], [2, 1, None])
+        self.assertEqual(locations[catalog_id[self.used[16][0]]], [2, 4, None])
+        self.assertEqual(locations[catalog_id[self.used[-2][0]]], [1, None, None])
+        # La carta de arriba queda en la cima del mazo
+        deck = [card for card, (location, _, _) in locations.items() if location == 0]
+        # used[17:-2] más la de arriba
+        self.assertEqual(len(deck), len(self.used) - 18)
+        self.assertEqual(
+            locations[catalog_id[self.used[-1][0]]], [0, None, len(deck) - 1]
+        )
+        self.assertEqual(state["chat"], [[1, "p1", None], [2, "", "p2"]])
+        self.assertIsNotNone(state["match"]["seed"])
+        self.assertEqual(state["match"]["shuffles"], 0)
+        self.assertEqual(state["match"]["played_card"], 1)
+
+    def test_drops_old_tables(self):
+        migrate(self.filename)
+
+        conn = sqlite3.connect(self.filename)
+        try:
+            tables = {
+                row[0]
+                for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+            columns = {row[1] for row in conn.execute('PRAGMA table_info("Match")')}
+        finally:
+            conn.close()
+        self.assertFalse({"Deck", "Card_Deck", "Card_Player"} & tables)
+        self.assertFalse({"top_card", "chat_record", "logs_record"} & columns)
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import tempfile
+import pytest
+from connection.broker import Broker
+from connection.connections import ConnectionManager
+from connection.pubsub import (
+    InProcessBus,
+    InProcessHub,
+    SocketBus,
+    bus_from_url,
+)
+from connection.socket_messages import BATCH
+
+
+class _WebStub:
+    def __init__(self):
+        self.messages = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame):
+        self.messages.append(json.loads(frame))
+
+
+def _workers(count: int) -> list:
+    """Managers of the same process sharing a hub, as if they were workers"""
+    hub = InProcessHub()
+    return [ConnectionManager(bus=InProcessBus(hub)) for _ in range(count)]
+
+
+@pytest.fixture
+def connected(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_other_workers(connected):
+    worker1, worker2 = _workers(2)
+    socket1, socket2 = _WebStub(), _WebStub()
+    await worker1.connect(socket1, 1, "player1")
+    await worker2.connect(socket2, 1, "player2")
+
+    report = await worker1.broadcast("test_type", "test_content", 1)
+
+    message = {"message_type": "test_type", "message_content": "test_content"}
+    assert socket1.messages == [message]
+    assert socket2.messages == [message]
+    # El reporte cuenta sólo los sockets del proceso
+    assert report.delivered == 1
+
+
+@pytest.mark.asyncio
+async def test_personal_message_reaches_other_worker(connected):
+    worker1, worker2 = _workers(2)
+    socket1, socket2 = _WebStub(), _WebStub()
+    await worker1.connect(socket1, 1, "player1")
+    await worker2.connect(socket2, 1, "player2")
+
+    await worker1.send_personal_message("personal", 2, 1, "player2")
+
+    assert socket1.messages == []
+    assert socket2.messages == [{"message_type": "personal", "message_content": 2}]
+
+
+@pytest.mark.asyncio
+async def test_only_workers_of_the_match_receive(connected):
+    worker1, worker2, worker3 = _workers(3)
+    await worker1.connect(_WebStub(), 1, "player1")
+    await worker2.connect(_WebStub(), 1, "player2")
+    await worker3.connect(_WebStub(), 2, "player3")
+    delivered = []
+
+    async def deliver(*args):
+        delivered.append(args)
+
+    worker3.bus.attach(deliver)
+
+    await worker1.broadcast("test_type", "test_content", 1)
+
+    assert delivered == []
+    assert worker1.bus.hub.rooms[1] == {worker1.bus, worker2.bus}
+
+
+@pytest.mark.asyncio
+async def test_last_disconnect_leaves_the_match(connected):
+    worker1, worker2 = _workers(2)
+    socket = _WebStub()
+    await worker1.connect(_WebStub(), 1, "player1")
+    await worker2.connect(socket, 1, "player2")
+
+    worker2.disconnect("player2", 1, socket)
+    await worker1.broadcast("test_type", "test_content", 1)
+
+    assert worker1.bus.hub.rooms[1] == {worker1.bus}
+    assert socket.messages == []
+
+
+@pytest.mark.asyncio
+async def test_batch_reaches_other_worker_as_batch(connected):
+    worker1, worker2 = _workers(2)
+    socket = _WebStub()
+    await worker1.connect(_WebStub(), 1, "player1")
+    await worker2.connect(socket, 1, "player2")
+
+    async with worker1.batch(1):
+        await worker1.broadcast("first", 1, 1)
+        await worker1.send_personal_message("personal", 2, 1, "player1")
+        await worker1.broadcast("third", 3, 1)
+
+    assert socket.messages == [
+        {
+            "message_type": BATCH,
+            "message_content": [
+                {"message_type": "first", "message_content": 1},
+                {"message_type": "third", "message_content": 3},
+            ],
+        }
+    ]
+
+
+def test_bus_from_url():
+    assert isinstance(bus_from_url("local"), InProcessBus)
+    bus = bus_from_url("unix:///tmp/lacosa-test.sock")
+    assert isinstance(bus, SocketBus)
+    assert bus.path == "/tmp/lacosa-test.sock"
+    with pytest.raises(ValueError):
+        bus_from_url("redis://localhost")
+
+
+async def _wait_for(condition, timeout=2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_socket_bus_through_broker(connected):
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "bus.sock")
+    broker = Broker(path)
+    await broker.start()
+    workers = [
+        ConnectionManager(bus=SocketBus(path, retry_delay=0.01)) for _ in range(3)
+    ]
+    worker1, worker2, worker3 = workers
+    try:
+        for worker in workers:
+            await worker.start()
+        await _wait_for(lambda: all(w.bus.connected.is_set() for w in workers))
+
+        socket1, socket2, socket3 = _WebStub(), _WebStub(), _WebStub()
+        await worker1.connect(socket1, 1, "player1")
+        await worker2.connect(socket2, 1, "player2")
+        await worker3.connect(socket3, 2, "player3")
+        await _wait_for(lambda: len(broker.rooms.get(1, ())) == 2)
+
+        await worker1.broadcast("test_type", "test_content", 1)
+        await worker1.send_personal_message("personal", 2, 1, "player2")
+        await _wait_for(lambda: len(socket2.messages) == 2)
+
+        assert socket1.messages == [
+            {"message_type": "test_type", "message_content": "test_content"}
+        ]
+        assert socket2.messages == [
+            {"message_type": "test_type", "message_content": "test_content"},
+            {"message_type": "personal", "message_content": 2},
+        ]
+        assert socket3.messages == []
+    finally:
+        for worker in workers:
+            await worker.stop()
+        await broker.stop()
+        directory.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_socket_bus_rejoins_after_reconnecting(connected):
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "bus.sock")
+    worker = ConnectionManager(bus=SocketBus(path, retry_delay=0.01))
+    await worker.connect(_WebStub(), 1, "player1")
+    # El broker arranca después que el worker
+    await worker.start()
+    broker = Broker(path)
+    await broker.start()
+    try:
+        await _wait_for(lambda: 1 in broker.rooms)
+    finally:
+        await worker.stop()
+        await broker.stop()
+        directory.cleanup()
@@ -0,0 +1,131 @@
+import json
+from unittest import TestCase
+from fastapi.testclient import TestClient
+from app import app
+from Database.Database import *
+from Database.models.Match import *
+from Game.reconnect_snapshot import reconnect_snapshot, snapshot_cache
+from Game.state_versions import state_versions
+from connection.serializer import encode_with_parts
+from connection.socket_messages import *
+from Tests.auxiliar_functions import *
+from Tests.test_match_state import _start_match, _query_count
+
+
+class test_reconnect_snapshot(TestCase):
+    def setUp(self):
+        self.match_id, self.players = _start_match()
+
+    def _snapshot(self, player_name: str, logs_since: int = 0) -> dict:
+        message = json.loads(reconnect_snapshot(self.match_id, player_name, logs_since))
+        self.assertEqual(message["message_type"], RECONNECT_SNAPSHOT)
+        return message["message_content"]
+
+    def test_content(self):
+        save_log(self.match_id, "log1")
+        save_log(self.match_id, "log2")
+
+        snapshot = self._snapshot(self.players[0], logs_since=1)
+
+        self.assertEqual(snapshot["version"], 0)
+        self.assertEqual(
+            set(snapshot["match"]),
+            {
+                POSITIONS,
+                MATCH_STATE,
+                DEAD_PLAYERS,
+                QUARANTINE,
+                LOGS_SEQ,
+                OBSTACLES,
+                DIRECTION,
+                DEFENSE_STAMP,
+            },
+        )
+        self.assertEqual(snapshot["match"][LOGS_SEQ], 2)
+        player = snapshot["player"]
+        self.assertEqual(player[INITIAL_STATE], get_game_state_for(self.players[0]))
+        self.assertEqual(player[LOGS_RECORD], {"seq": 2, "logs": ["log2"]})
+        self.assertEqual(player[CHAT_RECORD], [])
+        self.assertNotIn(ALREADY_SELECTED, player)
+
+    def test_common_part_is_shared(self):
+        first = self._snapshot(self.players[0])
+        before = _query_count()
+        second = self._snapshot(self.players[1])
+
+        self.assertEqual(first["match"], second["match"])
+        self.assertNotEqual(
+            first["player"][INITIAL_STATE]["hand"],
+            second["player"][INITIAL_STATE]["hand"],
+        )
+        self.assertEqual((snapshot_cache.hits, snapshot_cache.misses), (1, 1))
+        # La partida está en memoria: no se consulta la base
+        self.assertEqual(_query_count(), before)
+
+    def test_new_version_rebuilds(self):
+        self._snapshot(self.players[0])
+        tracker = state_versions.get(self.match_id)
+        tracker.changed(DEAD_PLAYERS, ["alguien"])
+        tracker.commit()
+
+        snapshot = self._snapshot(self.players[1])
+
+        self.assertEqual(snapshot["version"], 1)
+        self.assertEqual(snapshot_cache.misses, 2)
+
+    def test_untracked_changes_rebuild(self):
+        self._snapshot(self.players[0])
+        toggle_direction(self.match_id)
+
+        snapshot = self._snapshot(self.players[1])
+
+        self.assertFalse(snapshot["match"][DIRECTION])
+        self.assertEqual(snapshot_cache.misses, 2)
+
+
+class test_encode_with_parts(TestCase):
+    def test_splices_encoded_parts(self):
+        frame = encode_with_parts("tipo", {"a": 1}, {"b": '{"c":[1,2]}'})
+
+        self.assertEqual(
+            json.loads(frame),
+            {"message_type": "tipo", "message_content": {"a": 1, "b": {"c": [1, 2]}}},
+        )
+
+    def test_empty_content(self):
+        frame = encode_with_parts("tipo", {}, {"b": "2"})
+
+        self.assertEqual(json.loads(frame)["message_content"], {"b": 2})
+
+
+def test_reconnect_sends_one_snapshot_to_the_player():
+    client = TestClient(app)
+    match_name = generate_unique_testing_name()
+    players = [generate_unique_testing_name() for _ in range(4)]
+    for player in players:
+        client.post("/player/create", data={"name_player": player})
+    client.post(
+        "/match/create",
+        json={
+            "match_name": match_name,
+            "player_name": players[0],
+            "min_players": 4,
+            "max_players": 12,
+        },
+    )
+    for player in players[1:]:
+        client.post("/match/join", json={"match_name": match_name, "player_name": player})
+    client.post("/match/start", json={"match_name": match_name, "player_name": players[0]})
+
+    with client.websocket_connect(f"/ws/{match_name}/{players[1]}") as websocket:
+        message = websocket.receive_json()
+
+    if message["message_type"] == BATCH:
+        messages = message["message_content"]
+    else:
+        messages = [message]
+    types = [message["message_type"] for message in messages]
+    assert types.count(RECONNECT_SNAPSHOT) == 1
+    assert INITIAL_STATE not in types
+    snapshot = messages[types.index(RECONNECT_SNAPSHOT)]["message_content"]
+    assert snapshot["version"] == state_versions.get(get_match_id(match_name)).version
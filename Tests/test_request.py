@@ -4,16 +4,17 @@ from Database.Database import *
 from Tests.auxiliar_functions import *
 from connection.request_handler import parse_request, RequestException
 from Game.app_auxiliars import *
+from connection.socket_messages import CHAT
 
 
 class test_parse_request(TestCase):
     def test_parse_request(self):
-        json = '{"message_type": "test", "message_content": "test_content"}'
+        json = '{"message_type": "chat", "message_content": {"message": "test"}}'
 
         type, content = parse_request(json)
 
-        self.assertEqual(type, "test")
-        self.assertEqual(content, "test_content")
+        self.assertEqual(type, CHAT)
+        self.assertEqual(content.message, "test")
 
     def test_parse_request_invalid(self):
         json = '{"message_type": "test", "message_content": "test_content"'
@@ -1,13 +1,19 @@
+import json
+import threading
 from unittest.mock import Mock, patch, AsyncMock
 from unittest import TestCase
 from Database.Database import *
+from Database.Database import _CountingDatabase
 from app import *
 from Tests.auxiliar_functions import *
 from Game.app_auxiliars import *
 from Database.models.Match import _get_match
 from connection.request_handler import *
 import pytest
+from fastapi.testclient import TestClient
 from connection.connections import *
+from connection.request_scope import request_scope, request_stats
+from Game.match_state import match_states
 
 
 class _WebStub:
@@ -40,170 +46,150 @@ socket = _WebStub()
 
 class test_parse_request(TestCase):
     def test_parse_request(self):
-        request = '{"message_type": "CHAT", "message_content": {"message": "Hola"}}'
-        expected = ("CHAT", {"message": "Hola"})
-        self.assertEqual(parse_request(request), expected)
+        request = '{"message_type": "chat", "message_content": {"message": "Hola"}}'
+        self.assertEqual(parse_request(request), (CHAT, ChatRequest(message="Hola")))
+
+    def test_parse_request_without_content_model(self):
+        request = '{"message_type": "robar carta", "message_content": ""}'
+        self.assertEqual(parse_request(request), (PICKUP_CARD, None))
 
     def test_parse_request_invalid(self):
-        request = '{"message_type": "CHAT", "message_content": {"message": "Hola"}'
-        with self.assertRaises(RequestException):
+        requests = [
+            '{"message_type": "chat", "message_content": {"message": "Hola"}',
+            '{"message_type": "chat"}',
+            '["chat", {"message": "Hola"}]',
+            '{"message_type": ["chat"], "message_content": {}}',
+            '{"message_type": "chat", "message_content": {"message": 1}}',
+            '{"message_type": "jugar carta", "message_content": {"card_id": "uno"}}',
+            '{"message_type": "revelaciones", "message_content": {"decision": "x"}}',
+        ]
+        for request in requests:
+            with self.assertRaises(RequestException, msg=request):
+                parse_request(request)
+
+    def test_parse_request_unknown_type(self):
+        request = '{"message_type": "CHAT", "message_content": {"message": "Hola"}}'
+        with self.assertRaisesRegex(RequestException, "Petición no reconocida"):
             parse_request(request)
 
-
-@pytest.mark.asyncio
-async def test_handle_request_chat(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    chat_handler = mocker.patch("connection.request_handler.chat_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    chat_handler.assert_called_once_with({"message": "Hola"}, "match_id", "player_name")
-
-
-@pytest.mark.asyncio
-async def test_handle_request_match_not_found(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch("connection.request_handler.chat_handler", side_effect=MatchNotFound)
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_key_error(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch("connection.request_handler.chat_handler", side_effect=KeyError)
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_request_exception(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch(
-        "connection.request_handler.chat_handler", side_effect=RequestException
-    )
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_game_exception(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch("connection.request_handler.chat_handler", side_effect=GameException)
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_database_error(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch("connection.request_handler.chat_handler", side_effect=DatabaseError)
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_manager_exception(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(CHAT, {"message": "Hola"}),
-    )
-    mocker.patch(
-        "connection.request_handler.chat_handler", side_effect=ManagerException
-    )
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_pickup_card(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request", return_value=(PICKUP_CARD, {})
-    )
-    mocker.patch("connection.request_handler.pickup_card_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
+    def test_every_incoming_message_has_a_route(self):
+        self.assertEqual(
+            set(request_routes),
+            {
+                CHAT,
+                PICKUP_CARD,
+                PLAY_CARD,
+                DISCARD_CARD,
+                SKIP_DEFENSE,
+                EXCHANGE_CARD,
+                DECLARE,
+                REVELACIONES,
+                RESYNC,
+                CHAT_HISTORY,
+            },
+        )
+
+
+def _route(mocker, msg_type: str, **kwargs):
+    """Replace the handler of the message type, returning the mock"""
+    handler = mocker.AsyncMock(**kwargs)
+    route = request_routes[msg_type]
+    mocker.patch.object(match_states, "is_loaded", return_value=True)
+    mocker.patch.dict(request_routes, {msg_type: route._replace(handler=handler)})
+    return handler
+
+
+def _request(msg_type: str, content) -> str:
+    return json.dumps({"message_type": msg_type, "message_content": content})
 
 
 @pytest.mark.asyncio
-async def test_handle_request_play_card(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(PLAY_CARD, {"card_id": 1, "target": "target"}),
+async def test_handle_request_chat(mocker):
+    chat_handler = _route(mocker, CHAT)
+    await handle_request(
+        _request(CHAT, {"message": "Hola"}), "match_id", "player_name", "websocket"
     )
-    mocker.patch("connection.request_handler.play_card_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
-
-
-@pytest.mark.asyncio
-async def test_handle_request_discard_card(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(DISCARD_CARD, {"card_id": 1}),
+    chat_handler.assert_called_once_with(
+        ChatRequest(message="Hola"), "match_id", "player_name"
     )
-    mocker.patch("connection.request_handler.discard_card_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
 
 
 @pytest.mark.asyncio
-async def test_handle_request_skip_defense(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request", return_value=(SKIP_DEFENSE, {})
+async def test_handle_request_match_not_found(mocker):
+    _route(mocker, CHAT, side_effect=MatchNotFound)
+    send_error = mocker.patch("connection.request_handler.manager.send_error_message")
+    await handle_request(
+        _request(CHAT, {"message": "Hola"}), "match_id", "player_name", "websocket"
     )
-    mocker.patch("connection.request_handler.skip_defense_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
+    send_error.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_handle_request_exchange_card(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(EXCHANGE_CARD, {"card_id": 1}),
+@pytest.mark.parametrize(
+    "exception, error",
+    [
+        (KeyError, "Invalid request"),
+        (RequestException("request"), "request"),
+        (GameException("game"), "game"),
+        (DatabaseError("database"), "database"),
+        (ManagerException("manager"), "manager"),
+    ],
+)
+async def test_handle_request_exceptions(mocker, exception, error):
+    _route(mocker, CHAT, side_effect=exception)
+    send_error = mocker.patch("connection.request_handler.manager.send_error_message")
+    await handle_request(
+        _request(CHAT, {"message": "Hola"}), "match_id", "player_name", "websocket"
     )
-    mocker.patch("connection.request_handler.exchange_card_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
+    send_error.assert_called_once_with(error, "websocket")
 
 
 @pytest.mark.asyncio
-async def test_handle_request_declaration(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(DECLARE, {"declaration": "declaration"}),
+async def test_handle_request_invalid_content(mocker):
+    play_card_handler = _route(mocker, PLAY_CARD)
+    send_error = mocker.patch("connection.request_handler.manager.send_error_message")
+    await handle_request(
+        _request(PLAY_CARD, {"target": "target"}), "match_id", "player_name", "websocket"
     )
-    mocker.patch("connection.request_handler.declaration_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
+    play_card_handler.assert_not_called()
+    send_error.assert_called_once_with("Invalid request", "websocket")
 
 
 @pytest.mark.asyncio
-async def test_handle_request_revelaciones(mocker):
-    mocker.patch(
-        "connection.request_handler.parse_request",
-        return_value=(REVELACIONES, {"card_id": 1}),
+@pytest.mark.parametrize(
+    "msg_type, content, expected",
+    [
+        (PICKUP_CARD, {}, None),
+        (
+            PLAY_CARD,
+            {"card_id": 1, "target": "target"},
+            PlayCardRequest(card_id=1, target="target"),
+        ),
+        (PLAY_CARD, {"card_id": 1}, PlayCardRequest(card_id=1, target="")),
+        (
+            PLAY_CARD,
+            {"card_id": 1, "target": 3},
+            PlayCardRequest(card_id=1, target=3),
+        ),
+        (DISCARD_CARD, {"card_id": 1}, CardRequest(card_id=1)),
+        (SKIP_DEFENSE, {}, None),
+        (EXCHANGE_CARD, {"card_id": 1}, CardRequest(card_id=1)),
+        (DECLARE, {"declaration": "declaration"}, None),
+        (
+            REVELACIONES,
+            {"decision": "revelar mano"},
+            RevelacionesRequest(decision="revelar mano"),
+        ),
+        (RESYNC, {}, ResyncRequest()),
+        (CHAT_HISTORY, {"before": 10}, ChatHistoryRequest(before=10)),
+    ],
+)
+async def test_handle_request_dispatch(mocker, msg_type, content, expected):
+    handler = _route(mocker, msg_type)
+    await handle_request(
+        _request(msg_type, content), "match_id", "player_name", "websocket"
     )
-    mocker.patch("connection.request_handler.play_revelaciones_handler")
-    await handle_request("request", "match_id", "player_name", "websocket")
-    assert True
+    handler.assert_called_once_with(expected, "match_id", "player_name")
 
 
 @pytest.mark.asyncio
@@ -246,7 +232,9 @@ async def test_play_card_handler(mocker):
     )
     get_player_hand = mocker.patch("connection.request_handler.get_player_hand")
     get_player_hand.return_value = ["card1", "card2", "card3", "card4"]
-    await play_card_handler({"card_id": 1, "target": "target"}, None, "player_name")
+    await play_card_handler(
+        PlayCardRequest(card_id=1, target="target"), None, "player_name"
+    )
     get_player_hand.assert_called_once_with("player_name")
     assert socket.get(0) == ["card1", "card2", "card3", "card4"]
     socket.reset()
@@ -261,7 +249,7 @@ async def test_discard_card_handler(mocker):
     )
     get_player_hand = mocker.patch("connection.request_handler.get_player_hand")
     get_player_hand.return_value = ["card1", "card2", "card3", "card4"]
-    await discard_card_handler({"card_id": 1}, None, "player_name")
+    await discard_card_handler(CardRequest(card_id=1), None, "player_name")
     get_player_hand.assert_called_once_with("player_name")
     assert socket.get(0) == ["card1", "card2", "card3", "card4"]
     socket.reset()
@@ -285,12 +273,109 @@ async def test_skip_defense_handler(mocker):
 @pytest.mark.asyncio
 async def test_exchange_card_handler(mocker):
     exchange_handler = mocker.patch("connection.request_handler.exchange_handler")
-    await exchange_card_handler({"card_id": 1}, None, "player_name")
+    await exchange_card_handler(CardRequest(card_id=1), None, "player_name")
     exchange_handler.assert_called_once_with("player_name", 1)
 
 
+@pytest.mark.asyncio
+async def test_chat_history_handler(mocker):
+    get_chat_records_for = mocker.patch(
+        "connection.request_handler.get_chat_records_for", return_value=["msg"]
+    )
+    mocker.patch(
+        "connection.request_handler.manager.send_message_to",
+        side_effect=socket.send_message_to,
+    )
+    await chat_history_handler(ChatHistoryRequest(before=10), 1, "player_name")
+    get_chat_records_for.assert_called_once_with(1, "player_name", 10)
+    assert socket.get(0) == {"before": 10, "messages": ["msg"]}
+    socket.reset()
+
+
 @pytest.mark.asyncio
 async def test_play_revelaciones_handler(mocker):
     play_revelaciones = mocker.patch("connection.request_handler.play_revelaciones")
-    await play_revelaciones_handler({"decision": "decision"}, None, "player_name")
-    play_revelaciones.assert_called_once_with("player_name", "decision")
+    await play_revelaciones_handler(
+        RevelacionesRequest(decision="revelar carta"), None, "player_name"
+    )
+    play_revelaciones.assert_called_once_with("player_name", "revelar carta")
+
+
+def test_request_scope_counts_queries():
+    with request_scope() as scope:
+        player_exists(generate_unique_testing_name())
+        player_exists(generate_unique_testing_name())
+    assert scope.queries == 2
+    assert request_stats.last_queries == 2
+
+    player_exists(generate_unique_testing_name())
+    assert scope.queries == 2
+
+
+
+def test_request_stats_endpoint():
+    with request_scope():
+        player_exists(generate_unique_testing_name())
+
+    response = TestClient(app).get("/stats/requests")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "requests": request_stats.requests,
+        "queries": request_stats.queries,
+        "max_queries": request_stats.max_queries,
+        "last_queries": 1,
+        "average": request_stats.average(),
+    }
+
+@pytest.mark.asyncio
+async def test_handle_request_started_match_without_queries(mocker):
+    match_name = generate_unique_testing_name()
+    players = [generate_unique_testing_name() for _ in range(4)]
+    for player in players:
+        create_player(player)
+    db_create_match(match_name, players[0], 4, 12)
+    for player in players[1:]:
+        db_add_player(player, match_name)
+    started_match(match_name)
+    match_states.load(get_match_id(match_name))
+    match_id = get_match_id(match_name)
+
+    request = '{"message_type": "chat", "message_content": {"message": "Hola"}}'
+    await handle_request(request, match_id, players[0], "websocket")
+
+    assert request_stats.last_queries == 0
+
+
+@pytest.mark.asyncio
+async def test_handle_request_lobby_without_queries_on_loop(mocker):
+    match_name = generate_unique_testing_name()
+    players = [generate_unique_testing_name() for _ in range(4)]
+    for player in players:
+        create_player(player)
+    db_create_match(match_name, players[0], 4, 12)
+    for player in players[1:]:
+        db_add_player(player, match_name)
+    match_id = get_match_id(match_name)
+
+    threads = []
+    exec_sql = _CountingDatabase._exec_sql
+
+    def recording_exec_sql(self, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return exec_sql(self, *args, **kwargs)
+
+    mocker.patch.object(_CountingDatabase, "_exec_sql", recording_exec_sql)
+    broadcast = mocker.patch("connection.request_handler.manager.broadcast")
+    send_error = mocker.patch("connection.request_handler.manager.send_error_message")
+
+    await handle_request(
+        _request(CHAT, {"message": "Hola"}), match_id, players[0], "websocket"
+    )
+    await handle_request(
+        _request(PICKUP_CARD, {}), match_id, players[0], "websocket"
+    )
+
+    assert threads and threading.current_thread() not in threads
+    assert broadcast.call_args.args[0] == CHAT_NOTIFICATION
+    send_error.assert_called_once_with("Partida no ha iniciado", "websocket")
@@ -0,0 +1,145 @@
+from unittest import TestCase
+from unittest.mock import Mock
+from random import Random
+from Tests.auxiliar_functions import *
+from Game.app_auxiliars import *
+from Game.seat_ring import SeatRing, seat_rings
+from Game.match_state import match_states
+
+
+def _match(alive: list, obstacles: list) -> Mock:
+    match = Mock()
+    match.id = 1
+    match.players = []
+    for position, is_alive in enumerate(alive):
+        player = Mock()
+        player.player_name = f"p{position}"
+        player.position = position
+        player.is_alive = is_alive
+        match.players.append(player)
+    match.obstacles = obstacles
+    return match
+
+
+# Recorridos asiento por asiento, como se resolvían antes del índice
+def _walk(alive: list, position: int, step: int) -> int:
+    while True:
+        position = (position + step) % len(alive)
+        if alive[position]:
+            return position
+
+
+def _walk_door_right(obstacles: list, start: int, end: int) -> int:
+    while start != end:
+        if obstacles[start]:
+            return start
+        start = (start + 1) % len(obstacles)
+    return -1
+
+
+def _walk_door_left(obstacles: list, start: int, end: int) -> int:
+    while start != end:
+        if obstacles[start - 1]:
+            return (start - 1) % len(obstacles)
+        start = (start - 1) % len(obstacles)
+    return -1
+
+
+class test_seat_ring(TestCase):
+    def test_matches_seat_walk(self):
+        rng = Random(0)
+        for _ in range(200):
+            size = rng.randint(4, 12)
+            alive = [rng.random() < 0.7 for _ in range(size)]
+            alive[rng.randrange(size)] = True
+            obstacles = [rng.random() < 0.3 for _ in range(size)]
+            ring = SeatRing(_match(alive, obstacles))
+
+            self.assertEqual(ring.seats, [f"p{p}" for p in range(size)])
+            for position in range(size):
+                self.assertEqual(ring.right(position), _walk(alive, position, 1))
+                self.assertEqual(ring.left(position), _walk(alive, position, -1))
+                right, left = position, position
+                for _ in range(3):
+                    right, left = _walk(alive, right, 1), _walk(alive, left, -1)
+                self.assertEqual(ring.right(position, 3), right)
+                self.assertEqual(ring.left(position, 3), left)
+                for target in range(size):
+                    self.assertEqual(
+                        ring.door_to_right(position, target),
+                        _walk_door_right(obstacles, position, target),
+                    )
+                    self.assertEqual(
+                        ring.door_to_left(position, target),
+                        _walk_door_left(obstacles, position, target),
+                    )
+
+    def test_single_alive_player(self):
+        ring = SeatRing(_match([False, True, False, False], [False] * 4))
+
+        self.assertEqual(ring.right(1), 1)
+        self.assertEqual(ring.left(1, 3), 1)
+        self.assertEqual(ring.alive_to_left(1), [])
+
+    def test_alive_to_left(self):
+        ring = SeatRing(_match([True, True, False, True, True], [False] * 5))
+
+        self.assertEqual(ring.alive_to_left(1), [0, 4, 3])
+        self.assertEqual(ring.alive_to_left(2), [1, 0, 4, 3])
+
+
+class test_seat_rings(TestCase):
+    def _start_match(self):
+        match_name = generate_unique_testing_name()
+        players = [generate_unique_testing_name() for _ in range(4)]
+        for player in players:
+            create_player(player)
+        db_create_match(match_name, players[0], 4, 12)
+        for player in players[1:]:
+            db_add_player(player, match_name)
+        started_match(match_name)
+        match_states.load(get_match_id(match_name))
+        match_id = get_match_id(match_name)
+        by_position = sorted(players, key=get_player_position)
+        return match_id, by_position
+
+    def test_right_alive_player_keeps_direction(self):
+        match_id, players = self._start_match()
+
+        self.assertEqual(get_right_alive_player(match_id, players[0]), players[1])
+        self.assertEqual(get_left_alive_player(match_id, players[0]), players[3])
+        self.assertTrue(get_direction(match_id))
+
+    def test_invalidated_on_kill(self):
+        match_id, players = self._start_match()
+        self.assertEqual(get_right_alive_player(match_id, players[0]), players[1])
+
+        kill_player(players[1])
+
+        self.assertEqual(get_right_alive_player(match_id, players[0]), players[2])
+
+    def test_invalidated_on_swap(self):
+        match_id, players = self._start_match()
+        self.assertEqual(get_right_alive_player(match_id, players[0]), players[1])
+
+        toggle_places(players[1], players[2])
+
+        self.assertEqual(get_right_alive_player(match_id, players[0]), players[2])
+
+    def test_invalidated_on_door_change(self):
+        match_id, players = self._start_match()
+        self.assertFalse(exist_door_between(players[0], players[1]))
+
+        set_barred_door_between(players[0], players[1])
+        self.assertTrue(exist_door_between(players[0], players[1]))
+
+        remove_barred_door(get_first_door_between(players[0], players[1]), match_id)
+        self.assertFalse(exist_door_between(players[0], players[1]))
+
+    def test_forgotten_on_delete(self):
+        match_id, players = self._start_match()
+        get_right_alive_player(match_id, players[0])
+
+        delete_match(get_match_name(match_id))
+
+        self.assertNotIn(match_id, seat_rings._matches)
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import tempfile
+import pytest
+from connection.broker import Broker
+from connection.pubsub import InProcessBus, InProcessHub, SocketBus
+from connection.shards import ShardRouter, ShardException, shard_command, owner_of
+
+events = []
+
+
+@shard_command("test_echo")
+async def _echo(match_id: int, value):
+    return [match_id, value]
+
+
+@shard_command("test_fail")
+async def _fail(match_id: int):
+    raise ValueError("Jugada inválida")
+
+
+@shard_command("test_slow")
+async def _slow(match_id: int, name: str, delay: float):
+    events.append(("start", name))
+    await asyncio.sleep(delay)
+    events.append(("end", name))
+    return name
+
+
+@pytest.fixture(autouse=True)
+def clear_events():
+    events.clear()
+
+
+def _routers(shards: int, count: int = None, timeout: float = 1) -> list:
+    """Routers of the same process sharing a hub, as if they were workers"""
+    hub = InProcessHub()
+    return [
+        ShardRouter(InProcessBus(hub), shards=shards, timeout=timeout)
+        for _ in range(shards if count is None else count)
+    ]
+
+
+def test_owner_of():
+    assert owner_of(7, 3) == 1
+    assert owner_of(9, 3) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_shard_runs_locally():
+    router = ShardRouter(InProcessBus(), shards=1)
+
+    assert router.owns(5)
+    assert await router.call(5, "test_echo", "hola") == [5, "hola"]
+
+
+@pytest.mark.asyncio
+async def test_each_match_has_one_owner():
+    router0, router1 = _routers(2)
+
+    assert (router0.bus.shard, router1.bus.shard) == (0, 1)
+    assert router0.owns(2) and not router1.owns(2)
+    assert router1.owns(3) and not router0.owns(3)
+
+
+@pytest.mark.asyncio
+async def test_call_runs_in_the_owner(mocker):
+    router0, router1 = _routers(2)
+    send_direct = mocker.spy(router0.bus, "send_direct")
+    run = mocker.spy(router1, "_run")
+
+    result = await router0.call(3, "test_echo", {"carta": 1})
+
+    assert result == [3, {"carta": 1}]
+    assert send_direct.call_args.kwargs["shard"] == 1
+    run.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_remote_error_is_raised():
+    router0, _ = _routers(2)
+
+    with pytest.raises(ShardException, match="Jugada inválida"):
+        await router0.call(1, "test_fail")
+
+
+@pytest.mark.asyncio
+async def test_commands_of_a_match_run_one_at_a_time():
+    router0, router1 = _routers(2)
+
+    # Las dos llamadas a la partida 1 corren en su dueño, en orden y una
+    # después de otra
+    results = await asyncio.gather(
+        router0.call(1, "test_slow", "a", 0.05),
+        router0.call(1, "test_slow", "b", 0),
+        router1.call(2, "test_slow", "c", 0),
+    )
+
+    assert results == ["a", "b", "c"]
+    assert events.index(("end", "a")) < events.index(("start", "b"))
+    # Otra partida no espera
+    assert events.index(("end", "c")) < events.index(("end", "a"))
+    assert router1._lanes == {}
+
+
+@pytest.mark.asyncio
+async def test_shard_without_owner():
+    (router,) = _routers(2, count=1)
+
+    with pytest.raises(ShardException):
+        await router.call(1, "test_echo", None)
+
+
+@pytest.mark.asyncio
+async def test_owner_does_not_answer():
+    router0, _ = _routers(2, timeout=0.01)
+
+    with pytest.raises(ShardException):
+        await router0.call(1, "test_slow", "a", 0.5)
+
+
+async def _wait_for(condition, timeout=2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_call_through_broker():
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "bus.sock")
+    broker = Broker(path)
+    await broker.start()
+    buses = [SocketBus(path, retry_delay=0.01) for _ in range(2)]
+    routers = [ShardRouter(bus, shards=3) for bus in buses]
+    try:
+        for bus in buses:
+            bus.attach(None)
+            await bus.start()
+        await _wait_for(lambda: all(bus.shard is not None for bus in buses))
+        owner = next(r for r in routers if r.owns(4))
+        other = next(r for r in routers if r is not owner)
+
+        assert await other.call(4, "test_echo", "hola") == [4, "hola"]
+        with pytest.raises(ShardException, match="Jugada inválida"):
+            await other.call(4, "test_fail")
+        # El shard 2 no tiene dueño: el broker devuelve el pedido
+        with pytest.raises(ShardException, match="no tiene worker"):
+            await other.call(2, "test_echo", None)
+    finally:
+        for bus in buses:
+            await bus.stop()
+        await broker.stop()
+        directory.cleanup()
@@ -0,0 +1,44 @@
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+from pony.orm import db_session
+from Database.Database import db
+from Database.sqlite_profile import PROFILE, PROFILES, apply_profile, connect_kwargs
+
+
+class test_sqlite_profile(TestCase):
+    def _connect(self, profile: str) -> sqlite3.Connection:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connection = sqlite3.connect(
+            os.path.join(directory.name, "test.sqlite"), **connect_kwargs(profile)
+        )
+        self.addCleanup(connection.close)
+        apply_profile(connection, profile)
+        return connection
+
+    def _pragma(self, connection: sqlite3.Connection, pragma: str):
+        return connection.execute(f"PRAGMA {pragma}").fetchone()[0]
+
+    def test_tuned(self):
+        connection = self._connect("tuned")
+
+        self.assertEqual(self._pragma(connection, "journal_mode"), "wal")
+        self.assertEqual(self._pragma(connection, "synchronous"), 1)  # NORMAL
+        self.assertEqual(self._pragma(connection, "busy_timeout"), 5000)
+        self.assertEqual(self._pragma(connection, "temp_store"), 2)  # MEMORY
+        self.assertEqual(
+            self._pragma(connection, "cache_size"), PROFILES["tuned"]["cache_size"]
+        )
+
+    def test_default(self):
+        connection = self._connect("default")
+
+        self.assertEqual(self._pragma(connection, "journal_mode"), "delete")
+        self.assertEqual(self._pragma(connection, "synchronous"), 2)  # FULL
+
+    def test_applied_on_connect(self):
+        with db_session:
+            busy_timeout = db.execute("PRAGMA busy_timeout").fetchone()[0]
+        self.assertEqual(busy_timeout, PROFILES[PROFILE].get("busy_timeout", 0))
@@ -0,0 +1,74 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from Database.executor import db_lanes
+from Database.storage import SHARED_MEMORY, DEFAULT_POOL_SIZE, parse_url, from_env
+
+
+class test_storage(TestCase):
+    def test_sqlite_file(self):
+        storage = parse_url("sqlite:///lacosa.sqlite")
+
+        self.assertEqual(storage.provider, "sqlite")
+        self.assertEqual(storage.pool_size, 1)
+        self.assertTrue(os.path.isabs(storage.sqlite_file))
+        self.assertEqual(
+            os.path.basename(os.path.dirname(storage.sqlite_file)), "Database"
+        )
+        self.assertEqual(storage.bind_kwargs["filename"], storage.sqlite_file)
+        self.assertTrue(storage.bind_kwargs["create_db"])
+
+    def test_sqlite_absolute_file(self):
+        storage = parse_url("sqlite:////var/lib/lacosa/partidas.sqlite")
+
+        self.assertEqual(storage.sqlite_file, "/var/lib/lacosa/partidas.sqlite")
+
+    def test_sqlite_shared_memory(self):
+        storage = parse_url("sqlite:///:sharedmemory:")
+
+        self.assertEqual(storage.bind_kwargs["filename"], SHARED_MEMORY)
+        self.assertIsNone(storage.sqlite_file)
+
+    def test_postgres(self):
+        storage = parse_url("postgres://lacosa:se%40creto@db:5433/partidas?pool_size=8")
+
+        self.assertEqual(storage.provider, "postgres")
+        self.assertEqual(storage.pool_size, 8)
+        self.assertIsNone(storage.sqlite_file)
+        self.assertEqual(
+            storage.bind_kwargs,
+            {
+                "user": "lacosa",
+                "password": "se@creto",
+                "host": "db",
+                "port": 5433,
+                "database": "partidas",
+            },
+        )
+
+    def test_postgres_defaults(self):
+        storage = parse_url("postgresql://lacosa@localhost/partidas")
+
+        self.assertEqual(storage.pool_size, DEFAULT_POOL_SIZE)
+        self.assertEqual(storage.bind_kwargs["port"], 5432)
+
+    def test_invalid_pool_size(self):
+        with self.assertRaises(ValueError):
+            parse_url("postgres://lacosa@localhost/partidas?pool_size=0")
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            parse_url("mysql://lacosa@localhost/partidas")
+
+    def test_from_env(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(
+                from_env(testing=True).bind_kwargs["filename"], SHARED_MEMORY
+            )
+            self.assertTrue(from_env(testing=False).sqlite_file.endswith("lacosa.sqlite"))
+        with patch.dict(os.environ, {"LACOSA_DATABASE_URL": "postgres://a@b/c"}):
+            self.assertEqual(from_env(testing=True).provider, "postgres")
+
+    def test_sqlite_single_lane(self):
+        # Con SQLite las escrituras diferidas y run_db comparten el hilo
+        self.assertEqual(len(db_lanes.executors), 1)
@@ -0,0 +1,327 @@
+import json
+import os
+import struct
+import zlib
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from connection import wire
+from connection.connections import ConnectionManager
+from connection.serializer import encode_message, encode_batch
+from connection.socket_messages import *
+from connection.wire import (
+    JSON,
+    MSGPACK,
+    SUBPROTOCOL,
+    DEFLATED,
+    Wire,
+    negotiate,
+    compact_frame,
+    deflate_frame,
+    wire_frame,
+    compression_stats,
+    _pack,
+)
+from Database.models.Card import CARD_CATALOG
+from Tests.auxiliar_functions import *
+
+
+class _WebStub:
+    def __init__(self, scope=None, query_params=None):
+        self.scope = scope or {}
+        self.query_params = query_params or {}
+        self.subprotocol = None
+        self.texts = []
+        self.binaries = []
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, frame):
+        self.texts.append(json.loads(frame))
+
+    async def send_bytes(self, frame):
+        self.binaries.append(frame)
+
+
+@pytest.fixture(autouse=True)
+def clear_frames():
+    compact_frame.cache_clear()
+    deflate_frame.cache_clear()
+    compression_stats.__init__()
+
+
+@pytest.fixture
+def connected(mocker):
+    mocker.patch("connection.connections.check_match_existence", return_value=True)
+    mocker.patch("connection.connections.player_exists", return_value=True)
+
+
+@pytest.mark.parametrize(
+    "value, packed",
+    [
+        (None, b"\xc0"),
+        (True, b"\xc3"),
+        (False, b"\xc2"),
+        (5, b"\x05"),
+        (-1, b"\xff"),
+        (200, b"\xcc\xc8"),
+        (-100, b"\xd0\x9c"),
+        (70000, b"\xce\x00\x01\x11\x70"),
+        (1.5, b"\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00"),
+        ("ñ", b"\xa2\xc3\xb1"),
+        ("a" * 40, b"\xd9\x28" + b"a" * 40),
+        ([1, "a"], b"\x92\x01\xa1a"),
+        ({"a": [None]}, b"\x81\xa1a\x91\xc0"),
+    ],
+)
+def test_pack(value, packed):
+    assert _pack(value) == packed
+
+
+def test_pack_matches_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    value = {"n": [0, -33, 2**40, -(2**40), 3.25], "s": "x" * 300, "l": list(range(20))}
+
+    assert _pack(value) == msgpack.packb(value)
+
+
+def test_compact_frame():
+    hand = [{"card_id": 7, "card_name": "Lanzallamas", "type": 1}]
+    frame = encode_message(INITIAL_STATE, {"hand": hand, "role": 1})
+
+    assert _pack_inverse(compact_frame(frame)) == [
+        MESSAGE_CODES[INITIAL_STATE],
+        {"hand": [7], "role": 1},
+    ]
+
+
+def test_compact_batch_and_unknown_type():
+    frame = encode_batch(
+        [encode_message(CARDS, []), encode_message("sin código", "hola")]
+    )
+
+    assert _pack_inverse(compact_frame(frame)) == [
+        MESSAGE_CODES[BATCH],
+        [[MESSAGE_CODES[CARDS], []], ["sin código", "hola"]],
+    ]
+
+
+def test_message_codes_are_unique():
+    assert len(set(MESSAGE_CODES.values())) == len(MESSAGE_CODES)
+
+
+def test_negotiate():
+    assert negotiate(_WebStub()) == Wire()
+    assert negotiate(_WebStub(query_params={"encoding": MSGPACK})) == Wire(MSGPACK)
+    assert negotiate(_WebStub(scope={"subprotocols": [SUBPROTOCOL]})) == Wire(
+        MSGPACK, subprotocol=SUBPROTOCOL
+    )
+    assert negotiate(_WebStub(query_params={"compress": "deflate"})) == Wire(
+        JSON, compress=True
+    )
+
+
+def test_negotiate_compression_disabled(mocker):
+    mocker.patch("connection.wire.COMPRESS", False)
+
+    assert negotiate(_WebStub(query_params={"compress": "deflate"})) == Wire()
+
+
+def _inflate(frame: bytes) -> bytes:
+    assert frame[:1] == DEFLATED
+    return zlib.decompress(frame[1:], -zlib.MAX_WBITS)
+
+
+def test_small_frames_skip_compression():
+    frame = encode_message(PLAY_NOTIFICATION, "jugador1 robó una carta")
+
+    assert wire_frame(Wire(JSON, True), frame) == frame
+    assert compression_stats.frames == 1
+    assert compression_stats.compressed == 0
+
+
+def test_threshold_counts_utf8_bytes(mocker):
+    mocker.patch("connection.wire.COMPRESS_MIN_SIZE", 1024)
+    frame = encode_message(CHAT_NOTIFICATION, "ñ" * 500)
+    assert len(frame) < 1024 <= len(frame.encode("utf-8"))
+
+    sent = wire_frame(Wire(JSON, True), frame)
+
+    assert _inflate(sent).decode("utf-8") == frame
+
+
+def test_large_frames_are_compressed():
+    history = [{"author": "jugador1", "message": "hola", "timestamp": i} for i in range(100)]
+    frame = encode_message(CHAT_RECORD, history)
+
+    sent = wire_frame(Wire(JSON, True), frame)
+
+    assert _inflate(sent).decode("utf-8") == frame
+    assert compression_stats.compressed == 1
+    assert compression_stats.bytes_in == len(frame.encode("utf-8"))
+    assert compression_stats.bytes_out == len(sent)
+    assert compression_stats.ratio() < 0.2
+
+
+def test_compressed_compact_frame(mocker):
+    mocker.patch("connection.wire.COMPRESS_MIN_SIZE", 10)
+    frame = encode_message(LOGS_RECORD, {"seq": 2, "logs": ["jugador1 jugó"] * 10})
+
+    sent = wire_frame(Wire(MSGPACK, True), frame)
+
+    assert _inflate(sent) == compact_frame(frame)
+
+
+def test_incompressible_payload_is_kept():
+    payload = os.urandom(2048)
+
+    assert deflate_frame(payload) == (payload, 2048)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_per_encoding(connected, mocker):
+    manager = ConnectionManager()
+    plain, compact1, compact2 = _WebStub(), _WebStub(), _WebStub()
+    await manager.connect(plain, 1, "player1")
+    await manager.connect(compact1, 1, "player2", Wire(MSGPACK, subprotocol=SUBPROTOCOL))
+    await manager.connect(compact2, 1, "player3", Wire(MSGPACK))
+    loads = mocker.spy(wire, "loads")
+
+    await manager.broadcast(POSITIONS, {"player1": 0}, 1)
+
+    assert plain.texts == [{"message_type": POSITIONS, "message_content": {"player1": 0}}]
+    assert compact1.subprotocol == SUBPROTOCOL
+    assert compact1.binaries == compact2.binaries == [
+        _pack([MESSAGE_CODES[POSITIONS], {"player1": 0}])
+    ]
+    # El frame compacto se arma una vez para todos los sockets
+    assert loads.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_broadcast_compressed_once(connected, mocker):
+    mocker.patch("connection.wire.COMPRESS_MIN_SIZE", 10)
+    manager = ConnectionManager()
+    plain, deflate1, deflate2 = _WebStub(), _WebStub(), _WebStub()
+    await manager.connect(plain, 1, "player1")
+    await manager.connect(deflate1, 1, "player2", Wire(compress=True))
+    await manager.connect(deflate2, 1, "player3", Wire(compress=True))
+    content = ["jugador1", "jugador2", "jugador3"] * 5
+
+    await manager.broadcast(DEAD_PLAYERS, content, 1)
+
+    message = {"message_type": DEAD_PLAYERS, "message_content": content}
+    assert plain.texts == [message]
+    assert deflate1.binaries == deflate2.binaries
+    assert json.loads(_inflate(deflate1.binaries[0])) == message
+    assert deflate_frame.cache_info().misses == 1
+
+
+def test_compression_stats_endpoint():
+    history = [{"author": "jugador1", "message": "hola", "timestamp": i} for i in range(100)]
+    sent = wire_frame(Wire(JSON, True), encode_message(CHAT_RECORD, history))
+
+    response = TestClient(app).get("/stats/compression")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "frames": 1,
+        "compressed": 1,
+        "bytes_in": compression_stats.bytes_in,
+        "bytes_out": len(sent),
+        "ratio": compression_stats.ratio(),
+    }
+
+
+def test_card_catalog():
+    client = TestClient(app)
+
+    response = client.get("/cards/catalog")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["cards"]) == len(CARD_CATALOG)
+    entry = CARD_CATALOG[1]
+    assert body["cards"]["1"] == {"card_name": entry.card_name, "type": entry.type}
+    assert body["messages"] == MESSAGE_CODES
+
+
+def test_websocket_subprotocol():
+    client = TestClient(app)
+    match_name = generate_unique_testing_name()
+    player_name = generate_unique_testing_name()
+    client.post("/player/create", data={"name_player": player_name})
+    client.post(
+        "/match/create",
+        json={
+            "match_name": match_name,
+            "player_name": player_name,
+            "min_players": 4,
+            "max_players": 12,
+        },
+    )
+
+    with client.websocket_connect(
+        f"/ws/{match_name}/{player_name}", subprotocols=[SUBPROTOCOL]
+    ) as websocket:
+        frame = websocket.receive_bytes()
+        assert websocket.accepted_subprotocol == SUBPROTOCOL
+
+    code, messages = _pack_inverse(frame)
+    assert code == MESSAGE_CODES[BATCH]
+    assert messages[0] == [MESSAGE_CODES[LOBBY_PLAYERS], [player_name]]
+
+
+def _pack_inverse(frame: bytes):
+    """Decode the MessagePack values that _pack produces, for the tests"""
+    value, end = _unpack(frame, 0)
+    assert end == len(frame)
+    return value
+
+
+def _unpack(data: bytes, i: int):
+    code = data[i]
+    i += 1
+    if code <= 0x7F:
+        return code, i
+    if code >= 0xE0:
+        return code - 0x100, i
+    if 0xA0 <= code <= 0xBF:
+        size = code & 0x1F
+        return data[i : i + size].decode(), i + size
+    if 0x90 <= code <= 0x9F:
+        return _unpack_array(data, i, code & 0x0F)
+    if 0x80 <= code <= 0x8F:
+        return _unpack_map(data, i, code & 0x0F)
+    if code in (0xC0, 0xC2, 0xC3):
+        return {0xC0: None, 0xC2: False, 0xC3: True}[code], i
+    formats = {
+        0xCC: ">B", 0xCD: ">H", 0xCE: ">I", 0xCF: ">Q",
+        0xD0: ">b", 0xD1: ">h", 0xD2: ">i", 0xD3: ">q", 0xCB: ">d",
+    }
+    if code in formats:
+        fmt = formats[code]
+        return struct.unpack_from(fmt, data, i)[0], i + struct.calcsize(fmt)
+    sizes = {0xD9: ">B", 0xDA: ">H", 0xDB: ">I", 0xDC: ">H", 0xDD: ">I"}
+    size = struct.unpack_from(sizes[code], data, i)[0]
+    i += struct.calcsize(sizes[code])
+    if code in (0xDC, 0xDD):
+        return _unpack_array(data, i, size)
+    return data[i : i + size].decode(), i + size
+
+
+def _unpack_array(data: bytes, i: int, size: int):
+    items = []
+    for _ in range(size):
+        item, i = _unpack(data, i)
+        items.append(item)
+    return items, i
+
+
+def _unpack_map(data: bytes, i: int, size: int):
+    items = {}
+    for _ in range(size):
+        key, i = _unpack(data, i)
+        items[key], i = _unpack(data, i)
+    return items, i
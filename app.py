@@ -4,17 +4,32 @@ from fastapi import (
     status,
     Depends,
     Form,
+    Request,
+    Response,
     WebSocketDisconnect,
     WebSocket,
 )
 from Database.Database import *
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic_models import *
-from connection.connections import WebSocket
+from connection.connections import WebSocket, PlayerSocket
+from connection.shards import shard_command, ShardException
 from connection.request_handler import handle_request
 from Game.app_auxiliars import *
 from connection.socket_messages import *
+from Game.match_state import match_states, run_for_match, load_match
+from Game.state_versions import state_versions, StateVersion
+from Game.reconnect_snapshot import snapshot_cache, reconnect_snapshot
+from Game.lobby_index import lobby_index
+from connection.lobby_feed import lobby_feed
+from connection.wire import negotiate, compression_stats
+from connection.request_scope import request_stats
+from Database.models.Card import CARD_CATALOG
+from Database.executor import run_db, run_match_db
 from time import time
+import logging
+
+logger = logging.getLogger(__name__)
 
 MAX_LEN_ALIAS = 8
 MIN_LEN_ALIAS = 1
@@ -49,57 +64,154 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_manager():
+    await manager.start()
+    lobby_sync.start()
+
+
+@app.on_event("shutdown")
+async def stop_manager():
+    # Sólo el dueño de una partida tiene su estado al día: se guarda antes de
+    # que el router suelte las partidas
+    match_states.flush_all(shard_router.owns)
+    await manager.stop()
+
+
 # --- WebSockets --- #
 
 
+@app.websocket("/ws/lobby")
+async def lobby_feed_endpoint(websocket: WebSocket):
+    """Listing of the matches followed by its changes"""
+    if not lobby_index.loaded:
+        await run_db(load_lobby_index)
+    await lobby_feed.serve(websocket)
+
+
+# Todo lo que modifica el estado de una partida corre en el worker dueño de
+# la partida: ver connection/shards.py
+
+PLAYER_CONNECTED = "player_connected"
+PLAYER_REQUEST = "player_request"
+PLAYER_DISCONNECTED = "player_disconnected"
+MATCH_FINISHED = "match_finished"
+MATCH_STARTED = "match_started"
+
+
 @app.websocket("/ws/{match_name}/{player_name}")
 async def websocket_endpoint(websocket: WebSocket):
     match_name = websocket.path_params["match_name"]
     player_name = websocket.path_params["player_name"]
+    # Última entrada del registro que el cliente ya tiene
+    logs_since = websocket.query_params.get("logs_since", "0")
+    logs_since = int(logs_since) if logs_since.isdigit() else 0
+    wire = negotiate(websocket)
+    match_id = None
     try:
-        match_id = get_match_id(match_name)
-        await manager.connect(websocket, match_id, player_name)
-
-        if db_is_match_initiated(match_name):
-            await _send_initial_state(match_id, player_name)
-        else:
-            await _send_lobby_players(match_id)
-
-        await manager.send_personal_message(
-            CHAT_RECORD,
-            get_chat_records_for(match_id, player_name),
-            match_id,
-            player_name,
+        match_id = await run_db(get_match_id, match_name)
+        await manager.connect(websocket, match_id, player_name, wire)
+        finished = await shard_router.call(
+            match_id, PLAYER_CONNECTED, match_name, player_name, logs_since
         )
-
-        while True:
-            if match_exists(match_name) and db_is_match_initiated(match_name):
-                await _send_game_state(match_id)
+        while not finished:
             request = await websocket.receive_text()
-            if match_exists(match_name):
-                await handle_request(request, match_id, player_name, websocket)
+            finished = await shard_router.call(
+                match_id, PLAYER_REQUEST, match_name, player_name, request
+            )
     except WebSocketDisconnect:
-        manager.disconnect(player_name, match_id)
+        try:
+            await shard_router.call(match_id, PLAYER_DISCONNECTED)
+        except ShardException as e:
+            logger.warning("Player disconnected from %s: %s", match_name, e)
     except FinishedMatchException:
-        await _send_game_state(match_id)
-        delete_match(match_name)
-        manager.disconnect(player_name, match_id)
-    except Exception as e:
-        print(str(e))
+        await shard_router.call(match_id, MATCH_FINISHED, match_name)
+    except Exception:
+        logger.exception("Connection of %s to %s failed", player_name, match_name)
+    finally:
+        if match_id is not None:
+            manager.disconnect(player_name, match_id, websocket)
+
+
+@shard_command(PLAYER_CONNECTED)
+async def _player_connected(
+    match_id: int, match_name: str, player_name: str, logs_since: int = 0
+):
+    """Send the state of the match to the player. True if the match is over"""
+    try:
+        async with manager.batch(match_id):
+            if await run_db(db_is_match_initiated, match_name):
+                await load_match(match_id)
+                # Con el estado al día la versión identifica la parte común
+                # del snapshot
+                await _send_game_state(match_id)
+                snapshot = await run_for_match(
+                    match_id, reconnect_snapshot, match_id, player_name, logs_since
+                )
+                await manager.send_frame(snapshot, match_id, player_name)
+            else:
+                await _send_lobby_players(match_id)
+                chat_record = await run_db(
+                    get_chat_records_for, match_id, player_name
+                )
+                await manager.send_personal_message(
+                    CHAT_RECORD,
+                    chat_record,
+                    match_id,
+                    player_name,
+                )
+    except FinishedMatchException:
+        await _match_finished(match_id, match_name)
+        return True
+    return False
+
+
+@shard_command(PLAYER_REQUEST)
+async def _player_request(
+    match_id: int, match_name: str, player_name: str, request: str
+):
+    """Handle a request of the player. True if the match is over"""
+    if not await run_for_match(match_id, match_exists, match_name):
+        return False
+    try:
+        # Los mensajes de la petición y el estado resultante salen en un
+        # único lote por jugador
+        async with manager.batch(match_id):
+            if await run_for_match(match_id, _is_match_initiated, match_name):
+                # Como al conectarse: el estado puede no estar en memoria
+                await load_match(match_id)
+            socket = PlayerSocket(manager, match_id, player_name)
+            await handle_request(request, match_id, player_name, socket)
+            if await run_for_match(match_id, _is_match_initiated, match_name):
+                await _send_game_state(match_id)
+    except FinishedMatchException:
+        await _match_finished(match_id, match_name)
+        return True
+    match_states.flush_if_due(match_id)
+    return False
 
 
-async def _send_initial_state(match_id: int, player_name: str):
-    data = get_game_state_for(player_name)
-    await manager.send_message_to(INITIAL_STATE, data, player_name)
+@shard_command(PLAYER_DISCONNECTED)
+async def _player_disconnected(match_id: int):
+    match_states.flush(match_id)
 
-    positions = get_players_positions(get_match_name(match_id))
-    # probablemente se pueda eliminar (ya se envia en _send_game_state)
-    await manager.broadcast(POSITIONS, positions, match_id)
-    await manager.broadcast(OBSTACLES, get_obstacles(match_id), match_id)
-    await manager.broadcast(QUARANTINE, get_quarantined_players(match_id), match_id)
-    await manager.broadcast(DIRECTION, get_direction(match_id), match_id)
-    await manager.broadcast(DEFENSE_STAMP, get_stamp(match_id), match_id)
-    await _send_logs_record(match_id, player_name)
+
+@shard_command(MATCH_FINISHED)
+async def _match_finished(match_id: int, match_name: str):
+    await _send_game_state(match_id)
+    await _delete_match(match_id, match_name)
+
+
+async def _delete_match(match_id: int, match_name: str):
+    """Delete the match and drop what the loop keeps of it"""
+    await run_match_db(match_id, delete_match, match_name)
+    match_states.evict(match_id)
+    state_versions.forget(match_id)
+    snapshot_cache.forget(match_id)
+
+
+def _is_match_initiated(match_name: str) -> bool:
+    return match_exists(match_name) and db_is_match_initiated(match_name)
 
 
 def _join_match_msg(player_name: str):
@@ -107,7 +219,7 @@ def _join_match_msg(player_name: str):
 
 
 async def _send_greetings(match_id: int, player_name: str):
-    players = get_match_players_names(match_id)
+    players = await run_db(get_match_players_names, match_id)
     players.remove(player_name)
 
     msg_str = _join_match_msg(player_name)
@@ -117,42 +229,30 @@ async def _send_greetings(match_id: int, player_name: str):
         await manager.send_personal_message(CHAT_NOTIFICATION, msg, match_id, player)
 
 
-async def _send_logs_record(match_id: int, player_name: str):
-    all_logs = get_logs(match_id)
-    logs = []
-    for log in all_logs:
-        if "$" in log:
-            if log.split("$")[1] == player_name:
-                logs.append("LA COSA TE INFECTÓ!!")
-        else:
-            logs.append(log)
-    await manager.broadcast(LOGS_RECORD, logs, match_id)
-
-
 async def _send_lobby_players(match_id: int):
-    data = db_get_players(get_match_name(match_id))
+    match_name = await run_db(get_match_name, match_id)
+    data = await run_db(db_get_players, match_name)
     await manager.broadcast(LOBBY_PLAYERS, data, match_id)
 
 
 async def _send_game_state(match_id: int):
-    game_state = get_game_state(match_id)
-    state = {
-        "turn": get_player_in_turn(match_id),
-        "game_state": game_state,
-    }
-    positions = get_players_positions(get_match_name(match_id))
-    await manager.broadcast(POSITIONS, positions, match_id)
-    await manager.broadcast(MATCH_STATE, state, match_id)
-    await manager.broadcast(DEAD_PLAYERS, get_dead_players(match_id), match_id)
-    await manager.broadcast(QUARANTINE, get_quarantined_players(match_id), match_id)
-    if game_state == GAME_STATE["WAIT_DEFENSE"]:
-        await manager.broadcast(DEFENSE_STAMP, get_stamp(match_id), match_id)
-    if game_state == GAME_STATE["VUELTA_Y_VUELTA"]:
-        await send_alredy_selected(match_id)
-
-
-async def send_alredy_selected(match_id: int):
-    """Send to players if they have already selected a card in vuelta y vuelta"""
+    """Broadcast only the game state messages that changed since the last
+    push, followed by the new state version"""
+    tracker = state_versions.get(match_id)
+    for message_type, content in game_state_messages(match_id).items():
+        if tracker.changed(message_type, content):
+            await manager.broadcast(message_type, content, match_id)
+    if get_game_state(match_id) == GAME_STATE["VUELTA_Y_VUELTA"]:
+        await send_alredy_selected(match_id, tracker)
+    else:
+        tracker.discard(ALREADY_SELECTED)
+    if tracker.commit():
+        await manager.broadcast(STATE_VERSION, tracker.version, match_id)
+
+
+async def send_alredy_selected(match_id: int, tracker: StateVersion = None):
+    """Send to players if they have already selected a card in vuelta y vuelta.
+    If tracker is given, only to those whose selection changed"""
     players = db_get_players(get_match_name(match_id))
     exchange_json = get_exchange_json(match_id)
     for player in players:
@@ -160,16 +260,36 @@ async def send_alredy_selected(match_id: int):
             selected = 1
         else:
             selected = 0
-        await manager.send_message_to(ALREADY_SELECTED, selected, player)
+        if tracker is None or tracker.changed((ALREADY_SELECTED, player), selected):
+            await manager.send_message_to(ALREADY_SELECTED, selected, player)
 
 
 # ---------------- API REST ------------- #
 
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
 @app.get("/match/list", tags=["Matches"], status_code=200)
-async def match_listing():
-    res_list = get_match_list()
-    return {"Matches": res_list}
+async def match_listing(
+    request: Request, response: Response, params: MatchListParams = Depends()
+):
+    """
+    List the matches that pass the filters, paginated by cursor
+    """
+    if params.limit is not None and params.limit < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Límite inválido"
+        )
+    if not lobby_index.loaded:
+        await run_db(load_lobby_index)
+    etag, page = lobby_index.page(params)
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return page
 
 
 @app.post("/match/create", tags=["Matches"], status_code=status.HTTP_201_CREATED)
@@ -189,7 +309,8 @@ async def create_game(config: GameConfig):
         )
 
     try:
-        db_create_match(
+        await run_db(
+            db_create_match,
             config.match_name,
             config.player_name,
             config.min_players,
@@ -212,13 +333,13 @@ async def player_creator(name_player: str = Form()):
     )
     if len(name_player) > MAX_LEN_ALIAS or len(name_player) < MIN_LEN_ALIAS:
         raise invalid_fields
-    elif player_exists(name_player):
+    elif await run_db(player_exists, name_player):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Nombre no disponible"
         )
     else:
-        create_player(name_player)
-        return {"player_id": get_player_id(name_player)}
+        await run_db(create_player, name_player)
+        return {"player_id": await run_db(get_player_id, name_player)}
 
 
 @app.get("/player/host", tags=["Player"], status_code=200)
@@ -227,9 +348,9 @@ async def player_is_host(player_in_match: PlayerInMatch = Depends()):
     Return true if player is host
     """
     try:
-        match_id = get_match_id(player_in_match.match_name)
-        if is_in_match(player_in_match.player_name, match_id):
-            return {"is_host": is_host(player_in_match.player_name)}
+        match_id = await run_db(get_match_id, player_in_match.match_name)
+        if await run_db(is_in_match, player_in_match.player_name, match_id):
+            return {"is_host": await run_db(is_host, player_in_match.player_name)}
     except DatabaseError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -240,33 +361,65 @@ async def get_players(match_name: str):
     Get players names from a match
     """
     try:
-        players = db_get_players(match_name)
+        players = await run_db(db_get_players, match_name)
         response = {"players": players}
     except MatchNotFound:
         raise HTTPException(status_code=404, detail="Partida no encontrada")
     return response
 
 
+@app.get("/cards/catalog", tags=["Cards"], status_code=status.HTTP_200_OK)
+async def get_card_catalog():
+    """
+    Get the cards by id and the numeric codes of the socket messages, used
+    by the clients of the compact encoding
+    """
+    cards = {
+        card.id: {"card_name": card.card_name, "type": card.type}
+        for card in CARD_CATALOG.values()
+    }
+    return {"cards": cards, "messages": MESSAGE_CODES}
+
+
+@app.get("/stats/compression", tags=["Stats"], status_code=status.HTTP_200_OK)
+async def get_compression_stats():
+    """
+    Get how many frames this worker compressed and how much they shrank
+    """
+    return compression_stats.as_dict()
+
+
+@app.get("/stats/requests", tags=["Stats"], status_code=status.HTTP_200_OK)
+async def get_request_stats():
+    """
+    Get how many database queries the websocket requests of this worker sent
+    """
+    return request_stats.as_dict()
+
+
 @app.post("/match/join", tags=["Matches"], status_code=status.HTTP_200_OK)
 async def join_game(join_match: JoinMatch):
     """
     Join player to a match
     """
     try:
-        if db_is_match_initiated(join_match.match_name):
+        if await run_db(db_is_match_initiated, join_match.match_name):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Partida ya iniciada"
             )
-        elif not is_correct_password(join_match.match_name, join_match.password):
+        elif not await run_db(
+            is_correct_password, join_match.match_name, join_match.password
+        ):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Contraseña Incorrecta"
             )
         else:
-            db_add_player(join_match.player_name, join_match.match_name)
-            response = {"detail": "ok"}
-            await _send_greetings(
-                get_match_id(join_match.match_name), join_match.player_name
+            match_id = await run_db(get_match_id, join_match.match_name)
+            await run_match_db(
+                match_id, db_add_player, join_match.player_name, join_match.match_name
             )
+            response = {"detail": "ok"}
+            await _send_greetings(match_id, join_match.player_name)
     except DatabaseError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return response
@@ -281,22 +434,23 @@ async def start_game(match_player: PlayerInMatch):
     player_name = match_player.player_name
     match_name = match_player.match_name
     try:
-        match_id = get_match_id(match_name)
-        if db_is_match_initiated(match_name):
+        match_id = await run_db(get_match_id, match_name)
+        if await run_db(db_is_match_initiated, match_name):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Partida ya iniciada"
             )
-        if not is_in_match(player_name, match_id):
+        if not await run_db(is_in_match, player_name, match_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Jugador no está en la partida",
             )
-        if not is_host(player_name):
+        if not await run_db(is_host, player_name):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No eres el creador de la partida",
             )
-        if len(db_get_players(match_name)) < get_match_min_players(match_id):
+        players = await run_db(db_get_players, match_name)
+        if len(players) < await run_db(get_match_min_players, match_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cantidad insuficiente de jugadores",
@@ -304,13 +458,25 @@ async def start_game(match_player: PlayerInMatch):
     except DatabaseError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
-    started_match(match_name)
-    reset_chat_record(match_id)
+    try:
+        await shard_router.call(match_id, MATCH_STARTED, match_name)
+    except ShardException as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+    return {"detail": "Partida inicializada"}
+
+
+@shard_command(MATCH_STARTED)
+async def _match_started(match_id: int, match_name: str):
+    # El chat de la sala se borra antes de cargar la partida en memoria
+    await run_match_db(match_id, reset_chat_record, match_id)
+    await run_match_db(match_id, started_match, match_name)
+    await load_match(match_id)
     await manager.broadcast(CHAT_RECORD, [], match_id)
     set_game_state(match_id, GAME_STATE["DRAW_CARD"])
     start_alert = ("LA PARTIDA COMIENZA!!!",)
-    await manager.broadcast("start_match", start_alert, match_id)
-    return {"detail": "Partida inicializada"}
+    await manager.broadcast(START_MATCH, start_alert, match_id)
 
 
 # TODO: Cambiar a socket
@@ -322,12 +488,12 @@ async def left_lobby(lobby_left: PlayerInMatch):
     player_name = lobby_left.player_name
     match_name = lobby_left.match_name
     try:
-        match_id = get_match_id(match_name)
-        if db_is_match_initiated(match_name):
+        match_id = await run_db(get_match_id, match_name)
+        if await run_db(db_is_match_initiated, match_name):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Partida ya iniciada"
             )
-        if not is_in_match(player_name, match_id):
+        if not await run_db(is_in_match, player_name, match_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="El jugador no está en partida",
@@ -337,24 +503,26 @@ async def left_lobby(lobby_left: PlayerInMatch):
     except DatabaseError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
-    if is_host(player_name):
+    if await run_db(is_host, player_name):
         data_msg = {
             "message_content": "La partida ha sido eliminada debido a que el host la ha abandonado",
         }
-        await manager.broadcast("match_deleted", data_msg, match_id)
-        delete_match(lobby_left.match_name)
+        await manager.broadcast(MATCH_DELETED, data_msg, match_id)
+        await _delete_match(match_id, lobby_left.match_name)
         response = {
             "detail": lobby_left.player_name
             + " abandonó la sala y la partida fue eliminada"
         }
     else:
-        left_match(lobby_left.player_name, lobby_left.match_name)
+        await run_match_db(
+            match_id, left_match, lobby_left.player_name, lobby_left.match_name
+        )
         data_msg = {
             "message": lobby_left.player_name + " abandonó la sala",
-            "players": db_get_players(lobby_left.match_name),
+            "players": await run_db(db_get_players, lobby_left.match_name),
             "timestamp": time()
         }
-        await manager.broadcast("player_left", data_msg, match_id)
+        await manager.broadcast(PLAYER_LEFT, data_msg, match_id)
         response = {"detail": lobby_left.player_name + " abandonó la sala"}
         manager.disconnect(player_name, match_id)
         
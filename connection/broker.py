@@ -0,0 +1,134 @@
+# Broker local del bus (ver connection/pubsub.py).
+# Escucha en un socket unix y reenvía cada mensaje de una partida a los
+# demás workers que anunciaron sockets de esa partida. También reparte los
+# shards (ver connection/shards.py) y lleva los mensajes directos a su
+# destino. No guarda nada: un worker que se desconecta deja de estar en
+# todas sus partidas y libera su shard.
+#
+#   python -m connection.broker [/tmp/lacosa-bus.sock]
+
+import asyncio
+import json
+import os
+import sys
+from connection.pubsub import (
+    JOIN,
+    LEAVE,
+    SEND,
+    CLAIM,
+    SHARD,
+    DIRECT,
+    UNROUTED,
+    LINE_LIMIT,
+    encode_command,
+    claim_shard,
+)
+
+DEFAULT_PATH = "/tmp/lacosa-bus.sock"
+# Bytes pendientes de un worker a partir de los cuales se lo desconecta
+MAX_PENDING = 4 * 1024 * 1024
+
+
+class Broker:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        # id de la partida -> writers de los workers con sockets de la partida
+        self.rooms: dict[int, set] = {}
+        self.holders: dict = {}  # shard -> writer de su dueño
+        self.nodes: dict = {}  # proceso -> writer
+        self._server = None
+
+    def _join(self, match_id: int, writer: asyncio.StreamWriter):
+        self.rooms.setdefault(match_id, set()).add(writer)
+
+    def _leave(self, match_id: int, writer: asyncio.StreamWriter):
+        members = self.rooms.get(match_id)
+        if members is None:
+            return
+        members.discard(writer)
+        if not members:
+            del self.rooms[match_id]
+
+    def _forward(self, match_id: int, line: bytes, sender: asyncio.StreamWriter):
+        for writer in tuple(self.rooms.get(match_id, ())):
+            if writer is sender:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_PENDING:
+                # Un worker que no lee no frena a los demás
+                writer.close()
+                continue
+            writer.write(line)
+
+    def _direct(self, command: dict, line: bytes, sender: asyncio.StreamWriter):
+        if command["node"] is not None:
+            target = self.nodes.get(command["node"])
+        else:
+            target = self.holders.get(command["shard"])
+        if target is None:
+            sender.write(encode_command(UNROUTED, message=command["message"]))
+        else:
+            target.write(line)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        joined = set()
+        node = shard = None
+        try:
+            while line := await reader.readline():
+                command = json.loads(line)
+                op, match_id = command["op"], command.get("match")
+                if op == JOIN:
+                    self._join(match_id, writer)
+                    joined.add(match_id)
+                elif op == LEAVE:
+                    self._leave(match_id, writer)
+                    joined.discard(match_id)
+                elif op == SEND:
+                    self._forward(match_id, line, writer)
+                elif op == DIRECT:
+                    self._direct(command, line, writer)
+                elif op == CLAIM and node is None:
+                    node = command["node"]
+                    self.nodes[node] = writer
+                    shard = claim_shard(self.holders, command["shards"], writer)
+                    writer.write(encode_command(SHARD, shard=shard))
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            for match_id in joined:
+                self._leave(match_id, writer)
+            if node is not None:
+                del self.nodes[node]
+            if shard is not None:
+                del self.holders[shard]
+            writer.close()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Socket de una ejecución anterior
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle, self.path, limit=LINE_LIMIT
+        )
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    print(f"Broker escuchando en {path}")
+    try:
+        asyncio.run(Broker(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
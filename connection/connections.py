@@ -1,63 +1,281 @@
-from threading import Lock
 from fastapi import WebSocket
-from collections import defaultdict
-from Database.models.Match import check_match_existence, save_log, save_chat_message
+from types import MappingProxyType
+from typing import NamedTuple
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import os
+import weakref
+from Database.models.Match import check_match_existence, save_log
+from Database.models.Chat import save_chat_message
 from Database.models.Player import player_exists, get_player_match
-from connection.socket_messages import PLAY_NOTIFICATION, INFECTED, CHAT_NOTIFICATION
+from connection.socket_messages import (
+    PLAY_NOTIFICATION,
+    INFECTED,
+    CHAT_NOTIFICATION,
+    PLAYER_LEFT,
+)
+from Game.match_state import run_for_match, run_for_player
+from Database.executor import run_db
+from connection.serializer import encode_message, encode_batch
+from connection.pubsub import Bus, InProcessBus
+from connection.wire import Wire, wire_frame
+
+# Tiempo máximo que se espera a un socket antes de darlo por muerto
+SEND_TIMEOUT = float(os.environ.get("LACOSA_SEND_TIMEOUT", "2"))
+# Segundos que se esperan tras un lote para juntarlo con los siguientes
+BATCH_WINDOW = float(os.environ.get("LACOSA_BATCH_WINDOW", "0"))
+
+# Entrada del registro que sólo ve el jugador infectado
+INFECTED_LOG = "LA COSA TE INFECTÓ!!"
+
+# Mensajes para todos que se guardan en el chat (ver persist_broadcast)
+PERSISTED_BROADCASTS = frozenset({PLAYER_LEFT, CHAT_NOTIFICATION})
+
+DELIVERED = "delivered"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+
+
+_NO_CONNECTIONS = MappingProxyType({})
+_NO_BATCHES = MappingProxyType({})
 
 
 class ManagerException(Exception):
     pass
 
 
-class ConnectionManager:
-    lock = Lock()
+class BroadcastReport(NamedTuple):
+    delivered: int = 0
+    timed_out: int = 0
+    failed: int = 0
+
+
+def _report(results: list) -> BroadcastReport:
+    return BroadcastReport(
+        delivered=results.count(DELIVERED),
+        timed_out=results.count(TIMED_OUT),
+        failed=results.count(FAILED),
+    )
+
+
+class _Outbox:
+    """Messages of a request to a match waiting to be flushed as a batch"""
 
     def __init__(self):
-        self.connections: dict = defaultdict(dict)
+        self.frames: list[tuple] = []  # (player_name o None para todos, frame)
 
-    def __gen_msg(self, message_type: str, message_content):
-        return {
-            "message_type": message_type,
-            "message_content": message_content,
-        }
 
-    def _get_connections_and_lock(self, match_id: int):
-        self.lock.acquire()
-        try:
-            connections = self.connections[match_id]
-        except Exception as e:
-            print(e)
-            self.lock.release()
-            raise ManagerException("Match not found")
-        return connections
+class _MatchConnections(dict):
+    """match_id -> read-only {player_name: websocket} snapshot"""
 
-    def _release_connections_lock(self):
-        self.lock.release()
+    def __missing__(self, match_id: int):
+        return _NO_CONNECTIONS
 
-    async def connect(self, websocket: WebSocket, match_id: int, player_name: str):
-        await websocket.accept()
-        if match_id is None or not check_match_existence(match_id):
-            raise ManagerException("Match not found")
-        if player_name is None or not player_exists(player_name):
-            raise ManagerException("Player not found")
-        connections = self._get_connections_and_lock(match_id)
+
+class PlayerSocket:
+    """What the request handlers use as the socket of a player that may be
+    connected to another process"""
+
+    def __init__(self, manager: "ConnectionManager", match_id: int, player_name: str):
+        self.manager = manager
+        self.match_id = match_id
+        self.player_name = player_name
+
+    async def send_text(self, frame: str):
+        await self.manager.send_frame(frame, self.match_id, self.player_name)
+
+
+class ConnectionManager:
+    # Todas las operaciones sobre el registro corren en el event loop y no
+    # hacen await entre leer y reemplazar el snapshot de una partida, así que
+    # no hace falta lock. Cada cambio crea un dict nuevo (copy-on-write): un
+    # broadcast envía sobre el snapshot que leyó sin copiarlo ni bloquear a
+    # las demás partidas.
+    #
+    # Lo que se envía a una partida se publica además en el bus (ver
+    # connection/pubsub.py), que lo lleva a los sockets de la partida
+    # conectados a otros procesos.
+    #
+    # Los frames circulan en JSON; a los sockets que negociaron otra
+    # codificación o compresión se les envía su versión binaria (ver
+    # connection/wire.py).
+
+    def __init__(
+        self,
+        send_timeout: float = SEND_TIMEOUT,
+        batch_window: float = BATCH_WINDOW,
+        bus: Bus = None,
+    ):
+        self.connections: dict = _MatchConnections()
+        self.send_timeout = send_timeout
+        self.batch_window = batch_window
+        # Lotes abiertos por la petición en curso: match_id -> _Outbox. Cada
+        # petición (cada tarea) ve sólo los suyos
+        self._batches = ContextVar(f"batches_{id(self)}", default=_NO_BATCHES)
+        # Frames de lotes ya cerrados que esperan la ventana de batch_window
+        self._pending: dict[int, list] = {}
+        # socket -> Wire, para los que no reciben JSON sin comprimir
+        self._wires = weakref.WeakKeyDictionary()
+        self.bus = bus if bus is not None else InProcessBus()
+        self.bus.attach(self._deliver)
+
+    async def start(self):
+        await self.bus.start()
+
+    async def stop(self):
+        await self.bus.stop()
+
+    def _get_connections(self, match_id: int) -> MappingProxyType:
+        return self.connections[match_id]
+
+    def _add_connection(self, match_id: int, player_name: str, websocket: WebSocket):
+        if match_id not in self.connections:
+            self.bus.join(match_id)
+        connections = dict(self.connections[match_id])
+        connections[player_name] = websocket
+        self.connections[match_id] = MappingProxyType(connections)
+
+    def _remove_connection(
+        self, match_id: int, player_name: str, websocket: WebSocket = None
+    ):
+        """Remove the player's socket. If websocket is given, only remove it
+        when it's still the registered one, so a reconnection isn't lost"""
+        current = self.connections[match_id].get(player_name)
+        if current is None or (websocket is not None and current is not websocket):
+            return
+        connections = dict(self.connections[match_id])
+        del connections[player_name]
+        if connections:
+            self.connections[match_id] = MappingProxyType(connections)
+        else:
+            del self.connections[match_id]
+            self.bus.leave(match_id)
+
+    async def _close(self, websocket: WebSocket):
         try:
-            connections[player_name] = websocket
-        except Exception as e:
-            print(e)
-        finally:
-            self._release_connections_lock()
+            await asyncio.wait_for(websocket.close(), self.send_timeout)
+        except Exception:
+            pass
 
-    def disconnect(self, player_name: str, match_id: int):
-        connections = self._get_connections_and_lock(match_id)
+    async def _send(
+        self, match_id: int, player_name: str, websocket: WebSocket, frame: str
+    ):
+        """Send an encoded frame to one socket, evicting it if the send fails
+        or times out"""
         try:
-            if player_exists(player_name) and player_name in connections.keys():
-                del connections[player_name]
-        except Exception as e:
-            print(e)
+            wire = self._wires.get(websocket)
+            data = frame if wire is None else wire_frame(wire, frame)
+            if isinstance(data, str):
+                send = websocket.send_text(data)
+            else:
+                send = websocket.send_bytes(data)
+            await asyncio.wait_for(send, self.send_timeout)
+            return DELIVERED
+        except asyncio.TimeoutError:
+            print(f"Socket of {player_name} timed out")
+            self._remove_connection(match_id, player_name, websocket)
+            # Un envío cancelado a mitad de frame deja el socket inutilizable
+            asyncio.ensure_future(self._close(websocket))
+            return TIMED_OUT
+        except Exception:
+            print(f"Socket of {player_name} closed")
+            self._remove_connection(match_id, player_name, websocket)
+            return FAILED
+
+    @asynccontextmanager
+    async def batch(self, match_id: int):
+        """Queue the messages sent to the match inside the block and send
+        them to each socket as a single batch frame, keeping their order.
+        Nested blocks share the batch of the outer one; concurrent requests
+        have a batch each"""
+        batches = self._batches.get()
+        if match_id in batches:
+            yield
+            return
+        outbox = _Outbox()
+        token = self._batches.set(MappingProxyType({**batches, match_id: outbox}))
+        try:
+            yield
         finally:
-            self._release_connections_lock()
+            self._batches.reset(token)
+            await self._release(match_id, outbox.frames)
+
+    async def _release(self, match_id: int, frames: list):
+        """Send the frames of a closed batch, or keep them for the window to
+        join them with the next batches of the match"""
+        if not frames:
+            return
+        if self.batch_window <= 0:
+            await self._fan_out(match_id, frames)
+        elif match_id in self._pending:
+            self._pending[match_id].extend(frames)
+        else:
+            self._pending[match_id] = list(frames)
+            asyncio.ensure_future(self._flush_later(match_id))
+
+    async def _flush_later(self, match_id: int):
+        await asyncio.sleep(self.batch_window)
+        await self._fan_out(match_id, self._pending.pop(match_id))
+
+    async def _fan_out(self, match_id: int, frames: list) -> BroadcastReport:
+        """Send the (player_name or None, frame) pairs to the sockets of this
+        process and publish them to the other ones. Returns the report of the
+        local sends"""
+        report, _ = await asyncio.gather(
+            self._deliver(match_id, frames), self.bus.publish(match_id, frames)
+        )
+        return report
+
+    async def _deliver(self, match_id: int, pending: list) -> BroadcastReport:
+        """Send the (player_name or None, frame) pairs to the sockets of this
+        process, joining the frames of each socket into a batch"""
+        sends = []
+        for player_name, socket in self._get_connections(match_id).items():
+            frames = [
+                frame
+                for recipient, frame in pending
+                if recipient is None or recipient == player_name
+            ]
+            if not frames:
+                continue
+            frame = frames[0] if len(frames) == 1 else encode_batch(frames)
+            sends.append(self._send(match_id, player_name, socket, frame))
+        results = await asyncio.gather(*sends)
+        return _report(results)
+
+    def _queue(self, match_id: int, player_name: str, frame: str) -> bool:
+        """Add the frame to the batch of the match open by this request, if
+        there is one"""
+        outbox = self._batches.get().get(match_id)
+        if outbox is None:
+            return False
+        outbox.frames.append((player_name, frame))
+        return True
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        match_id: int,
+        player_name: str,
+        wire: Wire = Wire(),
+    ):
+        """Accept and register the socket of the player, which receives
+        frames as negotiated in wire (see connection/wire.py)"""
+        if wire.subprotocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=wire.subprotocol)
+        if wire != Wire():
+            self._wires[websocket] = wire
+        if match_id is None or not await run_db(check_match_existence, match_id):
+            raise ManagerException("Match not found")
+        if player_name is None or not await run_db(player_exists, player_name):
+            raise ManagerException("Player not found")
+        self._add_connection(match_id, player_name, websocket)
+
+    def disconnect(self, player_name: str, match_id: int, websocket: WebSocket = None):
+        self._remove_connection(match_id, player_name, websocket)
 
     async def send_personal_message(
         self, message_type: str, message_content, match_id: int, player_name: str
@@ -65,66 +283,85 @@ class ConnectionManager:
         if message_type == CHAT_NOTIFICATION:
             msg_copy = message_content.copy()
             msg_copy["target"] = player_name
-            save_chat_message(match_id, msg_copy)
+            await run_for_match(match_id, save_chat_message, match_id, msg_copy)
 
-        msg = self.__gen_msg(message_type, message_content)
-        connections = self._get_connections_and_lock(match_id)
-        copy_connections = connections.copy()
-        self._release_connections_lock()
-        try:
-            await copy_connections[player_name].send_json(msg)
-        except:
-            print("Socket closed")
+        frame = encode_message(message_type, message_content)
+        await self.send_frame(frame, match_id, player_name)
+
+    async def send_frame(self, frame: str, match_id: int, player_name: str):
+        """Send an encoded frame to the player, in this process or another"""
+        if self._queue(match_id, player_name, frame):
+            return
+        websocket = self._get_connections(match_id).get(player_name)
+        if websocket is None:
+            # Puede estar conectado a otro proceso
+            await self.bus.publish(match_id, [(player_name, frame)])
+            return
+        await self._send(match_id, player_name, websocket, frame)
 
     async def send_message_to(
         self, message_type: str, message_content, player_name: str
     ):
-        match_id = get_player_match(player_name)
-
-        if message_type == INFECTED:
-            save_log(match_id, "$" + player_name)
+        match_id = await run_for_player(player_name, get_player_match, player_name)
 
         await self.send_personal_message(
             message_type, message_content, match_id, player_name
         )
 
-    async def send_error_message(self, message_content, websocket: str):
-        msg = self.__gen_msg("error", message_content)
+        if message_type == INFECTED:
+            await run_for_match(match_id, save_log, match_id, INFECTED_LOG, player_name)
+            await self.send_personal_message(
+                PLAY_NOTIFICATION, INFECTED_LOG, match_id, player_name
+            )
+
+    async def send_error_message(self, message_content, websocket: WebSocket):
+        """Send an error to the socket. The errors of a request go in its
+        batch, after the messages it already queued"""
+        frame = encode_message("error", message_content)
+        if isinstance(websocket, PlayerSocket):
+            await self.send_frame(frame, websocket.match_id, websocket.player_name)
+            return
         try:
-            await websocket.send_json(msg)
+            await websocket.send_text(frame)
         except:
             print("Socket closed")
 
-    async def broadcast(self, message_type: str, message_content, match_id: int):
+    async def broadcast(
+        self, message_type: str, message_content, match_id: int
+    ) -> BroadcastReport:
+        """Send the message to every socket of the match concurrently.
+        Returns how many sends to the sockets of this process were delivered,
+        timed out or failed (nothing is sent yet if a batch of the match is
+        open)"""
         if message_type == PLAY_NOTIFICATION:
-            save_log(match_id, message_content)
+            await run_for_match(match_id, save_log, match_id, message_content)
 
-        msg = self.__gen_msg(message_type, message_content)
+        # Se codifica una sola vez para todos los destinatarios
+        frame = encode_message(message_type, message_content)
 
-        connections = self._get_connections_and_lock(match_id)
-        copy_connections = connections.copy()
-        self._release_connections_lock()
-        try:
-            for socket in copy_connections.values():
-                await socket.send_json(msg)
-        except Exception as e:
-            print(e)
-
-        self.persist_broadcast(message_type, message_content, match_id, copy_connections)
-
-    def persist_broadcast(self, message_type, message_content, match_id, copy_connections):
-        if message_type == "player_left":
-            for player in copy_connections.keys():
-                if not player == message_content["message"].split(" ")[0]:
-                    msg = {
-                        "author": "",
-                        "message": message_content["message"],
-                        "timestamp": message_content["timestamp"],
-                        "target": player,
-                    }
-                    save_chat_message(match_id, msg)
+        if self._queue(match_id, None, frame):
+            report = BroadcastReport()
+        else:
+            report = await self._fan_out(match_id, [(None, frame)])
+
+        if message_type in PERSISTED_BROADCASTS:
+            await run_for_match(
+                match_id,
+                self.persist_broadcast,
+                message_type,
+                message_content,
+                match_id,
+            )
+        return report
+
+    def persist_broadcast(self, message_type, message_content, match_id):
+        # Los mensajes para todos se guardan una sola vez, sin destinatario
+        if message_type == PLAYER_LEFT:
+            msg = {
+                "author": "",
+                "message": message_content["message"],
+                "timestamp": message_content["timestamp"],
+            }
+            save_chat_message(match_id, msg)
         elif message_type == CHAT_NOTIFICATION:
-            msg_copy = message_content.copy()
-            for player in copy_connections.keys():
-                msg_copy["target"] = player
-                save_chat_message(match_id, msg_copy)
+            save_chat_message(match_id, message_content)
@@ -0,0 +1,140 @@
+# Canal de novedades del lobby.
+# Cada cliente que navega el lobby abre un websocket, recibe el listado
+# completo y después sólo los cambios del índice del lobby. Los cambios de un
+# suscriptor se acumulan por partida mientras su envío anterior está en
+# curso: un cliente lento recibe el último estado de cada partida en vez de
+# todos los intermedios.
+
+from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+from connection.connections import SEND_TIMEOUT
+from connection.serializer import encode_message
+from connection.socket_messages import LOBBY_MATCHES, LOBBY_CHANGES
+from Game.lobby_index import LobbyIndex, lobby_index, public_entry, CREATED, DELETED
+
+
+def _coalesce(previous: dict, change: dict) -> dict:
+    """Pending change of a match after change arrives"""
+    if previous is None:
+        return change
+    if change["version"] < previous["version"]:
+        return previous
+    # Si el cliente todavía no supo que la partida se creó, sigue siendo nueva
+    if previous["event"] == CREATED and change["event"] != DELETED:
+        return {**change, "event": CREATED}
+    return change
+
+
+class _Subscriber:
+    def __init__(self, websocket: WebSocket, loop: asyncio.AbstractEventLoop):
+        self.websocket = websocket
+        self.loop = loop
+        self.pending: dict[int, dict] = {}  # id de la partida -> cambio
+        self.wakeup = asyncio.Event()
+        # Versión del listado enviado: los cambios anteriores ya están en él
+        self.since = None
+
+    def publish(self, change: dict):
+        """Runs in the subscriber's event loop"""
+        if self.since is None or change["version"] <= self.since:
+            return
+        self.pending[change["id"]] = _coalesce(self.pending.get(change["id"]), change)
+        self.wakeup.set()
+
+    def take(self) -> list:
+        pending, self.pending = self.pending, {}
+        self.wakeup.clear()
+        return sorted(pending.values(), key=lambda change: change["version"])
+
+
+class LobbyFeed:
+    # Los cambios llegan desde el hilo de la base de datos: se pasan al event
+    # loop de cada suscriptor con call_soon_threadsafe. El conjunto de
+    # suscriptores se reemplaza entero en cada alta o baja.
+
+    def __init__(self, index: LobbyIndex = lobby_index, send_timeout=SEND_TIMEOUT):
+        self.index = index
+        self.send_timeout = send_timeout
+        self._subscribers: frozenset = frozenset()
+        index.subscribe(self._on_change)
+
+    def _on_change(self, event: str, entry: dict, version: int):
+        change = {
+            "id": entry["id"],
+            "event": event,
+            "version": version,
+            "match": {"name": entry["name"]} if event == DELETED else public_entry(entry),
+        }
+        for subscriber in self._subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.publish, change)
+            except RuntimeError:
+                # El loop del suscriptor ya se cerró
+                pass
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def _pump(self, subscriber: _Subscriber):
+        while True:
+            await subscriber.wakeup.wait()
+            changes = subscriber.take()
+            content = {
+                "version": changes[-1]["version"],
+                "changes": [
+                    {"event": change["event"], "match": change["match"]}
+                    for change in changes
+                ],
+            }
+            frame = encode_message(LOBBY_CHANGES, content)
+            await asyncio.wait_for(
+                subscriber.websocket.send_text(frame), self.send_timeout
+            )
+
+    async def _receive(self, websocket: WebSocket):
+        # El cliente no envía nada: sólo se espera a que cierre
+        while True:
+            await websocket.receive_text()
+
+    async def serve(self, websocket: WebSocket):
+        """Stream the lobby to the websocket until it disconnects or stops
+        keeping up with the sends"""
+        await websocket.accept()
+        subscriber = _Subscriber(websocket, asyncio.get_running_loop())
+        self._subscribers = self._subscribers | {subscriber}
+        tasks = []
+        try:
+            version, matches = self.index.listing()
+            subscriber.since = version
+            await asyncio.wait_for(
+                websocket.send_text(
+                    encode_message(
+                        LOBBY_MATCHES, {"version": version, "matches": matches}
+                    )
+                ),
+                self.send_timeout,
+            )
+            tasks = [
+                asyncio.ensure_future(self._pump(subscriber)),
+                asyncio.ensure_future(self._receive(websocket)),
+            ]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except (WebSocketDisconnect, asyncio.TimeoutError):
+            pass
+        finally:
+            self._subscribers = self._subscribers - {subscriber}
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task.exception() is not None and task is tasks[0]:
+                    # El envío falló o tardó demasiado
+                    await self._close(websocket)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
+
+lobby_feed = LobbyFeed()
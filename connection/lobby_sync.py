@@ -0,0 +1,61 @@
+# Sincronización del índice del lobby entre procesos.
+# Cada proceso tiene su índice (Game/lobby_index.py), que actualizan las
+# funciones de la base que corren en ese proceso. Cada cambio local se
+# publica en el bus, en la sala LOBBY_ROOM a la que se unen todos los
+# procesos, y los demás lo aplican a su índice: así /match/list, su ETag y
+# /ws/lobby ven también las partidas que crean, modifican o borran los otros
+# workers.
+#
+# Los cambios que llegan del bus no se vuelven a publicar. El índice los
+# notifica en el event loop, y los locales en el hilo que los hizo: la marca
+# de cambio remoto es una variable de contexto, propia de cada hilo.
+
+import asyncio
+from contextvars import ContextVar
+from connection.pubsub import Bus
+from connection.serializer import encode_message, loads
+from Game.lobby_index import LobbyIndex, lobby_index, DELETED
+
+# Sala del bus de los cambios del lobby: no es el id de ninguna partida
+LOBBY_ROOM = -1
+
+
+class LobbySync:
+    def __init__(self, bus: Bus, index: LobbyIndex = lobby_index):
+        self.bus = bus
+        self.index = index
+        self._loop = None
+        self._remote = ContextVar(f"lobby_remote_{id(self)}", default=False)
+        bus.attach_room(LOBBY_ROOM, self._apply)
+        index.subscribe(self._on_change)
+
+    def start(self):
+        """Start publishing the local changes, from the running loop"""
+        self._loop = asyncio.get_running_loop()
+
+    def _on_change(self, event: str, entry: dict, version: int):
+        if self._remote.get() or self._loop is None:
+            return
+        frame = encode_message(event, entry)
+        try:
+            self._loop.call_soon_threadsafe(self._publish, frame)
+        except RuntimeError:
+            # El loop ya se cerró
+            pass
+
+    def _publish(self, frame: str):
+        asyncio.ensure_future(self.bus.publish(LOBBY_ROOM, [(None, frame)]))
+
+    async def _apply(self, room: int, frames: list):
+        """Apply the changes published by another process"""
+        token = self._remote.set(True)
+        try:
+            for _, frame in frames:
+                change = loads(frame)
+                entry = change["message_content"]
+                if change["message_type"] == DELETED:
+                    self.index.remove(entry["id"])
+                else:
+                    self.index.put(entry)
+        finally:
+            self._remote.reset(token)
@@ -0,0 +1,292 @@
+# Difusión de mensajes entre procesos.
+# Con varios workers de uvicorn los jugadores de una partida pueden estar
+# conectados a procesos distintos. El ConnectionManager envía cada mensaje a
+# sus sockets y lo publica en el bus, que lo lleva a los demás procesos con
+# jugadores de esa partida (afinidad por partida: un proceso sólo recibe los
+# mensajes de las partidas en las que tiene sockets).
+#
+# LACOSA_PUBSUB elige el bus:
+#   local (por defecto)           un solo proceso
+#   unix:///tmp/lacosa-bus.sock   broker local, ver connection/broker.py
+#
+# Un mensaje del bus lleva la partida y la lista de frames ya codificados con
+# su destinatario (None para todos), como los lotes del ConnectionManager.
+#
+# Con sharding (ver connection/shards.py) cada proceso reclama uno de los
+# shards y el bus lleva además mensajes directos a un shard o a un proceso.
+#
+# Las salas con números negativos no son partidas: sus mensajes los recibe
+# el manejador registrado con attach_room (ver connection/lobby_sync.py).
+
+import asyncio
+import json
+import os
+from secrets import token_hex
+from urllib.parse import urlsplit
+
+JOIN = "join"
+LEAVE = "leave"
+SEND = "send"
+CLAIM = "claim"  # el worker pide un shard
+SHARD = "shard"  # el broker le asigna uno (o None si están todos tomados)
+DIRECT = "direct"  # mensaje para el dueño de un shard o para un proceso
+UNROUTED = "unrouted"  # el broker devuelve un mensaje directo sin destino
+
+# Segundos entre intentos de conexión al broker
+RETRY_DELAY = 1
+# Tiempo máximo que se espera a que el broker acepte un mensaje
+PUBLISH_TIMEOUT = 2
+# Largo máximo de una línea del protocolo
+LINE_LIMIT = 4 * 1024 * 1024
+
+
+def encode_command(op: str, **fields) -> bytes:
+    """One line of the broker protocol"""
+    command = {"op": op, **fields}
+    return json.dumps(command, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def claim_shard(holders: dict, shards: int, holder) -> int:
+    """Lowest free shard, taken by holder. None if they are all taken"""
+    for shard in range(shards):
+        if shard not in holders:
+            holders[shard] = holder
+            return shard
+    return None
+
+
+class Bus:
+    """Carries the frames of a match to the other processes with sockets of
+    the match. deliver(match_id, frames) is awaited for each message that
+    arrives from another process"""
+
+    def __init__(self):
+        self.node = token_hex(8)  # identifica al proceso en el bus
+        self.shard = None  # shard reclamado, None mientras no lo tenga
+        self._on_direct = None
+        self._on_unrouted = None
+        self._room_handlers: dict = {}  # sala -> deliver propio
+
+    def attach(self, deliver: callable):
+        self._deliver = deliver
+
+    def attach_room(self, room: int, deliver: callable):
+        """Join the room and await deliver(room, frames), instead of the
+        attached deliver, for each message of the room"""
+        self._room_handlers[room] = deliver
+        self.join(room)
+
+    async def _dispatch(self, match_id: int, frames: list):
+        deliver = self._room_handlers.get(match_id)
+        if deliver is None:
+            deliver = self._deliver
+        await deliver(match_id, frames)
+
+    def join(self, match_id: int):
+        """This process has sockets of the match"""
+
+    def leave(self, match_id: int):
+        """This process has no more sockets of the match"""
+
+    async def publish(self, match_id: int, frames: list):
+        """Send the frames to the other processes"""
+
+    def enable_sharding(
+        self, shards: int, on_direct: callable, on_unrouted: callable
+    ):
+        """Claim one of the shards for this process. on_direct(message) is
+        awaited for each direct message that arrives, on_unrouted(message)
+        for each one sent by this process that had no destination"""
+        self.shards = shards
+        self._on_direct = on_direct
+        self._on_unrouted = on_unrouted
+
+    async def send_direct(
+        self, message: dict, shard: int = None, node: str = None
+    ) -> bool:
+        """Send the message to the owner of the shard or to the node. False
+        if it can't be sent"""
+        return False
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InProcessHub:
+    """Rooms of the buses of one process"""
+
+    def __init__(self):
+        self.rooms: dict[int, frozenset] = {}
+        self.holders: dict = {}  # shard -> bus
+        self.nodes: dict = {}  # node -> bus
+
+
+class InProcessBus(Bus):
+    # Conecta varios ConnectionManager dentro del mismo proceso (cada uno con
+    # su bus sobre el mismo hub). Con un hub propio no hay otros procesos y
+    # publicar no hace nada.
+
+    def __init__(self, hub: InProcessHub = None):
+        super().__init__()
+        self.hub = hub if hub is not None else InProcessHub()
+        self.hub.nodes[self.node] = self
+
+    def join(self, match_id: int):
+        rooms = self.hub.rooms
+        rooms[match_id] = rooms.get(match_id, frozenset()) | {self}
+
+    def leave(self, match_id: int):
+        rooms = self.hub.rooms
+        members = rooms.get(match_id, frozenset()) - {self}
+        if members:
+            rooms[match_id] = members
+        else:
+            rooms.pop(match_id, None)
+
+    async def publish(self, match_id: int, frames: list):
+        peers = [bus for bus in self.hub.rooms.get(match_id, ()) if bus is not self]
+        await asyncio.gather(*(bus._dispatch(match_id, frames) for bus in peers))
+
+    def enable_sharding(
+        self, shards: int, on_direct: callable, on_unrouted: callable
+    ):
+        super().enable_sharding(shards, on_direct, on_unrouted)
+        self.shard = claim_shard(self.hub.holders, shards, self)
+
+    async def send_direct(
+        self, message: dict, shard: int = None, node: str = None
+    ) -> bool:
+        if node is not None:
+            target = self.hub.nodes.get(node)
+        else:
+            target = self.hub.holders.get(shard)
+        if target is None or target._on_direct is None:
+            return False
+        # Como por el broker: el que envía no espera a que se procese
+        asyncio.ensure_future(target._on_direct(message))
+        return True
+
+    async def stop(self):
+        if self.shard is not None:
+            del self.hub.holders[self.shard]
+            self.shard = None
+        self.hub.nodes.pop(self.node, None)
+
+
+class SocketBus(Bus):
+    # Cliente del broker local. Mantiene la conexión abierta y se reconecta
+    # si se cae, volviendo a anunciar sus partidas. Lo que se publica sin
+    # conexión se pierde: el estado de la partida se recupera al reconectar.
+
+    def __init__(self, path: str, retry_delay: float = RETRY_DELAY):
+        super().__init__()
+        self.path = path
+        self.retry_delay = retry_delay
+        self.rooms: set[int] = set()
+        self._writer = None
+        self._task = None
+        self.connected = asyncio.Event()
+
+    def _write(self, line: bytes):
+        if self._writer is not None:
+            self._writer.write(line)
+
+    def join(self, match_id: int):
+        self.rooms.add(match_id)
+        self._write(encode_command(JOIN, match=match_id))
+
+    def leave(self, match_id: int):
+        self.rooms.discard(match_id)
+        self._write(encode_command(LEAVE, match=match_id))
+
+    async def _send(self, line: bytes) -> bool:
+        writer = self._writer
+        if writer is None:
+            return False
+        writer.write(line)
+        try:
+            await asyncio.wait_for(writer.drain(), PUBLISH_TIMEOUT)
+        except (asyncio.TimeoutError, OSError):
+            # El broker no responde: se reconecta
+            writer.close()
+            return False
+        return True
+
+    async def publish(self, match_id: int, frames: list):
+        await self._send(encode_command(SEND, match=match_id, frames=frames))
+
+    async def send_direct(
+        self, message: dict, shard: int = None, node: str = None
+    ) -> bool:
+        return await self._send(
+            encode_command(DIRECT, shard=shard, node=node, message=message)
+        )
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=LINE_LIMIT
+                )
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if self._on_direct is not None:
+                writer.write(encode_command(CLAIM, node=self.node, shards=self.shards))
+            for match_id in self.rooms:
+                writer.write(encode_command(JOIN, match=match_id))
+            self._writer = writer
+            self.connected.set()
+            try:
+                await self._receive(reader)
+            except (OSError, ValueError, KeyError):
+                pass
+            finally:
+                self.connected.clear()
+                self._writer = None
+                # El broker libera el shard al perder la conexión
+                self.shard = None
+                writer.close()
+            await asyncio.sleep(self.retry_delay)
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        # Los frames se entregan en orden de llegada, uno por vez. Los
+        # mensajes directos se procesan aparte para no demorar los frames.
+        while line := await reader.readline():
+            command = json.loads(line)
+            op = command["op"]
+            if op == SEND:
+                await self._dispatch(command["match"], command["frames"])
+            elif op == SHARD:
+                self.shard = command["shard"]
+            elif op == DIRECT:
+                asyncio.ensure_future(self._on_direct(command["message"]))
+            elif op == UNROUTED:
+                asyncio.ensure_future(self._on_unrouted(command["message"]))
+
+
+def bus_from_url(url: str) -> Bus:
+    if url == "local":
+        return InProcessBus()
+    parts = urlsplit(url)
+    if parts.scheme == "unix" and parts.path:
+        return SocketBus(parts.path)
+    raise ValueError(f"Bus no soportado: {url}")
+
+
+def bus_from_env() -> Bus:
+    return bus_from_url(os.environ.get("LACOSA_PUBSUB", "local"))
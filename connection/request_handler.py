@@ -1,47 +1,69 @@
-import json
+from typing import NamedTuple
+from pydantic import BaseModel
 from Game.app_auxiliars import *
 from connection.connections import *
 from connection.socket_messages import *
+from connection.request_scope import request_scope
+from connection.serializer import loads
+from pydantic_models import (
+    ChatRequest,
+    ChatHistoryRequest,
+    CardRequest,
+    PlayCardRequest,
+    RevelacionesRequest,
+    ResyncRequest,
+)
 from time import time
 
+# Cada tipo de mensaje entrante tiene un modelo de su contenido y un handler
+# (ver request_routes, al final). El contenido se valida antes de llegar al
+# handler: un mensaje mal formado no llega a tocar la partida.
+#
+# Ninguna consulta a la base corre en el event loop. Los handlers de juego
+# sólo corren con la partida en memoria (Game/match_state.py), donde las
+# funciones auxiliares no consultan la base; antes de iniciarse la partida
+# se rechazan sin tocarla. Los demás pasan por run_for_match.
+
 
 # Custom request exceptions
 class RequestException(Exception):
     pass
 
 
+class Route(NamedTuple):
+    model: type[BaseModel]  # None si el mensaje no lleva contenido
+    handler: callable
+    in_game: bool = True  # sólo con la partida iniciada
+
+
 # Request parser
-def parse_request(request: str):
+def parse_request(request: str) -> tuple:
+    """Message type and validated content of an incoming message"""
     try:
-        request = json.loads(request)
-        type = request["message_type"]
+        request = loads(request)
+        route = request_routes.get(request["message_type"])
+        if route is None:
+            raise RequestException("Petición no reconocida")
         content = request["message_content"]
-    except:
+        content = None if route.model is None else route.model.model_validate(content)
+    except (ValueError, KeyError, TypeError):
+        # ValidationError también es un ValueError
         raise RequestException("Invalid request")
-    return (type, content)
+    return (request["message_type"], content)
 
 
 async def handle_request(request, match_id, player_name, websocket):
+    with request_scope():
+        await _handle_request(request, match_id, player_name, websocket)
+
+
+async def _handle_request(request, match_id, player_name, websocket):
     try:
-        request = parse_request(request)
-        msg_type, content = request
-
-        message_handlers = {
-            CHAT: chat_handler,
-            PICKUP_CARD: pickup_card_handler,
-            PLAY_CARD: play_card_handler,
-            DISCARD_CARD: discard_card_handler,
-            SKIP_DEFENSE: skip_defense_handler,
-            EXCHANGE_CARD: exchange_card_handler,
-            DECLARE: declaration_handler,
-            REVELACIONES: play_revelaciones_handler,
-        }
-
-        handler = message_handlers.get(msg_type)
-        if handler:
-            await handler(content, match_id, player_name)
-        else:
-            raise RequestException("Petición no reconocida")
+        msg_type, content = parse_request(request)
+        route = request_routes[msg_type]
+        if route.in_game and not match_states.is_loaded(match_id):
+            raise MatchNotStarted("Partida no ha iniciado")
+        await route.handler(content, match_id, player_name)
     except MatchNotFound:
         pass
     except KeyError as e:
@@ -51,24 +73,36 @@ async def handle_request(request, match_id, player_name, websocket):
 
 
 # Define individual handler functions for each message type
-async def chat_handler(content, match_id, player_name):
+async def chat_handler(content: ChatRequest, match_id, player_name):
     # Save chat message in database
-    msg = gen_chat_message(match_id, player_name, content["message"])
+    msg = await run_for_match(
+        match_id, gen_chat_message, match_id, player_name, content.message
+    )
     await manager.broadcast(CHAT_NOTIFICATION, msg, match_id)
 
 
+async def chat_history_handler(content: ChatHistoryRequest, match_id, player_name):
+    before = content.before
+    page = await run_for_match(
+        match_id, get_chat_records_for, match_id, player_name, before
+    )
+    await manager.send_message_to(
+        CHAT_PAGE, {"before": before, "messages": page}, player_name
+    )
+
+
 async def pickup_card_handler(content, match_id, player_name):
     await pickup_card(player_name)
     await manager.send_message_to(CARDS, get_player_hand(player_name), player_name)
 
 
-async def play_card_handler(content, match_id, player_name):
-    await play_card(player_name, content["card_id"], content["target"])
+async def play_card_handler(content: PlayCardRequest, match_id, player_name):
+    await play_card(player_name, content.card_id, content.target)
     await manager.send_message_to(CARDS, get_player_hand(player_name), player_name)
 
 
-async def discard_card_handler(content, match_id, player_name):
-    await discard_player_card(player_name, content["card_id"])
+async def discard_card_handler(content: CardRequest, match_id, player_name):
+    await discard_player_card(player_name, content.card_id)
     await manager.send_message_to(CARDS, get_player_hand(player_name), player_name)
 
 
@@ -77,8 +111,8 @@ async def skip_defense_handler(content, match_id, player_name):
     await manager.send_message_to(CARDS, get_player_hand(player_name), player_name)
 
 
-async def exchange_card_handler(content, match_id, player_name):
-    await exchange_handler(player_name, content["card_id"])
+async def exchange_card_handler(content: CardRequest, match_id, player_name):
+    await exchange_handler(player_name, content.card_id)
 
 
 async def declaration_handler(content, match_id, player_name):
@@ -88,5 +122,28 @@ async def declaration_handler(content, match_id, player_name):
         await set_win(match_id, "Declaración incorrecta")
 
 
-async def play_revelaciones_handler(content, match_id, player_name):
-    await play_revelaciones(player_name, content["decision"])
+async def play_revelaciones_handler(
+    content: RevelacionesRequest, match_id, player_name
+):
+    await play_revelaciones(player_name, content.decision)
+
+
+async def resync_handler(content: ResyncRequest, match_id, player_name):
+    await send_full_state(match_id, player_name)
+    if content.logs_since is not None:
+        await send_logs_record(match_id, player_name, content.logs_since)
+
+
+# Tipo de mensaje -> modelo de su contenido y handler
+request_routes = {
+    CHAT: Route(ChatRequest, chat_handler, in_game=False),
+    PICKUP_CARD: Route(None, pickup_card_handler),
+    PLAY_CARD: Route(PlayCardRequest, play_card_handler),
+    DISCARD_CARD: Route(CardRequest, discard_card_handler),
+    SKIP_DEFENSE: Route(None, skip_defense_handler),
+    EXCHANGE_CARD: Route(CardRequest, exchange_card_handler),
+    DECLARE: Route(None, declaration_handler),
+    REVELACIONES: Route(RevelacionesRequest, play_revelaciones_handler),
+    RESYNC: Route(ResyncRequest, resync_handler),
+    CHAT_HISTORY: Route(ChatHistoryRequest, chat_history_handler, in_game=False),
+}
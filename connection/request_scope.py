@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from Database.Database import query_counter
+
+# Alcance de una petición por websocket.
+# Las partidas iniciadas ya viven en memoria (Game/match_state.py), que hace de
+# caché de identidad compartida por todas las funciones auxiliares; acá solo se
+# cuentan las consultas que la petición todavía envía a la base de datos.
+# No se abre un db_session que abarque al handler: Pony guarda la sesión por
+# hilo, y todas las corrutinas del event loop la compartirían entre awaits.
+
+
+class RequestScope:
+    def __init__(self):
+        self.queries = 0
+
+
+class RequestStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.last_queries = 0
+
+    def record(self, scope: RequestScope):
+        self.requests += 1
+        self.queries += scope.queries
+        self.max_queries = max(self.max_queries, scope.queries)
+        self.last_queries = scope.queries
+
+    def average(self) -> float:
+        if self.requests == 0:
+            return 0.0
+        return self.queries / self.requests
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "max_queries": self.max_queries,
+            "last_queries": self.last_queries,
+            "average": self.average(),
+        }
+
+
+request_stats = RequestStats()
+
+
+@contextmanager
+def request_scope():
+    scope = RequestScope()
+    token = query_counter.set(scope)
+    try:
+        yield scope
+    finally:
+        query_counter.reset(token)
+        request_stats.record(scope)
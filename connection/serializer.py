@@ -0,0 +1,60 @@
+import json
+from connection.socket_messages import BATCH
+
+# Codificación de los mensajes salientes.
+# Cada mensaje se codifica una sola vez y el mismo frame se envía a todos los
+# sockets de la partida. Si orjson está instalado se usa como codificador; si
+# no, json de la stdlib con el mismo formato que orjson: sin espacios y con
+# los caracteres no ASCII en UTF-8. WebSocket.send_json los escapa (\uXXXX),
+# así que el JSON es el mismo pero no los bytes.
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+# Misma interfaz que orjson.dumps: objeto -> bytes UTF-8
+dumps = _orjson_dumps if orjson is not None else _stdlib_dumps
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def encode_message(message_type: str, message_content) -> str:
+    """Encode an outgoing message into a text frame ready to be sent"""
+    msg = {
+        "message_type": message_type,
+        "message_content": message_content,
+    }
+    return dumps(msg).decode("utf-8")
+
+
+def encode_with_parts(message_type: str, content: dict, parts: dict) -> str:
+    """Encode a message whose content is the content object plus the
+    members of parts, whose values are already encoded"""
+    members = [dumps(content).decode("utf-8")[1:-1]] if content else []
+    members += [
+        dumps(key).decode("utf-8") + ":" + value for key, value in parts.items()
+    ]
+    return (
+        '{"message_type":' + dumps(message_type).decode("utf-8")
+        + ',"message_content":{' + ",".join(members) + "}}"
+    )
+
+
+def encode_batch(frames: list[str]) -> str:
+    """Join already encoded messages into a single batch frame, in order"""
+    # Los mensajes ya codificados se concatenan sin volver a serializarlos
+    message_type = dumps(BATCH).decode("utf-8")
+    return (
+        '{"message_type":' + message_type + ',"message_content":['
+        + ",".join(frames)
+        + "]}"
+    )
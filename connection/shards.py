@@ -0,0 +1,136 @@
+# Reparto de las partidas entre los workers.
+# LACOSA_WORKERS es la cantidad de shards: cada worker reclama uno en el bus
+# (ver connection/pubsub.py) y la partida match_id pertenece al shard
+# match_id % LACOSA_WORKERS. Sólo el dueño de la partida modifica su estado:
+# los comandos de una partida corren de a uno, en orden de llegada, en el
+# event loop de su dueño. Los demás workers se los reenvían por el bus y
+# esperan la respuesta.
+#
+# Los comandos se registran con @shard_command y reciben el id de la partida
+# seguido de sus argumentos, que deben poder pasarse a JSON igual que su
+# resultado.
+
+import asyncio
+import os
+from itertools import count
+from connection.pubsub import Bus
+
+SHARDS = int(os.environ.get("LACOSA_WORKERS", "1"))
+# Tiempo máximo que se espera la respuesta del dueño de una partida
+CALL_TIMEOUT = float(os.environ.get("LACOSA_SHARD_TIMEOUT", "10"))
+
+CALL = "call"
+REPLY = "reply"
+
+commands: dict[str, callable] = {}
+
+
+class ShardException(Exception):
+    pass
+
+
+def shard_command(name: str):
+    """Register the coroutine function as the command name"""
+
+    def register(fn):
+        commands[name] = fn
+        return fn
+
+    return register
+
+
+def owner_of(match_id: int, shards: int) -> int:
+    return match_id % shards
+
+
+class _Lane:
+    """Commands of a match waiting to run in its owner"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class ShardRouter:
+    def __init__(self, bus: Bus, shards: int = SHARDS, timeout: float = CALL_TIMEOUT):
+        self.bus = bus
+        self.shards = shards
+        self.timeout = timeout
+        self._lanes: dict[int, _Lane] = {}
+        self._calls: dict[int, asyncio.Future] = {}
+        self._ids = count()
+        if shards > 1:
+            bus.enable_sharding(shards, self._on_direct, self._on_unrouted)
+
+    def owns(self, match_id: int) -> bool:
+        if self.shards == 1:
+            return True
+        return self.bus.shard == owner_of(match_id, self.shards)
+
+    async def call(self, match_id: int, command: str, *args):
+        """Run the command of the match in its owner and return its result"""
+        if self.owns(match_id):
+            return await self._run(match_id, command, args)
+
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        message = {
+            "kind": CALL,
+            "id": call_id,
+            "node": self.bus.node,
+            "match": match_id,
+            "command": command,
+            "args": args,
+        }
+        try:
+            if not await self.bus.send_direct(
+                message, shard=owner_of(match_id, self.shards)
+            ):
+                raise ShardException("No se pudo contactar al worker de la partida")
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ShardException("El worker de la partida no responde")
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def _run(self, match_id: int, command: str, args):
+        # La fila se toma antes del primer await: los comandos que llegan
+        # juntos corren en el orden en que llegaron
+        lane = self._lanes.get(match_id)
+        if lane is None:
+            lane = self._lanes[match_id] = _Lane()
+        lane.users += 1
+        try:
+            async with lane.lock:
+                return await commands[command](match_id, *args)
+        finally:
+            lane.users -= 1
+            if lane.users == 0:
+                del self._lanes[match_id]
+
+    def _resolve(self, call_id: int, result=None, error: str = None):
+        future = self._calls.get(call_id)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(ShardException(error))
+
+    async def _on_direct(self, message: dict):
+        if message["kind"] == REPLY:
+            self._resolve(message["id"], message.get("result"), message.get("error"))
+            return
+        reply = {"kind": REPLY, "id": message["id"]}
+        try:
+            reply["result"] = await self._run(
+                message["match"], message["command"], message["args"]
+            )
+        except Exception as e:
+            reply["error"] = str(e) or type(e).__name__
+        await self.bus.send_direct(reply, node=message["node"])
+
+    async def _on_unrouted(self, message: dict):
+        if message["kind"] == CALL:
+            self._resolve(message["id"], error="La partida no tiene worker")
@@ -11,6 +11,8 @@ LEAVE_MATCH = "leave match"
 EXCHANGE_CARD = "intercambiar carta"
 DECLARE = "declaración"
 REVELACIONES = "revelaciones"
+RESYNC = "resincronizar"
+CHAT_HISTORY = "historial anterior"
 
 
 # ------ Outgoing messages ------
@@ -32,9 +34,55 @@ QUARANTINE = "cuarentena"
 DEFENSE_STAMP = "timestamp"
 DIRECTION = "sentido horario"
 CHAT_RECORD = "historial"
+CHAT_PAGE = "página historial"
 CHAT_NOTIFICATION = "notificación chat"
 INFECTED = "infectado"
 ALREADY_SELECTED = "carta ya seleccionada"
 LOGS_RECORD = "logs"
+LOGS_SEQ = "secuencia logs"
+RECONNECT_SNAPSHOT = "snapshot"
+STATE_VERSION = "versión estado"
+BATCH = "lote"
+LOBBY_MATCHES = "partidas lobby"
+LOBBY_CHANGES = "cambios lobby"
+START_MATCH = "start_match"
+MATCH_DELETED = "match_deleted"
+PLAYER_LEFT = "player_left"
+
+# ------ Numeric codes of the outgoing messages ------
+# Los usa la codificación compacta (ver connection/wire.py). Los clientes
+# guardan estos números: sólo se agregan códigos nuevos, nunca se reusan.
+
+MESSAGE_CODES = {
+    ERROR: 0,
+    BATCH: 1,
+    CARDS: 2,
+    REVEALED_CARDS: 3,
+    PLAY_NOTIFICATION: 4,
+    WAIT_NOTIFICATION: 5,
+    MATCH_FINISHED: 6,
+    DEAD_NOTIFICATION: 7,
+    INITIAL_STATE: 8,
+    POSITIONS: 9,
+    LOBBY_PLAYERS: 10,
+    DEAD_PLAYERS: 11,
+    MATCH_STATE: 12,
+    OBSTACLES: 13,
+    QUARANTINE: 14,
+    DEFENSE_STAMP: 15,
+    DIRECTION: 16,
+    CHAT_RECORD: 17,
+    CHAT_PAGE: 18,
+    CHAT_NOTIFICATION: 19,
+    INFECTED: 20,
+    ALREADY_SELECTED: 21,
+    LOGS_RECORD: 22,
+    LOGS_SEQ: 23,
+    RECONNECT_SNAPSHOT: 24,
+    STATE_VERSION: 25,
+    START_MATCH: 26,
+    MATCH_DELETED: 27,
+    PLAYER_LEFT: 28,
+}
 
 # ------ Auxiliary functions for sockets messages ------
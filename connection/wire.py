@@ -0,0 +1,242 @@
+# Codificación de los frames salientes según lo que negoció cada socket.
+# JSON es la codificación por defecto. Un cliente pide la compacta con el
+# subprotocolo "lacosa.msgpack" o con el parámetro ?encoding=msgpack, y
+# recibe frames binarios en MessagePack donde:
+#   - cada mensaje es [código, contenido], con el código del tipo en
+#     MESSAGE_CODES (connection/socket_messages.py) o el tipo si no tiene,
+#   - un lote es [código de BATCH, [mensajes]],
+#   - cada carta ({"card_id", "card_name", "type"}) es sólo su id en el
+#     catálogo (GET /cards/catalog).
+#
+# Los mensajes se siguen armando, encolando y publicando en el bus en JSON:
+# el frame compacto se deriva del JSON al enviarlo y lo reusan todos los
+# sockets compactos que reciben el mismo frame.
+#
+# Si el paquete msgpack está instalado se usa para empaquetar; si no, un
+# empaquetador propio con la parte del formato que usan los mensajes.
+#
+# Además, con ?compress=deflate los frames de LACOSA_COMPRESS_MIN_SIZE bytes
+# o más (historial de chat, registro, manos completas) se envían comprimidos
+# como un frame binario: el byte 0xC1, que MessagePack no usa, seguido del
+# frame en deflate crudo. Los frames chicos se envían sin comprimir. El
+# permessage-deflate del servidor comprime todos los frames por igual: con
+# esta compresión conviene desactivarlo (ver el README).
+
+import os
+import struct
+import zlib
+from functools import lru_cache
+from typing import NamedTuple
+from fastapi import WebSocket
+from connection.serializer import loads
+from connection.socket_messages import BATCH, MESSAGE_CODES
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depende del entorno
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+SUBPROTOCOL = "lacosa.msgpack"
+DEFLATE = "deflate"
+DEFLATED = b"\xc1"
+# Frames recientes cuya codificación se recuerda
+CACHE_SIZE = 256
+
+# LACOSA_COMPRESS=0 ignora los pedidos de compresión
+COMPRESS = os.environ.get("LACOSA_COMPRESS", "1") != "0"
+COMPRESS_MIN_SIZE = int(os.environ.get("LACOSA_COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("LACOSA_COMPRESS_LEVEL", "6"))
+
+
+class Wire(NamedTuple):
+    encoding: str = JSON
+    compress: bool = False
+    subprotocol: str = None  # el que se acepta, si se pidió por subprotocolo
+
+
+def negotiate(websocket: WebSocket) -> Wire:
+    """Encoding and compression asked by the client"""
+    compress = COMPRESS and websocket.query_params.get("compress") == DEFLATE
+    if SUBPROTOCOL in websocket.scope.get("subprotocols", ()):
+        return Wire(MSGPACK, compress, SUBPROTOCOL)
+    if websocket.query_params.get("encoding") == MSGPACK:
+        return Wire(MSGPACK, compress)
+    return Wire(JSON, compress)
+
+
+class CompressionStats:
+    def __init__(self):
+        self.frames = 0  # frames enviados a sockets con compresión
+        self.compressed = 0
+        self.bytes_in = 0  # tamaño de los frames comprimidos antes
+        self.bytes_out = 0  # y después de comprimirlos
+
+    def record(self, size: int, compressed_size: int):
+        self.compressed += 1
+        self.bytes_in += size
+        self.bytes_out += compressed_size
+
+    def ratio(self) -> float:
+        """Compressed size over original size of the compressed frames"""
+        if self.bytes_in == 0:
+            return 0.0
+        return self.bytes_out / self.bytes_in
+
+    def as_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "compressed": self.compressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.ratio(),
+        }
+
+
+compression_stats = CompressionStats()
+
+
+# --------- MessagePack --------- #
+
+_UINTS = ((0xFF, 0xCC, ">B"), (0xFFFF, 0xCD, ">H"), (0xFFFFFFFF, 0xCE, ">I"))
+_INTS = ((0x7F, 0xD0, ">b"), (0x7FFF, 0xD1, ">h"), (0x7FFFFFFF, 0xD2, ">i"))
+
+
+def _pack_int(buffer: bytearray, value: int):
+    if -0x20 <= value < 0x80:
+        buffer += struct.pack(">b" if value < 0 else ">B", value)
+        return
+    for limit, code, fmt in _UINTS if value > 0 else _INTS:
+        if -limit - 1 <= value <= limit:
+            buffer.append(code)
+            buffer += struct.pack(fmt, value)
+            return
+    buffer.append(0xCF if value > 0 else 0xD3)
+    buffer += struct.pack(">Q" if value > 0 else ">q", value)
+
+
+def _pack_header(buffer: bytearray, size: int, fixed: int, fixed_max: int, codes):
+    """Header of a string, array or map of size elements"""
+    if size <= fixed_max:
+        buffer.append(fixed | size)
+        return
+    for limit, code, fmt in codes:
+        if size <= limit:
+            buffer.append(code)
+            buffer += struct.pack(fmt, size)
+            return
+    raise ValueError("Valor demasiado largo")
+
+
+_STR_CODES = ((0xFF, 0xD9, ">B"), (0xFFFF, 0xDA, ">H"), (0xFFFFFFFF, 0xDB, ">I"))
+_ARRAY_CODES = ((0xFFFF, 0xDC, ">H"), (0xFFFFFFFF, 0xDD, ">I"))
+_MAP_CODES = ((0xFFFF, 0xDE, ">H"), (0xFFFFFFFF, 0xDF, ">I"))
+
+
+def _pack_into(buffer: bytearray, value):
+    if value is None:
+        buffer.append(0xC0)
+    elif value is True:
+        buffer.append(0xC3)
+    elif value is False:
+        buffer.append(0xC2)
+    elif isinstance(value, int):
+        _pack_int(buffer, value)
+    elif isinstance(value, float):
+        buffer.append(0xCB)
+        buffer += struct.pack(">d", value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        _pack_header(buffer, len(data), 0xA0, 31, _STR_CODES)
+        buffer += data
+    elif isinstance(value, (list, tuple)):
+        _pack_header(buffer, len(value), 0x90, 15, _ARRAY_CODES)
+        for item in value:
+            _pack_into(buffer, item)
+    elif isinstance(value, dict):
+        _pack_header(buffer, len(value), 0x80, 15, _MAP_CODES)
+        for key, item in value.items():
+            _pack_into(buffer, key)
+            _pack_into(buffer, item)
+    else:
+        raise TypeError(f"No se puede codificar {type(value).__name__}")
+
+
+def _pack(value) -> bytes:
+    buffer = bytearray()
+    _pack_into(buffer, value)
+    return bytes(buffer)
+
+
+# Misma interfaz que msgpack.packb: objeto -> bytes
+pack = msgpack.packb if msgpack is not None else _pack
+
+
+# --------- Compact frames --------- #
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        if len(value) == 3 and "card_id" in value and "card_name" in value:
+            return value["card_id"]
+        return {key: _compact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def _compact_message(message: dict) -> list:
+    message_type = message["message_type"]
+    content = message["message_content"]
+    if message_type == BATCH:
+        content = [_compact_message(m) for m in content]
+    else:
+        content = _compact(content)
+    return [MESSAGE_CODES.get(message_type, message_type), content]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compact_frame(frame: str) -> bytes:
+    """Compact binary frame of an encoded JSON frame"""
+    return pack(_compact_message(loads(frame)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def deflate_frame(payload) -> tuple:
+    """Compressed binary frame of the payload, or the payload itself if it
+    doesn't shrink, and the payload size in bytes"""
+    data = payload.encode("utf-8") if isinstance(payload, str) else payload
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = DEFLATED + compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return payload, len(data)
+    return compressed, len(data)
+
+
+def _reaches_min_size(payload) -> bool:
+    """Whether the payload has COMPRESS_MIN_SIZE bytes or more"""
+    if len(payload) >= COMPRESS_MIN_SIZE:
+        return True
+    # Un carácter ocupa hasta 4 bytes en UTF-8: sólo se codifica el texto
+    # si podría llegar al mínimo
+    return (
+        isinstance(payload, str)
+        and len(payload) * 4 >= COMPRESS_MIN_SIZE
+        and len(payload.encode("utf-8")) >= COMPRESS_MIN_SIZE
+    )
+
+
+def wire_frame(wire: Wire, frame: str):
+    """Text or binary frame to send through a socket with the wire, for the
+    encoded JSON frame"""
+    payload = compact_frame(frame) if wire.encoding == MSGPACK else frame
+    if not wire.compress:
+        return payload
+    compression_stats.frames += 1
+    if not _reaches_min_size(payload):
+        return payload
+    sent, size = deflate_frame(payload)
+    if sent is not payload:
+        compression_stats.record(size, len(sent))
+    return sent
@@ -1,10 +1,15 @@
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
 
 class MatchListParams(BaseModel):
-    name: str
-    filter: str = "all"
+    filter: Literal["all", "open"] = "all"  # "open": sólo las no iniciadas y con lugar
+    name: Optional[str] = None  # parte del nombre de la partida
+    has_password: Optional[bool] = None
+    min_player_count: Optional[int] = None
+    max_player_count: Optional[int] = None
+    cursor: Optional[int] = None  # next_cursor de la página anterior
+    limit: Optional[int] = None  # None: todas las partidas
 
 
 class GameConfig(BaseModel):
@@ -27,3 +32,33 @@ class JoinMatch(BaseModel):
 class PlayerInMatch(BaseModel):
     player_name: str
     match_name: str
+
+
+# ----- Contenido de los mensajes del websocket de una partida -----
+# Ver connection/request_handler.py
+
+
+class ChatRequest(BaseModel):
+    message: str
+
+
+class ChatHistoryRequest(BaseModel):
+    before: Optional[int] = None  # None: la página más reciente
+
+
+class CardRequest(BaseModel):
+    card_id: int
+
+
+class PlayCardRequest(BaseModel):
+    card_id: int
+    # Nombre del jugador, o posición del obstáculo para el Hacha
+    target: Optional[Union[int, str]] = ""
+
+
+class RevelacionesRequest(BaseModel):
+    decision: Literal["omitir revelaciones", "revelar mano", "revelar carta"]
+
+
+class ResyncRequest(BaseModel):
+    logs_since: Optional[int] = None  # última entrada del registro que tiene